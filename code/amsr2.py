@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+Local store of AMSR2 sea ice concentration data
+
+Daily files from the University of Bremen sea ice data archive are ingested
+once into a single compressed HDF5 file with a time-stacked array
+of sea ice concentration and one shared grid of coordinates:
+
+    /lon   (y, x)        longitudes of the grid
+    /lat   (y, x)        latitudes of the grid
+    /date  (time,)       dates as YYYYMMDD integers (in order of ingestion)
+    /sic   (time, y, x)  ASI sea ice concentration, chunked by (1, 256, 256)
+
+so that reading one day over a small region reads only the relevant chunks.
+The store is meant to have one writer at a time (`ingest()`),
+reading functions open it in read-only mode.
+
+The store is modified whenever a date is added, so an empty stamp file
+is written next to it for each ingested date (see `date_stamp()`):
+outputs made from the data of one day depend on its stamp only.
+"""
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+import cartopy.crs as ccrs
+import h5py
+import numpy as np
+
+import mypaths
+import sat_tools
+
+LON_NAME = "Longitudes"
+LAT_NAME = "Latitudes"
+SIC_NAME = "ASI Ice Concentration"
+
+CHUNK_SIZE = 256
+STORE_COMPRESSION = dict(compression="gzip", compression_opts=4, shuffle=True)
+DATE_FMT = "%Y%m%d"
+# Number of coordinate grids and index windows kept in memory
+COORDS_CACHE_SIZE = 2
+WINDOW_CACHE_SIZE = 32
+# Projection of the Arctic grids (NSIDC polar stereographic, Hughes 1980 ellipsoid)
+GRID_CRS = ccrs.Stereographic(
+    central_latitude=90,
+    central_longitude=-45,
+    true_scale_latitude=70,
+    globe=ccrs.Globe(semimajor_axis=6378273, semiminor_axis=6356889.449),
+)
+# Maximum deviation of the grid from a regular one in `GRID_CRS` [grid cells]
+GRID_TOLERANCE = 0.25
+
+
+def read_hdf(filename, names):
+    """
+    Read datasets from an HDF4 or HDF5 file
+
+    HDF4 files (as distributed by the University of Bremen) are read directly
+    using the `pyhdf` package, so conversion with `h4toh5` is not needed.
+
+    Arguments
+    ---------
+    filename: str or path-like
+        Path to the file
+    names: sequence of str
+        Names of the datasets
+
+    Returns
+    -------
+    List of numpy arrays
+    """
+    filename = Path(filename)
+    if h5py.is_hdf5(filename):
+        with h5py.File(filename, "r") as f:
+            return [f[name][()] for name in names]
+
+    try:
+        from pyhdf.SD import SD, SDC
+    except ImportError:
+        raise ImportError(f"pyhdf package is required to read {filename}")
+    sd = SD(str(filename), SDC.READ)
+    try:
+        return [sd.select(name)[:] for name in names]
+    finally:
+        sd.end()
+
+
+def store_path(store_dir=None, res="n6250"):
+    """Path to the AMSR2 store file"""
+    if store_dir is None:
+        store_dir = mypaths.amsr2_dir
+    return store_dir / f"asi-AMSR2-{res}-Arctic-store.h5"
+
+
+def date_stamp(dt, store_dir=None, res="n6250"):
+    """
+    Path to the stamp file of a date in the store
+
+    The file is written when the data of the date are ingested, so its
+    modification time can be compared with those of outputs made from them.
+    """
+    target = store_path(store_dir=store_dir, res=res)
+    return target.parent / "stamps" / f"{target.stem}-{dt:{DATE_FMT}}"
+
+
+def _date_key(dt):
+    return int(f"{dt:{DATE_FMT}}")
+
+
+def _find_local_file(url, download_dir):
+    """Find a file downloaded earlier (and possibly converted to HDF5)"""
+    hdf4_file = download_dir / Path(url).name
+    for candidate in (hdf4_file.with_suffix(".h5"), hdf4_file):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def raw_file(dt, download_dir=None, res="n6250"):
+    """
+    Path to the original file of a date downloaded earlier
+    (HDF4 or HDF5, see `ingest()`), None if there is none
+
+    `download_dir` defaults to `mypaths.amsr2_dir`.
+    """
+    if download_dir is None:
+        download_dir = mypaths.amsr2_dir
+    return _find_local_file(sat_tools.amsr2_data_url(dt, res=res), download_dir)
+
+
+def _create_store(f, lons, lats):
+    f.create_dataset("lon", data=lons, **STORE_COMPRESSION)
+    f.create_dataset("lat", data=lats, **STORE_COMPRESSION)
+    f.create_dataset("date", shape=(0,), maxshape=(None,), dtype="i4")
+    ny, nx = lons.shape
+    f.create_dataset(
+        "sic",
+        shape=(0, ny, nx),
+        maxshape=(None, ny, nx),
+        dtype="f4",
+        chunks=(1, min(CHUNK_SIZE, ny), min(CHUNK_SIZE, nx)),
+        fillvalue=np.nan,
+        **STORE_COMPRESSION,
+    )
+
+
+def ingest(dts, store_dir=None, res="n6250", download_dir=None, keep_raw=False):
+    """
+    Add AMSR2 data for the given dates to the store
+
+    Dates that are already in the store are skipped, and a stamp is
+    written for each new date (see `date_stamp()`). Files found in
+    `download_dir` (HDF4 or HDF5 converted by `h4toh5`) are used as is,
+    the rest are downloaded in one parallel job and removed after ingestion
+    unless `keep_raw` is True.
+
+    Arguments
+    ---------
+    dts: sequence of datetime.datetime
+        Dates of the required sea ice data
+    store_dir: pathlib.Path, optional
+        Directory of the store; defaults to `mypaths.amsr2_dir`
+    res: str, optional
+        Resolution ([n|s][2500|3125|6250|12500])
+    download_dir: pathlib.Path, optional
+        Directory for the original files; defaults to `store_dir`
+    keep_raw: bool, optional
+        Keep the downloaded files
+
+    Returns
+    -------
+    Path to the store
+    """
+    target = store_path(store_dir=store_dir, res=res)
+    if download_dir is None:
+        download_dir = target.parent
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    # Opening the file for writing changes its modification time,
+    # so check first if there is anything to add
+    if target.is_file():
+        stored = set(map(_date_key, stored_dates(store_dir=store_dir, res=res)))
+        if stored.issuperset(map(_date_key, dts)):
+            return target
+
+    with h5py.File(target, "a") as f:
+        stored = set(f["date"][()].tolist()) if "date" in f else set()
+        new_dts = []
+        for dt in sorted(dts):
+            if _date_key(dt) not in stored:
+                stored.add(_date_key(dt))
+                new_dts.append(dt)
+        if "lon" in f and len(new_dts) == 0:
+            return target
+
+        # Look up local files first and download the rest in parallel
+        urls = [sat_tools.amsr2_coords_url(res)] * ("lon" not in f)
+        urls += [sat_tools.amsr2_data_url(dt, res=res) for dt in new_dts]
+        files = [_find_local_file(url, download_dir) for url in urls]
+        missing = [url for url, fname in zip(urls, files) if fname is None]
+        downloaded = sat_tools.download_many(missing, save_dir=download_dir)
+        downloaded = dict(zip(missing, downloaded))
+        files = [downloaded.get(url, fname) for url, fname in zip(urls, files)]
+
+        if "lon" not in f:
+            lons, lats = read_hdf(files.pop(0), [LON_NAME, LAT_NAME])
+            _create_store(f, lons, lats)
+
+        for dt, fname in zip(new_dts, files):
+            (data,) = read_hdf(fname, [SIC_NAME])
+            n = f["date"].shape[0]
+            f["date"].resize((n + 1,))
+            f["sic"].resize((n + 1, *f["sic"].shape[1:]))
+            f["date"][n] = _date_key(dt)
+            f["sic"][n] = data
+
+    for dt in new_dts:
+        stamp = date_stamp(dt, store_dir=store_dir, res=res)
+        stamp.parent.mkdir(exist_ok=True)
+        stamp.touch()
+    if not keep_raw:
+        for fname in downloaded.values():
+            fname.unlink()
+    return target
+
+
+def stored_dates(store_dir=None, res="n6250"):
+    """Sorted list of dates available in the store"""
+    target = store_path(store_dir=store_dir, res=res)
+    if not target.is_file():
+        return []
+    with h5py.File(target, "r") as f:
+        keys = sorted(f["date"][()].tolist())
+    return [datetime.strptime(str(key), DATE_FMT) for key in keys]
+
+
+def read_coords(store_dir=None, res="n6250", window=None):
+    """
+    Read longitudes and latitudes of the grid
+
+    Arguments
+    ---------
+    store_dir: pathlib.Path, optional
+        Directory of the store; defaults to `mypaths.amsr2_dir`
+    res: str, optional
+        Resolution ([n|s][2500|3125|6250|12500])
+    window: tuple of slice, optional
+        Sub-region of the grid (y, x)
+
+    Returns
+    -------
+    lons, lats: numpy arrays
+    """
+    if window is None:
+        window = (slice(None), slice(None))
+    with h5py.File(store_path(store_dir=store_dir, res=res), "r") as f:
+        return f["lon"][window], f["lat"][window]
+
+
+def read_sic(start, end=None, store_dir=None, res="n6250", window=None):
+    """
+    Read sea ice concentration for a range of dates from the store
+
+    Only the chunks covering the requested dates and sub-region are read.
+
+    Arguments
+    ---------
+    start: datetime.datetime
+        First date
+    end: datetime.datetime, optional
+        Last date (inclusive); defaults to `start`
+    store_dir: pathlib.Path, optional
+        Directory of the store; defaults to `mypaths.amsr2_dir`
+    res: str, optional
+        Resolution ([n|s][2500|3125|6250|12500])
+    window: tuple of slice, optional
+        Sub-region of the grid (y, x)
+
+    Returns
+    -------
+    dates: list of datetime.datetime
+        Dates found in the store, sorted
+    data: numpy array
+        Sea ice concentration of shape (time, y, x)
+    """
+    if end is None:
+        end = start
+    if window is None:
+        window = (slice(None), slice(None))
+    with h5py.File(store_path(store_dir=store_dir, res=res), "r") as f:
+        keys = f["date"][()]
+        (idx,) = np.nonzero((keys >= _date_key(start)) & (keys <= _date_key(end)))
+        assert len(idx) > 0, f"No AMSR2 data for {start:%Y-%m-%d}-{end:%Y-%m-%d}"
+        # h5py needs increasing indices, so sort by time afterwards
+        data = f["sic"][(idx, *window)]
+    order = np.argsort(keys[idx], kind="stable")
+    dates = [datetime.strptime(str(key), DATE_FMT) for key in keys[idx][order]]
+    return dates, data[order]
+
+
+@lru_cache(maxsize=COORDS_CACHE_SIZE)
+def _cached_coords(target):
+    with h5py.File(target, "r") as f:
+        lons, lats = f["lon"][()], f["lat"][()]
+    # the arrays are shared between calls, so protect them from changes
+    lons.flags.writeable = False
+    lats.flags.writeable = False
+    return lons, lats
+
+
+def get_coords(store_dir=None, res="n6250"):
+    """
+    Get longitudes and latitudes of the grid
+
+    The grid never changes, so it is read from the store only once
+    per process and then kept in a (size-limited) cache.
+
+    Returns
+    -------
+    lons, lats: read-only numpy arrays
+    """
+    return _cached_coords(str(store_path(store_dir=store_dir, res=res)))
+
+
+@lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def _cached_window(target, bbox, crs, margin):
+    lons, lats = _cached_coords(target)
+    if crs is None:
+        x, y = lons, lats
+    else:
+        xyz = crs.transform_points(ccrs.Geodetic(), lons, lats)
+        x, y = xyz[..., 0], xyz[..., 1]
+    x0, x1, y0, y1 = bbox
+    inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+    (rows,) = np.nonzero(inside.any(axis=1))
+    (cols,) = np.nonzero(inside.any(axis=0))
+    assert len(rows) > 0, f"AMSR2 grid does not intersect {bbox}"
+    return (
+        slice(max(rows[0] - margin, 0), rows[-1] + margin + 1),
+        slice(max(cols[0] - margin, 0), cols[-1] + margin + 1),
+    )
+
+
+def get_window(bbox, crs=None, store_dir=None, res="n6250", margin=2):
+    """
+    Get the index window of the grid covering a bounding box
+
+    Windows are cached, so repeated calls for the same region are free.
+
+    Arguments
+    ---------
+    bbox: sequence
+        Bounding box (x0, x1, y0, y1), in degrees of longitude and latitude
+        or in coordinates of `crs`
+    crs: cartopy.crs.Projection, optional
+        Projection of the bounding box, e.g. the projection of the map
+    store_dir: pathlib.Path, optional
+        Directory of the store; defaults to `mypaths.amsr2_dir`
+    res: str, optional
+        Resolution ([n|s][2500|3125|6250|12500])
+    margin: int, optional
+        Number of extra grid cells on each side of the window,
+        so that contours reach the edges of the bounding box
+
+    Returns
+    -------
+    window: tuple of slice
+        Sub-region of the grid (y, x)
+    """
+    target = str(store_path(store_dir=store_dir, res=res))
+    return _cached_window(target, tuple(bbox), crs, margin)
+
+
+def get_amsr2(dt, store_dir=None, res="n6250", mask_invalid=True, bbox=None, crs=None):
+    """
+    Get AMSR2 data and matching coordinates for one day
+
+    The data are added to the store first if needed (see `ingest()`).
+    If `bbox` is given, only the part of the grid covering it is read
+    (see `get_window()` for details).
+
+    Returns
+    -------
+    lons, lats, data: numpy arrays
+    """
+    if _date_key(dt) not in map(_date_key, stored_dates(store_dir, res=res)):
+        ingest([dt], store_dir=store_dir, res=res)
+    lons, lats = get_coords(store_dir=store_dir, res=res)
+    window = (slice(None), slice(None))
+    if bbox is not None:
+        window = get_window(bbox, crs=crs, store_dir=store_dir, res=res)
+    dates, data = read_sic(dt, store_dir=store_dir, res=res, window=window)
+    data = data[0]
+    if mask_invalid:
+        data = np.ma.masked_invalid(data)
+    return lons[window], lats[window], data
+
+
+@lru_cache(maxsize=COORDS_CACHE_SIZE)
+def _cached_grid_transform(target):
+    lons, lats = _cached_coords(target)
+    xyz = GRID_CRS.transform_points(ccrs.Geodetic(), lons, lats)
+    x, y = xyz[..., 0], xyz[..., 1]
+    ny, nx = x.shape
+    x0, y0 = x[0, 0], y[0, 0]
+    dx = (x[0, -1] - x0) / (nx - 1)
+    dy = (y[-1, 0] - y0) / (ny - 1)
+    rows, cols = np.mgrid[:ny, :nx]
+    error = max(
+        np.nanmax(np.abs(x - x0 - cols * dx)) / abs(dx),
+        np.nanmax(np.abs(y - y0 - rows * dy)) / abs(dy),
+    )
+    assert error < GRID_TOLERANCE, f"AMSR2 grid is not regular in GRID_CRS: {error}"
+    return x0, dx, y0, dy, ny, nx
+
+
+def grid_transform(store_dir=None, res="n6250"):
+    """
+    Get the regular grid of the store in `GRID_CRS` coordinates
+
+    The grid is checked against the stored longitudes and latitudes
+    once per process.
+
+    Returns
+    -------
+    x0, dx, y0, dy: float
+        Coordinates of the centre of the first cell and the grid steps
+    ny, nx: int
+        Shape of the grid
+    """
+    assert res.startswith("n"), "Only Arctic grids are supported"
+    return _cached_grid_transform(str(store_path(store_dir=store_dir, res=res)))
+
+
+def grid_index(lons, lats, store_dir=None, res="n6250"):
+    """
+    Find the grid cells containing points in one vectorized operation
+
+    Returns
+    -------
+    rows, cols: numpy arrays of int
+        Indices of the cells (-1 for points outside the grid)
+    """
+    x0, dx, y0, dy, ny, nx = grid_transform(store_dir=store_dir, res=res)
+    xyz = GRID_CRS.transform_points(
+        ccrs.Geodetic(), np.asarray(lons, dtype="f8"), np.asarray(lats, dtype="f8")
+    )
+    rows = np.rint((xyz[..., 1] - y0) / dy)
+    cols = np.rint((xyz[..., 0] - x0) / dx)
+    inside = (rows >= 0) & (rows < ny) & (cols >= 0) & (cols < nx)
+    rows = np.where(inside, rows, -1).astype(int)
+    cols = np.where(inside, cols, -1).astype(int)
+    return rows, cols
+
+
+def sample_sic(lons, lats, dt, store_dir=None, res="n6250"):
+    """
+    Get sea ice concentration of one day at given points
+
+    Only the part of the grid covering the points is read from the store.
+
+    Arguments
+    ---------
+    lons, lats: numpy arrays
+        Coordinates of the points
+    dt: datetime.datetime
+        Date
+    store_dir: pathlib.Path, optional
+        Directory of the store; defaults to `mypaths.amsr2_dir`
+    res: str, optional
+        Resolution ([n][2500|3125|6250|12500])
+
+    Returns
+    -------
+    numpy array of float32 (NaN for points outside the grid or without data)
+    """
+    if _date_key(dt) not in map(_date_key, stored_dates(store_dir, res=res)):
+        ingest([dt], store_dir=store_dir, res=res)
+    rows, cols = grid_index(lons, lats, store_dir=store_dir, res=res)
+    inside = rows >= 0
+    sic = np.full(rows.shape, np.nan, dtype="f4")
+    if not inside.any():
+        return sic
+    r0, r1 = rows[inside].min(), rows[inside].max() + 1
+    c0, c1 = cols[inside].min(), cols[inside].max() + 1
+    _, data = read_sic(
+        dt, store_dir=store_dir, res=res, window=(slice(r0, r1), slice(c0, c1))
+    )
+    sic[inside] = data[0][rows[inside] - r0, cols[inside] - c0]
+    return sic
@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the satellite, map and flight track code
+
+Synthetic inputs resembling the campaign data are generated once
+in a fixtures directory (see `make_fixtures()`):
+
+    geotiff       full-size polar stereographic image like the Dundee ones
+    dundee/       day archive with hundreds of images named like the Dundee ones
+    amsr2/        AMSR2 grid coordinates and sea ice concentration (HDF5)
+    masin/        1 Hz MASIN file of a flight
+    nmea/         NMEA log of a day (about 20 MB)
+
+Each stage runs in a fresh process, so that caches and memory of one stage
+do not affect the others. Stages are run `repeat` times after an untimed
+setup, and then once more with `tracemalloc` to get the peak memory
+allocated by Python and numpy (memory allocated by GDAL or HDF5 is only
+seen in the maximum resident set size of the process).
+
+Results are appended to a JSON lines file, one record per stage tagged with
+the git commit, so that the same stages can be compared across commits:
+
+    python bench.py                      # all stages
+    python bench.py read_raster_stereo   # selected stages
+    python bench.py --list
+    python bench.py --compare HEAD~1     # compare with results of a commit
+"""
+import argparse
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
+import gc
+import json
+import multiprocessing
+from pathlib import Path
+import platform
+import resource
+import shutil
+import statistics
+import subprocess as sb
+import sys
+import tempfile
+import time
+import tracemalloc
+from zipfile import ZIP_STORED, ZipFile
+
+import numpy as np
+
+import mypaths
+
+# Bump the version if the fixtures change
+FIXTURE_VERSION = 1
+# Date and flight of the fixtures (must be in `common_defs.FLIGHTS`)
+FIXTURE_DATE = datetime(2018, 3, 1)
+FLIGHT_ID = "293"
+# Satellite image options used by the stages
+SAT_OPT = dict(instrument="viirs", platform="npp", channel="m05")
+# Dundee images: projection, size and position of the grid
+GEOTIFF_CRS = "+proj=stere +lat_0=90 +lon_0=-45 +lat_ts=70 +x_0=0 +y_0=0 +datum=WGS84"
+GEOTIFF_SIZE = 3000  # pixels
+GEOTIFF_RES = 500  # m
+GEOTIFF_ORIGIN = (300e3, -1400e3)  # upper left corner, m
+# Day archive: passes of each satellite (about one orbit period apart)
+# with two granules per pass; images of other options than `SAT_OPT`
+# are smaller to keep the archive size reasonable
+ORBIT_PERIOD = timedelta(minutes=101)
+GRANULE_STEP = timedelta(minutes=3)
+SMALL_IMAGE_SIZE = GEOTIFF_SIZE // 8
+# AMSR2 n6250 Arctic grid
+AMSR2_SHAPE = (1792, 1216)
+AMSR2_ORIGIN = (-3850e3, 5850e3)
+AMSR2_RES = 6250
+# Number of extra (unused) variables in the MASIN file
+MASIN_EXTRA_VARS = 40
+# Map of the flight track figures (see `flight_track_over_sat_image.py`)
+MAP_KW = dict(extent=[-26, -11, 63, 72], ticks=[3, 1])
+MAP_COAST = dict(scale="50m", facecolor="none", edgecolor="C8", alpha=0.75)
+
+# Stage name -> function preparing the stage, see `stage()`
+STAGES = {}
+
+
+def stage(name):
+    """
+    Register a benchmark stage
+
+    The decorated function takes the paths of the fixtures (see
+    `fixture_paths()`), does all the untimed setup, and returns
+    a function without arguments that does the timed work.
+    """
+
+    def register(func):
+        STAGES[name] = func
+        return func
+
+    return register
+
+
+def fixture_paths(fixtures_dir):
+    """Paths to the fixtures in a given directory"""
+    return dict(
+        geotiff=fixtures_dir / "geotiff" / "image.tif",
+        dundee_dir=fixtures_dir / "dundee",
+        day_zip=fixtures_dir / "dundee" / f"{FIXTURE_DATE:%Y%m%d}.zip",
+        amsr2_dir=fixtures_dir / "amsr2",
+        masin_dir=fixtures_dir / "masin",
+        nmea_log=fixtures_dir / "nmea" / f"{FIXTURE_DATE:%Y%m%d}.log",
+    )
+
+
+#
+# Fixtures
+#
+def _image_data(size, edge):
+    """Smooth pattern with an empty (0) swath edge"""
+    yy, xx = np.ogrid[:size, :size]
+    data = (128 + 100 * np.sin(xx / 97) * np.cos(yy / 53)).astype("u1")
+    data[:, :edge] = 0
+    return data
+
+
+def _geotiff_bytes(data):
+    """Encode an image as a GeoTIFF on the Dundee grid"""
+    import rasterio
+    from rasterio.io import MemoryFile
+    from rasterio.transform import from_origin
+
+    res = GEOTIFF_RES * GEOTIFF_SIZE / data.shape[0]
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=data.shape[1],
+            height=data.shape[0],
+            count=1,
+            dtype=data.dtype,
+            crs=rasterio.crs.CRS.from_proj4(GEOTIFF_CRS),
+            transform=from_origin(*GEOTIFF_ORIGIN, res, res),
+            nodata=0,
+        ) as dst:
+            dst.write(data, 1)
+        return memfile.read()
+
+
+def _make_day_zip(target):
+    """Day archive with images of all satellite options"""
+    import sat_tools
+
+    day = FIXTURE_DATE.strftime("%Y%m%d")
+    with ZipFile(target, "w", compression=ZIP_STORED) as z:
+        for k, (instrument, opts) in enumerate(
+            sat_tools.get_avail_sat_img_opt().items()
+        ):
+            for opt in opts:
+                full_size = dict(instrument=instrument, **opt) == SAT_OPT
+                size = GEOTIFF_SIZE if full_size else SMALL_IMAGE_SIZE
+                n_passes = int(timedelta(days=1) / ORBIT_PERIOD)
+                for i in range(n_passes):
+                    start = FIXTURE_DATE + i * ORBIT_PERIOD + k * GRANULE_STEP
+                    for j in range(2):
+                        dt = start + j * GRANULE_STEP
+                        edge = (i * 397 + j * 701) % (size // 2)
+                        z.writestr(
+                            f"{day}/{opt['platform']}_{instrument}_{opt['channel']}"
+                            f"_{dt:%Y%m%d_%H%M%S}_mapping6_500.tif",
+                            _geotiff_bytes(_image_data(size, edge)),
+                        )
+
+
+def _make_amsr2(target_dir):
+    """AMSR2 coordinates and sea ice concentration named like the downloads"""
+    import cartopy.crs as ccrs
+    import h5py
+
+    import amsr2
+    import sat_tools
+
+    ny, nx = AMSR2_SHAPE
+    x = AMSR2_ORIGIN[0] + AMSR2_RES * (np.arange(nx) + 0.5)
+    y = AMSR2_ORIGIN[1] - AMSR2_RES * (np.arange(ny) + 0.5)
+    xx, yy = np.meshgrid(x, y)
+    lonlat = ccrs.Geodetic().transform_points(amsr2.GRID_CRS, xx, yy)
+    lons, lats = lonlat[..., 0], lonlat[..., 1]
+
+    coords_file = Path(sat_tools.amsr2_coords_url()).with_suffix(".h5").name
+    with h5py.File(target_dir / coords_file, "w") as f:
+        f[amsr2.LON_NAME] = lons
+        f[amsr2.LAT_NAME] = lats
+    data_file = Path(sat_tools.amsr2_data_url(FIXTURE_DATE)).with_suffix(".h5").name
+    with h5py.File(target_dir / data_file, "w") as f:
+        sic = np.clip((lats - 66) * 30 + 5 * np.sin(np.deg2rad(lons) * 7), 0, 100)
+        sic[lats < 55] = np.nan
+        f[amsr2.SIC_NAME] = sic.astype("f4")
+
+
+def _make_masin(target_dir):
+    """1 Hz MASIN file of a 5-hour flight around the Iceland Sea"""
+    import xarray as xr
+
+    import masin
+
+    target = masin.masin_file(FLIGHT_ID, masin_dir=target_dir)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    n = 5 * 3600
+    s = np.linspace(0, 1, n)
+    alt = 1000 + 800 * np.sin(20 * s)
+    alt[:60] = np.nan
+    dims = ("data_point",)
+    data_vars = dict(
+        Time=(
+            dims,
+            np.arange(11 * 3600, 11 * 3600 + n, dtype="f8"),
+            {"units": f"seconds since {FIXTURE_DATE:%Y-%m-%d} 00:00:00 +0000"},
+        ),
+        LON_OXTS=(dims, -20 + 3 * np.sin(6 * s), {"units": "degree_east"}),
+        LAT_OXTS=(dims, 67 + 2 * s, {"units": "degree_north"}),
+        ALT_OXTS=(dims, alt, {"units": "m "}),
+    )
+    rng = np.random.default_rng(0)
+    for i in range(MASIN_EXTRA_VARS):
+        data_vars[f"VAR{i:02d}"] = (dims, rng.standard_normal(n).astype("f4"))
+    xr.Dataset(data_vars).to_netcdf(target)
+
+
+def _make_nmea(target):
+    """NMEA log of a day: GGA, HDT, MWV and VTG sentences every second"""
+    import nmea
+
+    epoch = FIXTURE_DATE.replace(tzinfo=timezone.utc).timestamp()
+    lines = []
+    for i in range(24 * 3600):
+        hh, mm, ss = i // 3600, (i // 60) % 60, i % 60
+        stamp = f"{epoch + i:.2f} "
+        bodies = [
+            f"GPGGA,{hh:02d}{mm:02d}{ss:02d}.00,{6630 + i * 1e-4:.4f},N,"
+            f"{1830 + i * 1e-4:.4f},W,1,08,0.9,12.3,M,60.1,M,,",
+            f"HEHDT,{i * 0.7 % 360:.1f},T",
+            f"WIMWV,{i * 3 % 360:.1f},R,{5 + i % 7 * 0.5:.1f},N,A",
+            "GPVTG,054.7,T,034.4,M,005.5,N,010.2,K",
+        ]
+        lines.extend((stamp, body) for body in bodies)
+    sums = nmea.checksum([body for _, body in lines])
+    with target.open("w", newline="") as f:
+        f.writelines(
+            f"{stamp}${body}*{cs:02X}\r\n" for (stamp, body), cs in zip(lines, sums)
+        )
+
+
+def make_fixtures(fixtures_dir, force=False):
+    """
+    Generate the synthetic inputs (if they are missing or out of date)
+
+    Returns
+    -------
+    dict of fixture name -> path (see `fixture_paths()`)
+    """
+    paths = fixture_paths(fixtures_dir)
+    stamp_file = fixtures_dir / "fixtures.json"
+    stamp = dict(version=FIXTURE_VERSION, geotiff_size=GEOTIFF_SIZE)
+    if not force and stamp_file.is_file():
+        with stamp_file.open("r") as f:
+            if json.load(f) == stamp:
+                return paths
+
+    print(f"Generating fixtures in {fixtures_dir}")
+    shutil.rmtree(fixtures_dir, ignore_errors=True)
+    for key in ("geotiff", "day_zip", "nmea_log"):
+        paths[key].parent.mkdir(parents=True, exist_ok=True)
+    for key in ("amsr2_dir", "masin_dir"):
+        paths[key].mkdir(parents=True, exist_ok=True)
+    paths["geotiff"].write_bytes(
+        _geotiff_bytes(_image_data(GEOTIFF_SIZE, GEOTIFF_SIZE // 8))
+    )
+    _make_day_zip(paths["day_zip"])
+    _make_amsr2(paths["amsr2_dir"])
+    _make_masin(paths["masin_dir"])
+    _make_nmea(paths["nmea_log"])
+    with stamp_file.open("w") as f:
+        json.dump(stamp, f)
+    return paths
+
+
+#
+# Stages
+#
+@stage("read_raster_stereo")
+def _read_raster_full(fx):
+    """Read a full-size image"""
+    import sat_tools
+
+    return lambda: sat_tools.read_raster_stereo(fx["geotiff"])
+
+
+@stage("read_raster_stereo_map")
+def _read_raster_map(fx):
+    """Read the part of an image in the day archive within the map"""
+    import cart
+    import sat_tools
+
+    index = sat_tools.get_sat_index(fx["day_zip"])
+    member = sat_tools.zip_member_path(
+        fx["day_zip"],
+        f"{FIXTURE_DATE:%Y%m%d}/{index[sat_tools.sat_opt_key(**SAT_OPT)][1][6]}",
+    )
+    proj = cart.igp_projection()
+    extent = cart.project_extent(MAP_KW["extent"], proj)
+    return lambda: sat_tools.read_raster_stereo(member, extent=extent, extent_crs=proj)
+
+
+@stage("get_nearest_zfile")
+def _get_nearest_zfile(fx):
+    """Find the nearest image for each hour of the day (cold index)"""
+    import sat_tools
+
+    sat_tools._SAT_INDEX_CACHE.clear()
+    shutil.rmtree(mypaths.cache_dir / "sat_index", ignore_errors=True)
+
+    def run():
+        for hour in range(24):
+            sat_tools.get_nearest_zfile(
+                fx["day_zip"], FIXTURE_DATE + timedelta(hours=hour), **SAT_OPT
+            )
+
+    return run
+
+
+@stage("footprints")
+def _footprints(fx):
+    """Extract footprints of all images in the day archive (cold cache)"""
+    import footprints
+
+    shutil.rmtree(mypaths.cache_dir / "footprints", ignore_errors=True)
+    return lambda: footprints.get_footprints(fx["day_zip"])
+
+
+@stage("amsr2_ingest")
+def _amsr2_ingest(fx):
+    """Add a day of AMSR2 data to an empty store"""
+    import amsr2
+
+    shutil.rmtree(mypaths.amsr2_dir, ignore_errors=True)
+    return lambda: amsr2.ingest(
+        [FIXTURE_DATE], download_dir=fx["amsr2_dir"], keep_raw=True
+    )
+
+
+@stage("get_amsr2")
+def _get_amsr2(fx):
+    """Read AMSR2 data within the map (cold coordinate caches)"""
+    import amsr2
+    import cart
+    import sat_tools
+
+    amsr2.ingest([FIXTURE_DATE], download_dir=fx["amsr2_dir"], keep_raw=True)
+    amsr2._cached_coords.cache_clear()
+    amsr2._cached_window.cache_clear()
+    proj = cart.igp_projection()
+    bbox = cart.project_extent(MAP_KW["extent"], proj)
+    return lambda: sat_tools.get_amsr2(FIXTURE_DATE, bbox=bbox, crs=proj)
+
+
+@stage("masin_load_track")
+def _masin_load_track(fx):
+    """Load a flight track"""
+    import masin
+
+    return lambda: masin.load_track(FLIGHT_ID)
+
+
+@stage("masin_simplify_track")
+def _masin_simplify_track(fx):
+    """Simplify a flight track in the map projection"""
+    import cart
+    import masin
+
+    track = masin.load_track(FLIGHT_ID)
+    proj = cart.igp_projection()
+    return lambda: masin.simplify_track(track, crs=proj)
+
+
+@stage("overview_layers")
+def _overview_layers(fx):
+    """Prepare the layers of overview maps from the track store (built)"""
+    import overview
+
+    overview.make_layers([FLIGHT_ID], sea_ice=False)
+    return lambda: overview.make_layers([FLIGHT_ID], sea_ice=False)
+
+
+@stage("nmea_read_log")
+def _nmea_read_log(fx):
+    """Parse a day of NMEA log (without the cache)"""
+    import nmea
+
+    return lambda: nmea.read_log(fx["nmea_log"], use_cache=False)
+
+
+@stage("mosaic_scene")
+def _mosaic_scene(fx):
+    """Reproject an image of the day archive to the map grid (cold cache)"""
+    import mosaic
+    import sat_tools
+
+    index = sat_tools.get_sat_index(fx["day_zip"])
+    zfile = f"{FIXTURE_DATE:%Y%m%d}/{index[sat_tools.sat_opt_key(**SAT_OPT)][1][6]}"
+
+    def run():
+        shutil.rmtree(mosaic.mosaic_dir(fx["day_zip"]), ignore_errors=True)
+        mosaic.get_scene(fx["day_zip"], zfile)
+
+    return run
+
+
+@stage("mosaic_read_window")
+def _mosaic_read_window(fx):
+    """Read the part of a reprojected image within the map"""
+    import cart
+    import mosaic
+    import sat_tools
+
+    index = sat_tools.get_sat_index(fx["day_zip"])
+    zfile = f"{FIXTURE_DATE:%Y%m%d}/{index[sat_tools.sat_opt_key(**SAT_OPT)][1][6]}"
+    fname = mosaic.get_scene(fx["day_zip"], zfile)
+    bbox = cart.project_extent(MAP_KW["extent"], cart.igp_projection())
+    return lambda: mosaic.read_window(fname, bbox)
+
+
+def _new_map():
+    import matplotlib.pyplot as plt
+
+    import cart
+
+    fig = plt.figure(figsize=(12, 8))
+    cart.ukmo_igp_map(fig, coast=MAP_COAST, **MAP_KW)
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+@stage("ukmo_igp_map")
+def _ukmo_igp_map(fx):
+    """Create and draw a map (cold coastline and tick caches)"""
+    import cart
+
+    cart._land_geometries.cache_clear()
+    cart._MAP_TICKS.clear()
+    return _new_map
+
+
+@stage("ukmo_igp_map_warm")
+def _ukmo_igp_map_warm(fx):
+    """Create and draw a map after another one with the same parameters"""
+    _new_map()
+    return _new_map
+
+
+def _flight_track_config(fx):
+    """Configuration of the flight track figures (without sea ice)"""
+    import flight_track_over_sat_image as ft
+
+    return ft.make_config(
+        dict(sea_ice=None),
+        flights=[FLIGHT_ID],
+        sat_opts=[SAT_OPT],
+        arch_dir=fx["dundee_dir"],
+        masin_dir=fx["masin_dir"],
+    )
+
+
+@stage("flight_track_tasks")
+def _flight_track_tasks(fx):
+    """List the figures of a flight (cached footprints)"""
+    import footprints
+    import flight_track_over_sat_image as ft
+
+    footprints.get_footprints(fx["day_zip"])
+    cfg = _flight_track_config(fx)
+    return lambda: ft.make_tasks(cfg)
+
+
+@stage("flight_track_figure")
+def _flight_track_figure(fx):
+    """
+    Render a flight track figure without sea ice (see `get_amsr2`)
+    from a reprojected image (see `mosaic_scene`)
+    """
+    import cart
+    import flight_track_over_sat_image as ft
+
+    cfg = _flight_track_config(fx)
+    task = ft.make_tasks(cfg)[0]
+    ft._get_mosaic(cfg, task)
+    cart._land_geometries.cache_clear()
+    cart._MAP_TICKS.clear()
+    return lambda: ft.plotter(cfg, task)
+
+
+#
+# Running
+#
+def _max_rss_mb():
+    """Maximum resident set size of this process [MiB]"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def measure(name, fixtures_dir, work_dir, repeat=3):
+    """
+    Run a stage (in a fresh process, see `run_stages()`)
+
+    Returns
+    -------
+    dict
+        times: wall times of the runs [s]
+        peak_traced_mb: peak memory traced by `tracemalloc` [MiB]
+        max_rss_mb: maximum resident set size of the process [MiB]
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    # Derived files go to the work directory, inputs are the fixtures
+    fx = fixture_paths(fixtures_dir)
+    mypaths.cache_dir = work_dir / "cache"
+    mypaths.plotdir = work_dir / "figures"
+    mypaths.amsr2_dir = work_dir / "amsr2"
+    mypaths.dundee_dir = fx["dundee_dir"]
+    mypaths.masin_dir = fx["masin_dir"]
+    mypaths.nmea_dir = fx["nmea_log"].parent
+
+    times = []
+    for _ in range(repeat):
+        func = STAGES[name](fx)
+        gc.collect()
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    max_rss = _max_rss_mb()
+
+    func = STAGES[name](fx)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(times=times, peak_traced_mb=peak / 2**20, max_rss_mb=max_rss)
+
+
+def git_commit():
+    """Short hash of the current commit and whether the tree has changes"""
+    cwd = Path(__file__).parent
+    try:
+        commit = sb.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        changes = sb.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, sb.CalledProcessError):
+        return None, None
+    return commit, bool(changes)
+
+
+def run_stages(names, fixtures_dir, results_file, repeat=3):
+    """
+    Run stages one by one in fresh processes and append their results
+    to a JSON lines file
+
+    Returns
+    -------
+    records: list of dict
+    """
+    commit, dirty = git_commit()
+    context = multiprocessing.get_context("spawn")
+    records = []
+    for name in names:
+        record = dict(
+            stage=name,
+            commit=commit,
+            dirty=dirty,
+            date=f"{datetime.now(timezone.utc):%Y-%m-%dT%H:%M:%SZ}",
+            host=platform.node(),
+            python=platform.python_version(),
+            repeat=repeat,
+        )
+        with tempfile.TemporaryDirectory(prefix="bench_") as work_dir:
+            with concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=context
+            ) as executor:
+                future = executor.submit(
+                    measure, name, fixtures_dir, Path(work_dir), repeat
+                )
+                try:
+                    result = future.result()
+                except Exception as e:
+                    record["error"] = repr(e)
+                    print(f"{name:<24} failed: {e!r}")
+                else:
+                    record.update(
+                        result,
+                        best=min(result["times"]),
+                        median=statistics.median(result["times"]),
+                    )
+                    print(
+                        f"{name:<24} {record['median']:9.3f} s"
+                        f" {record['peak_traced_mb']:9.1f} MiB"
+                        f" {record['max_rss_mb']:9.1f} MiB"
+                    )
+        records.append(record)
+
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with results_file.open("a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return records
+
+
+def load_results(results_file, commit):
+    """Latest successful result of each stage for a given commit"""
+    latest = {}
+    if results_file.is_file():
+        with results_file.open("r") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["commit"] == commit and "error" not in record:
+                    latest[record["stage"]] = record
+    return latest
+
+
+def compare(records, baseline):
+    """Print the ratios of median times and traced memory to a baseline"""
+    print(f"{'stage':<24} {'time':>9} {'baseline':>9} {'ratio':>6} {'memory':>6}")
+    for record in records:
+        base = baseline.get(record["stage"])
+        if base is None or "error" in record:
+            continue
+        print(
+            f"{record['stage']:<24} {record['median']:9.3f} {base['median']:9.3f}"
+            f" {record['median'] / base['median']:6.2f}"
+            f" {record['peak_traced_mb'] / max(base['peak_traced_mb'], 1e-6):6.2f}"
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("stages", nargs="*", help="Stages to run (default: all)")
+    ap.add_argument("--list", action="store_true", help="List the stages")
+    ap.add_argument("--repeat", type=int, default=3, help="Timed runs per stage")
+    ap.add_argument(
+        "--fixtures",
+        type=Path,
+        default=mypaths.cache_dir / "bench" / "fixtures",
+        help="Directory of the synthetic inputs",
+    )
+    ap.add_argument(
+        "--results",
+        type=Path,
+        default=mypaths.cache_dir / "bench" / "results.jsonl",
+        help="JSON lines file with the results",
+    )
+    ap.add_argument(
+        "--regenerate", action="store_true", help="Generate the fixtures again"
+    )
+    ap.add_argument("--compare", metavar="COMMIT", help="Compare with a commit")
+    args = ap.parse_args()
+
+    if args.list:
+        for name, func in STAGES.items():
+            print(f"{name:<24} {func.__doc__}")
+        return
+    unknown = set(args.stages).difference(STAGES)
+    assert not unknown, f"Unknown stages: {sorted(unknown)}"
+
+    fixtures_dir = args.fixtures.resolve()
+    make_fixtures(fixtures_dir, force=args.regenerate)
+    records = run_stages(
+        args.stages or list(STAGES), fixtures_dir, args.results, repeat=args.repeat
+    )
+    if args.compare:
+        commit = sb.run(
+            ["git", "rev-parse", "--short", args.compare],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        compare(records, load_results(args.results, commit))
+    if any("error" in record for record in records):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to read data of the meteorological buoy
+
+The buoy data come as one growing text file on an FTP server (`FTP_HOST`).
+A local copy of the file is kept up to date by downloading only its new
+bytes (FTP REST command, see `fetch()`), and the new rows are parsed and
+appended to a local store of Feather files (see `update()`):
+
+    df = buoy.update()  # fetch, ingest and read the whole series
+    hourly = buoy.resample(df, "1h")
+
+so that a refresh costs in proportion to the new rows only. Wind direction
+(and other directions) are averaged as vectors (see `resample()`
+and `rolling()`).
+"""
+import ftplib
+import io
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+import mypaths
+from cache import cached
+
+BUOY_FILE = "31505.csv"
+# Format of the timestamps, e.g. "01.03.2018 12:00:00"
+TIME_FMT = "%d.%m.%Y %H:%M:%S"
+# Server of the buoy data (credentials are read from the environment,
+# see `fetch()`)
+FTP_HOST = "ftp.oceanor.info"
+# Bump the version if the structure of the store changes
+STORE_VERSION = 1
+# Number of appended parts of the store that are merged into one
+MAX_PARTS = 32
+# Columns of directions [degrees] averaged as vectors,
+# optionally weighted by a speed column
+DIRECTION_REGEX = re.compile(r"[Dd]irection")
+SPEED_COLUMNS = dict(windDirection="windSpeed")
+
+
+def buoy_file(buoy_dir=None):
+    """Path to the file of buoy data"""
+    if buoy_dir is None:
+        buoy_dir = mypaths.buoy_dir
+    return buoy_dir / BUOY_FILE
+
+
+def _parse_rows(buf, columns):
+    """Parse rows of buoy data (without the header lines)"""
+    df = pd.read_csv(io.BytesIO(buf), sep=";", header=None, names=columns, index_col=0)
+    # Convert all timestamps at once
+    df.index = pd.to_datetime(df.index, format=TIME_FMT).rename("time")
+    return df
+
+
+@cached(version=1)
+def read_buoy(fname):
+    """
+    Read a file of buoy data (semicolon-separated, one header line)
+
+    Arguments
+    ---------
+    fname: pathlib.Path
+        Path to the file (see `buoy_file()`)
+
+    Returns
+    -------
+    pandas.DataFrame indexed by time
+    """
+    df = pd.read_csv(fname, skiprows=1, sep=";", index_col=0)
+    # Convert all timestamps at once
+    df.index = pd.to_datetime(df.index, format=TIME_FMT).rename("time")
+    return df
+
+
+def fetch(
+    host=FTP_HOST, user=None, passwd=None, port=21, fname=BUOY_FILE, buoy_dir=None
+):
+    """
+    Bring the local copy of the buoy data file up to date
+
+    Only the bytes added to the remote file since the last call are
+    downloaded (the transfer is restarted at the size of the local copy).
+    If the remote file is smaller than the local copy, it has been replaced,
+    so it is downloaded again.
+
+    Arguments
+    ---------
+    host: str, optional
+        FTP server
+    user, passwd: str, optional
+        Credentials; default to the environment variables
+        BUOY_FTP_USER and BUOY_FTP_PASSWORD (anonymous if not set)
+    port: int, optional
+        Port of the server
+    fname: str, optional
+        Name of the remote file
+    buoy_dir: pathlib.Path, optional
+        Directory of the local copy; defaults to `mypaths.buoy_dir`
+
+    Returns
+    -------
+    int
+        Number of downloaded bytes
+    """
+    if user is None:
+        user = os.getenv("BUOY_FTP_USER", "anonymous")
+    if passwd is None:
+        passwd = os.getenv("BUOY_FTP_PASSWORD", "")
+    target = buoy_file(buoy_dir)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    offset = target.stat().st_size if target.is_file() else 0
+
+    with ftplib.FTP() as ftp:
+        ftp.connect(host, port)
+        ftp.login(user=user, passwd=passwd)
+        # SIZE is in bytes in the binary mode
+        ftp.voidcmd("TYPE I")
+        remote_size = ftp.size(fname)
+        if remote_size == offset:
+            return 0
+        if remote_size < offset:
+            print(f"{fname} has been replaced on the server, downloading it again")
+            offset = 0
+        with target.open("r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            ftp.retrbinary(f"RETR {fname}", f.write, rest=offset or None)
+    n_bytes = target.stat().st_size - offset
+    print(f"Downloaded {n_bytes} bytes of {fname}")
+    return n_bytes
+
+
+def store_dir(source, cache_dir=None):
+    """Directory of the store of a buoy data file"""
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    return cache_dir / "buoy" / source.stem
+
+
+def _read_state(target):
+    state_file = target / "state.json"
+    if not state_file.is_file():
+        return None
+    with state_file.open("r") as f:
+        state = json.load(f)
+    if state.get("version") != STORE_VERSION:
+        return None
+    return state
+
+
+def _write_state(target, state):
+    tmp_file = target / f"state.{os.getpid()}.tmp"
+    with tmp_file.open("w") as f:
+        json.dump(state, f)
+    tmp_file.replace(target / "state.json")
+
+
+def _write_part(target, df, start, end):
+    """Write rows parsed from bytes `start` to `end` of the file"""
+    name = f"part_{start:012d}_{end:012d}.feather"
+    tmp_file = target / f"{name}.{os.getpid()}.tmp"
+    feather.write_feather(df.reset_index(), tmp_file, compression="uncompressed")
+    tmp_file.replace(target / name)
+    return name
+
+
+def ingest(source=None, cache_dir=None):
+    """
+    Append the new rows of a buoy data file to its store
+
+    The store keeps the number of bytes of the file parsed so far, so only
+    the rows after them are parsed and written as a new part. An incomplete
+    last line (e.g. a file being written) is left for the next call.
+    The store is rebuilt if the file has been replaced (its header or
+    the last parsed line have changed).
+
+    Arguments
+    ---------
+    source: pathlib.Path, optional
+        Path to the file; defaults to `buoy_file()`
+    cache_dir: pathlib.Path, optional
+        Defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    int
+        Number of new rows
+    """
+    assert feather is not None, "pyarrow is required for the buoy data store"
+    if source is None:
+        source = buoy_file()
+    target = store_dir(source, cache_dir=cache_dir)
+    with source.open("rb") as f:
+        # the first line (description of the file) and the header
+        head = f.readline() + f.readline()
+        state = _read_state(target)
+        if state is not None:
+            last_line = state["last_line"].encode("latin-1")
+            f.seek(state["offset"] - len(last_line))
+            replaced = (
+                state["head"] != head.decode("latin-1")
+                or f.read(len(last_line)) != last_line
+            )
+        if state is None or replaced:
+            shutil.rmtree(target, ignore_errors=True)
+            target.mkdir(parents=True)
+            columns = head.decode("latin-1").splitlines()[-1].strip().split(";")
+            state = dict(
+                version=STORE_VERSION,
+                head=head.decode("latin-1"),
+                columns=columns,
+                offset=len(head),
+                last_line="",
+                parts=[],
+            )
+        f.seek(state["offset"])
+        buf = f.read()
+    # parse complete lines only
+    buf = buf[: buf.rfind(b"\n") + 1]
+    if not buf.strip():
+        return 0
+
+    df = _parse_rows(buf, state["columns"])
+    start = state["offset"]
+    state["offset"] += len(buf)
+    state["parts"].append(_write_part(target, df, start, state["offset"]))
+    # (latin-1 keeps any bytes as they are)
+    state["last_line"] = buf[buf.rstrip(b"\n").rfind(b"\n") + 1 :].decode("latin-1")
+    if len(state["parts"]) > MAX_PARTS:
+        # merge the parts so that reading stays fast
+        merged = read_store(source, cache_dir=cache_dir, state=state)
+        old_parts = state["parts"]
+        start = int(old_parts[0].split("_")[1])
+        state["parts"] = [_write_part(target, merged, start, state["offset"])]
+        _write_state(target, state)
+        for name in old_parts:
+            (target / name).unlink()
+    else:
+        _write_state(target, state)
+    return len(df)
+
+
+def read_store(source=None, cache_dir=None, state=None):
+    """
+    Read the stored buoy data (see `ingest()`)
+
+    Returns
+    -------
+    pandas.DataFrame indexed by time
+    """
+    if source is None:
+        source = buoy_file()
+    target = store_dir(source, cache_dir=cache_dir)
+    if state is None:
+        state = _read_state(target)
+    assert state is not None and state["parts"], f"No buoy data stored for {source}"
+    df = pd.concat(
+        [
+            feather.read_table(target / name, memory_map=True).to_pandas()
+            for name in state["parts"]
+        ],
+        ignore_index=True,
+    )
+    return df.set_index("time")
+
+
+def update(fetch_kw=None, source=None, cache_dir=None):
+    """
+    Fetch new buoy data, add them to the store and read the whole series
+
+    Arguments
+    ---------
+    fetch_kw: dict, optional
+        Arguments of `fetch()`; None to use the local file as it is
+    source: pathlib.Path, optional
+        Path to the local file; defaults to `buoy_file()`
+    cache_dir: pathlib.Path, optional
+        Defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    pandas.DataFrame indexed by time
+    """
+    if fetch_kw is not None:
+        fetch(**fetch_kw)
+        if source is None:
+            source = buoy_file(fetch_kw.get("buoy_dir"))
+    n_rows = ingest(source, cache_dir=cache_dir)
+    print(f"Added {n_rows} rows of buoy data")
+    return read_store(source, cache_dir=cache_dir)
+
+
+def _to_components(df, columns=None):
+    """
+    Numeric columns with directions replaced by the components
+    of their (speed-weighted) unit vectors
+    """
+    data = df.select_dtypes("number")
+    if columns is not None:
+        data = data[columns]
+    data = data.copy()
+    columns = list(data.columns)
+    directions = [col for col in columns if DIRECTION_REGEX.search(col)]
+    for col in directions:
+        rad = np.deg2rad(data[col].values)
+        speed = SPEED_COLUMNS.get(col)
+        weight = data[speed].values if speed in data else 1
+        data[f"{col}_x"] = weight * np.sin(rad)
+        data[f"{col}_y"] = weight * np.cos(rad)
+    return data.drop(columns=directions), directions, columns
+
+
+def _from_components(agg, directions, columns):
+    """Directions [0-360) from the mean vector components"""
+    for col in directions:
+        x, y = agg.pop(f"{col}_x"), agg.pop(f"{col}_y")
+        deg = np.rad2deg(np.arctan2(x, y)) % 360
+        # (e.g. -1e-15 % 360 rounds to 360)
+        agg[col] = np.where(deg >= 360, 0.0, deg)
+    return agg[columns]
+
+
+def resample(df, rule="1h", how="mean", columns=None):
+    """
+    Aggregate buoy data over regular time intervals
+
+    Directions are averaged as vectors (weighted by speed if there is
+    a matching column in `SPEED_COLUMNS`), so that e.g. the mean of
+    350 and 10 degrees is 0 and not 180.
+
+    Arguments
+    ---------
+    df: pandas.DataFrame
+        Buoy data indexed by time
+    rule: str, optional
+        Length of the intervals, e.g. "1h" or "1D"
+    how: str, optional
+        Aggregation of the other columns, e.g. "mean", "max" or "min"
+    columns: list of str, optional
+        Columns to aggregate; defaults to all numeric columns
+
+    Returns
+    -------
+    pandas.DataFrame indexed by the start of the intervals
+    """
+    data, directions, columns = _to_components(df, columns)
+    funcs = {
+        col: "mean" if col.rsplit("_", 1)[0] in directions else how
+        for col in data.columns
+    }
+    agg = data.resample(rule).agg(funcs)
+    return _from_components(agg, directions, columns)
+
+
+def rolling(df, window="3h", columns=None, center=False):
+    """
+    Moving average of buoy data over a time window
+
+    Directions are averaged as vectors (see `resample()`).
+
+    Arguments
+    ---------
+    df: pandas.DataFrame
+        Buoy data indexed by time
+    window: str, optional
+        Length of the window, e.g. "3h"
+    columns: list of str, optional
+        Columns to average; defaults to all numeric columns
+    center: bool, optional
+        Center the window on each time instead of ending it there
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    data, directions, columns = _to_components(df, columns)
+    if not data.index.is_monotonic_increasing:
+        # time windows need sorted times
+        data = data.sort_index(kind="stable")
+    agg = data.rolling(window, center=center).mean()
+    return _from_components(agg, directions, columns)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of parsed data tables
+
+Parsing raw text files (NMEA logs, lidar and buoy data, radiosonde profiles)
+is slow, so the parsed tables are stored once as typed columnar (Feather)
+files in `mypaths.cache_dir` and read back memory-mapped on later calls:
+
+    @cached(version=1)
+    def read_something(fname, **kwargs):
+        ...
+        return df  # a pandas.DataFrame or a dict of them
+
+    df = read_something(fname, columns=["a", "b"])
+
+Opening an entry does not read the files; only the requested columns
+(all by default) are read from the mapped files and copied into pandas.
+
+An entry is identified by the source file (path, size, modification time),
+the parser (name, version) and its arguments, so changing the raw file,
+the parser version or the arguments leads to parsing the file again.
+Bump the version of a parser whenever the structure of its output changes.
+"""
+from functools import wraps
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+import mypaths
+
+# Name of the file of a parser returning a single table
+TABLE_NAME = "table"
+
+
+def source_stamp(source):
+    """Identity of a source file: resolved path, size and modification time"""
+    source = Path(source).resolve()
+    stat = source.stat()
+    return dict(path=str(source), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def entry_dir(source, parser_name, version, arguments="", cache_dir=None):
+    """
+    Directory of the cache entry of a parsed file
+
+    Arguments
+    ---------
+    source: str or path-like
+        Path to the raw file
+    parser_name: str
+        Name of the parser, e.g. "nmea.read_log"
+    version: int
+        Version of the parser
+    arguments: str, optional
+        Other arguments of the parser (e.g. their `repr()`)
+    cache_dir: pathlib.Path, optional
+        Cache directory; defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    pathlib.Path
+    """
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    key = dict(
+        source=source_stamp(source),
+        parser=parser_name,
+        version=version,
+        arguments=arguments,
+    )
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return cache_dir / "tables" / parser_name / f"{Path(source).name}_{digest}"
+
+
+def write_entry(target, tables):
+    """
+    Write parsed tables to a cache entry
+
+    The entry is written to a temporary directory first,
+    so that an interrupted write never leaves a broken entry.
+
+    Arguments
+    ---------
+    target: pathlib.Path
+        Directory of the entry
+    tables: pandas.DataFrame or dict of pandas.DataFrame
+        Parsed tables
+    """
+    if isinstance(tables, pd.DataFrame):
+        tables = {TABLE_NAME: tables}
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    tmp.mkdir(parents=True, exist_ok=True)
+    for name, df in tables.items():
+        # Uncompressed files can be memory-mapped when reading
+        feather.write_feather(df, tmp / f"{name}.feather", compression="uncompressed")
+    try:
+        tmp.rename(target)
+    except OSError:
+        # written by another process in the meantime
+        shutil.rmtree(tmp)
+
+
+def _to_pandas(table, columns=None):
+    """Convert a table to pandas, optionally only some columns (and the index)"""
+    if columns is not None:
+        index_columns = [
+            i
+            for i in (table.schema.pandas_metadata or {}).get("index_columns", [])
+            if isinstance(i, str)
+        ]
+        table = table.select(
+            index_columns
+            + [i for i in columns if i in table.column_names and i not in index_columns]
+        )
+    return table.to_pandas()
+
+
+def select_columns(tables, columns=None):
+    """Select columns of a table or of a dict of tables (those present in each)"""
+    if columns is None:
+        return tables
+    if isinstance(tables, pd.DataFrame):
+        return tables[[i for i in columns if i in tables.columns]]
+    return {name: select_columns(df, columns) for name, df in tables.items()}
+
+
+def read_entry(target, columns=None):
+    """
+    Read parsed tables from a cache entry
+
+    The files are memory-mapped and only the selected columns are read
+    and converted to pandas.
+
+    Arguments
+    ---------
+    target: pathlib.Path
+        Directory of the entry
+    columns: list of str, optional
+        Columns to read (those present in each table); defaults to all
+
+    Returns
+    -------
+    pandas.DataFrame or dict of pandas.DataFrame
+    """
+    tables = {
+        fname.stem: _to_pandas(feather.read_table(fname, memory_map=True), columns)
+        for fname in sorted(target.glob("*.feather"))
+    }
+    if list(tables) == [TABLE_NAME]:
+        return tables[TABLE_NAME]
+    return tables
+
+
+def cached(version=1, cache_dir=None):
+    """
+    Decorator caching the output of a parser of a raw data file
+
+    The first argument of the parser must be the path to the file,
+    the other arguments are taken into account as a part of the key.
+    Calling the decorated parser with `use_cache=False` bypasses the cache.
+    If `pyarrow` is not installed, the file is always parsed.
+    The decorated parser takes an optional `columns` argument: a list of
+    the columns to return (the others are not read from the cache).
+
+    Arguments
+    ---------
+    version: int, optional
+        Version of the parser
+    cache_dir: pathlib.Path, optional
+        Cache directory; defaults to `mypaths.cache_dir` at the time of the call
+    """
+
+    def decorator(parser):
+        parser_name = f"{parser.__module__}.{parser.__qualname__}"
+
+        @wraps(parser)
+        def wrapper(source, *args, use_cache=True, columns=None, **kwargs):
+            if not use_cache or feather is None:
+                return select_columns(parser(source, *args, **kwargs), columns)
+            arguments = repr((args, sorted(kwargs.items())))
+            target = entry_dir(
+                source,
+                parser_name,
+                version,
+                arguments=arguments,
+                cache_dir=cache_dir,
+            )
+            if target.is_dir():
+                return read_entry(target, columns=columns)
+            tables = parser(source, *args, **kwargs)
+            write_entry(target, tables)
+            return select_columns(tables, columns)
+
+        return wrapper
+
+    return decorator
+
+
+def clear(parser_name=None, cache_dir=None):
+    """Remove cached tables of a parser (or of all parsers)"""
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    target = cache_dir / "tables"
+    if parser_name is not None:
+        target = target / parser_name
+    if target.is_dir():
+        shutil.rmtree(target)
@@ -4,11 +4,119 @@ Collection of functions for cartographic plotting.
 
 Borrows some functions from arke library
 """
+from functools import lru_cache
+
 from arke.cart import get_xy_ticks, add_coastline, _lambert_xticks, _lambert_yticks
 import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import cartopy.io.shapereader as shpreader
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
+import numpy as np
+import shapely.geometry as sgeom
+
+from spans import span, traced
+
+# Tick locations and labels of map templates (see `ukmo_igp_map()`)
+_MAP_TICKS = {}
+
+
+@lru_cache(maxsize=None)
+def igp_projection(clon=-21, clat=68.5):
+    """Stereographic projection used for the IGP maps"""
+    return ccrs.Stereographic(central_latitude=clat, central_longitude=clon)
+
+
+def project_extent(extent, proj, npts=100):
+    """
+    Get the bounding box in projection coordinates of a lon/lat extent
+
+    This is the area shown by `ax.set_extent(extent, crs=ccrs.PlateCarree())`
+    in axes with the given projection.
 
+    Parameters
+    ----------
+    extent: sequence
+        extent (lon0, lon1, lat0, lat1) in degrees
+    proj: cartopy.crs.Projection
+        target projection
+    npts: int, optional
+        number of points along each side of the extent
+    Returns
+    -------
+    tuple
+        extent (x0, x1, y0, y1) in the given projection
+    """
+    lon0, lon1, lat0, lat1 = extent
+    lons = np.linspace(lon0, lon1, npts)
+    lats = np.linspace(lat0, lat1, npts)
+    xs = np.concatenate([lons, np.full(npts, lon1), lons[::-1], np.full(npts, lon0)])
+    ys = np.concatenate([np.full(npts, lat0), lats, np.full(npts, lat1), lats[::-1]])
+    xyz = proj.transform_points(ccrs.PlateCarree(), xs, ys)
+    xyz = xyz[np.isfinite(xyz[:, :2]).all(axis=1)]
+    return (
+        xyz[:, 0].min(),
+        xyz[:, 0].max(),
+        xyz[:, 1].min(),
+        xyz[:, 1].max(),
+    )
 
+
+@lru_cache(maxsize=8)
+@traced("land_geometries")
+def _land_geometries(scale, clon, clat, extent, margin=2):
+    """
+    Natural Earth land polygons clipped to the map and projected onto it
+
+    The clipping box is the lon/lat bounding box of the map area
+    (of the outline of all its four edges) plus a margin in degrees.
+    """
+    npts = 100
+    proj = igp_projection(clon, clat)
+    x0, x1, y0, y1 = project_extent(extent, proj)
+    xs = np.linspace(x0, x1, npts)
+    ys = np.linspace(y0, y1, npts)
+    outline_x = np.concatenate([xs, np.full(npts, x1), xs[::-1], np.full(npts, x0)])
+    outline_y = np.concatenate([np.full(npts, y0), ys, np.full(npts, y1), ys[::-1]])
+    lonlat = ccrs.PlateCarree().transform_points(proj, outline_x, outline_y)
+    clip_box = sgeom.box(
+        max(lonlat[:, 0].min() - margin, -180),
+        max(lonlat[:, 1].min() - margin, -90),
+        min(lonlat[:, 0].max() + margin, 180),
+        min(lonlat[:, 1].max() + margin, 90),
+    )
+    reader = shpreader.Reader(
+        shpreader.natural_earth(resolution=scale, category="physical", name="land")
+    )
+    geoms = []
+    for geom in reader.geometries():
+        if geom.intersects(clip_box):
+            geoms.append(
+                proj.project_geometry(geom.intersection(clip_box), ccrs.PlateCarree())
+            )
+    return tuple(geoms)
+
+
+def add_igp_coastline(ax, coast, clon=-21, clat=68.5, extent=None):
+    """
+    Add a coastline to a map created by `ukmo_igp_map()`
+
+    If `coast` is a dictionary with a `scale` key and `extent` is given,
+    the Natural Earth land polygons of that scale (not `add_coastline()`)
+    are clipped to the map, projected onto it and drawn with the other
+    items of `coast` as the style. The geometries are computed once and
+    reused by all maps with the same extent. Otherwise `add_coastline()`
+    from arke is used.
+    """
+    if isinstance(coast, dict) and "scale" in coast and extent is not None:
+        style = dict(coast)
+        scale = style.pop("scale")
+        geoms = _land_geometries(scale, clon, clat, tuple(extent))
+        ax.add_feature(cfeature.ShapelyFeature(geoms, ax.projection, **style))
+    else:
+        add_coastline(ax, coast)
+
+
+@traced("igp_map")
 def ukmo_igp_map(
     fig,
     subplot_grd=111,
@@ -23,6 +131,11 @@ def ukmo_igp_map(
     Create axes the Stereographic projection in a given figure
 
     Defaults to plots like UK Met Office supplied for the IGP campaign
+
+    The projection, tick locations and coastline geometries are cached,
+    so only the first map with a given set of parameters needs a full
+    canvas draw to compute the tick locations.
+
     Parameters
     ----------
     fig: matplotlib.figure.Figure
@@ -35,7 +148,7 @@ def ukmo_igp_map(
     clat: float, optional
         central latitude of the projection
     coast: str or dict, optional
-        parameters to draw a coastline, see `add_coastline()` for details
+        parameters to draw a coastline, see `add_igp_coastline()` for details
     extent: sequence, optional
         extent (x0, x1, y0, y1) of the map in the given coordinate projection
     ticks: sequence, optional
@@ -48,25 +161,44 @@ def ukmo_igp_map(
         axes with the LCC projection
     """
     # Create a projection
-    proj = ccrs.Stereographic(central_latitude=68.5, central_longitude=-21)
+    proj = igp_projection(clon, clat)
 
     # Draw a set of axes with coastlines
     ax = fig.add_subplot(subplot_grd, projection=proj)
     if isinstance(extent, list):
         ax.set_extent(extent, crs=ccrs.PlateCarree())
+    else:
+        extent = None
 
-    add_coastline(ax, coast)
+    add_igp_coastline(ax, coast, clon=clon, clat=clat, extent=extent)
 
     if ticks:
         xticks, yticks = get_xy_ticks(ticks)
-        # *must* call draw in order to get the axis boundary used to add ticks
-        fig.canvas.draw()
         # Draw the lines using cartopy's built-in gridliner
         ax.gridlines(xlocs=xticks, ylocs=yticks, **gridline_kw)
         # Label the end-points of the gridlines using the custom tick makers:
         ax.xaxis.set_major_formatter(LONGITUDE_FORMATTER)
         ax.yaxis.set_major_formatter(LATITUDE_FORMATTER)
-        _lambert_xticks(ax, xticks)
-        _lambert_yticks(ax, yticks)
+        key = (clon, clat, extent and tuple(extent), tuple(ticks))
+        if key not in _MAP_TICKS:
+            # *must* call draw in order to get the axis boundary used to add ticks
+            with span("canvas_draw"):
+                fig.canvas.draw()
+            _lambert_xticks(ax, xticks)
+            _lambert_yticks(ax, yticks)
+            _MAP_TICKS[key] = (
+                ax.get_xticks(),
+                [i.get_text() for i in ax.get_xticklabels()],
+                ax.get_yticks(),
+                [i.get_text() for i in ax.get_yticklabels()],
+            )
+        else:
+            xlocs, xlabels, ylocs, ylabels = _MAP_TICKS[key]
+            ax.xaxis.tick_bottom()
+            ax.set_xticks(xlocs)
+            ax.set_xticklabels(xlabels)
+            ax.yaxis.tick_left()
+            ax.set_yticks(ylocs)
+            ax.set_yticklabels(ylabels)
 
     return ax
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Co-location of flight tracks with satellite images and sea ice data
+
+For each sample of a flight track, find the satellite image closest in time,
+the value of its pixel containing the sample and the AMSR2 sea ice
+concentration. Points are projected to the image coordinates in one
+vectorized transform per image and pixels are found using the affine
+transform of the image. Only the window of each image around the tracks
+of its day is read, and these windows are kept in memory until the flights
+of that day are done, so that flights of the same day (e.g. 293 and 294)
+do not read them again (see `colocate_flights()`).
+"""
+from datetime import datetime
+
+import cartopy.crs as ccrs
+import numpy as np
+import rasterio
+from rasterio.windows import Window, WindowError, from_bounds
+
+import amsr2
+import masin
+import mypaths
+import sat_tools
+
+# Margin around the track samples of a day [degrees]
+EXTENT_MARGIN = 0.1
+
+
+def track_extent(lons, lats, margin=EXTENT_MARGIN):
+    """
+    Area (lon0, lon1, lat0, lat1) around track samples
+
+    The bounds are rounded outwards to multiples of `margin`,
+    so that the same area is found for nearby tracks.
+    """
+    lon0, lon1 = np.nanmin(lons), np.nanmax(lons)
+    lat0, lat1 = np.nanmin(lats), np.nanmax(lats)
+    return (
+        float(np.floor(lon0 / margin - 1) * margin),
+        float(np.ceil(lon1 / margin + 1) * margin),
+        float(np.floor(lat0 / margin - 1) * margin),
+        float(np.ceil(lat1 / margin + 1) * margin),
+    )
+
+
+def read_image(filename, extent=None):
+    """
+    Read the first band of a satellite image with its geo-referencing
+
+    The arrays are read-only, so that they can be shared
+    (see `sample_image()`).
+
+    Arguments
+    ---------
+    filename: str
+        Path to the GeoTIFF file, or to a member of a zip archive
+        (see `sat_tools.zip_member_path()`)
+    extent: tuple, optional
+        Area (lon0, lon1, lat0, lat1) to read (see `track_extent()`);
+        by default the whole image is read
+
+    Returns
+    -------
+    data: numpy array of float32
+        Image data, NaN for no-data pixels
+    transform: affine.Affine
+        Pixel (col, row) -> image coordinates transform of `data`
+    crs: cartopy.crs.Projection
+        Projection of the image
+    """
+    with rasterio.open(filename, "r") as src:
+        crs = sat_tools.stereo_crs(src.crs)
+        window = Window(0, 0, src.width, src.height)
+        if extent is not None:
+            x0, x1, y0, y1 = sat_tools.transform_bbox(extent, ccrs.PlateCarree(), crs)
+            bounds = from_bounds(x0, y0, x1, y1, transform=src.transform)
+            # pad by one pixel, because the bounds are rounded outwards
+            bounds = (
+                Window(
+                    bounds.col_off - 1,
+                    bounds.row_off - 1,
+                    bounds.width + 2,
+                    bounds.height + 2,
+                )
+                .round_offsets(op="floor")
+                .round_lengths(op="ceil")
+            )
+            try:
+                window = window.intersection(bounds)
+            except WindowError:
+                # the area is outside the image
+                window = Window(0, 0, 0, 0)
+        transform = src.window_transform(window)
+        if window.width > 0 and window.height > 0:
+            data = src.read(1, window=window, masked=True).astype("f4").filled(np.nan)
+        else:
+            data = np.zeros((0, 0), dtype="f4")
+    data.flags.writeable = False
+    return data, transform, crs
+
+
+def sample_image(filename, lons, lats, extent=None, images=None):
+    """
+    Get pixel values of a satellite image at given points
+
+    Arguments
+    ---------
+    filename: str
+        See `read_image()`
+    lons, lats: numpy arrays
+        Coordinates of the points
+    extent: tuple, optional
+        Area to read, containing the points (see `read_image()`)
+    images: dict, optional
+        Images read so far, (filename, extent) -> output of `read_image()`;
+        the image is read only if it is not there, and added to it
+
+    Returns
+    -------
+    numpy array of float32 (NaN for points outside the image)
+    """
+    if images is None:
+        images = {}
+    key = (filename, extent)
+    if key not in images:
+        images[key] = read_image(filename, extent)
+    data, transform, crs = images[key]
+    xyz = crs.transform_points(ccrs.Geodetic(), lons, lats)
+    cols, rows = ~transform * (xyz[:, 0], xyz[:, 1])
+    rows = np.floor(rows)
+    cols = np.floor(cols)
+    inside = (rows >= 0) & (rows < data.shape[0]) & (cols >= 0) & (cols < data.shape[1])
+    values = np.full(len(lons), np.nan, dtype="f4")
+    values[inside] = data[rows[inside].astype(int), cols[inside].astype(int)]
+    return values
+
+
+def day_extents(tracks, stride=1):
+    """
+    Area around the samples of several tracks for each day
+
+    Arguments
+    ---------
+    tracks: sequence of dict
+        Flight tracks (see `masin.load_track()`)
+    stride: int, optional
+        Use every `stride`-th sample of the tracks
+
+    Returns
+    -------
+    dict
+        datetime.datetime (day) -> (lon0, lon1, lat0, lat1)
+    """
+    bounds = {}
+    for track in tracks:
+        lons = np.asarray(track["lon"][::stride], dtype="f8")
+        lats = np.asarray(track["lat"][::stride], dtype="f8")
+        days = track["time"][::stride].astype("M8[D]")
+        for day in np.unique(days):
+            in_day = days == day
+            lon0, lon1, lat0, lat1 = track_extent(lons[in_day], lats[in_day])
+            key = day.astype("M8[ms]").astype(datetime)
+            if key in bounds:
+                old = bounds[key]
+                lon0, lon1 = min(lon0, old[0]), max(lon1, old[1])
+                lat0, lat1 = min(lat0, old[2]), max(lat1, old[3])
+            bounds[key] = (lon0, lon1, lat0, lat1)
+    return bounds
+
+
+def nearest_images(times, index_times):
+    """
+    Find the images closest in time to many samples at once
+
+    Arguments
+    ---------
+    times: numpy array of datetime64
+        Times of the samples
+    index_times: sequence of datetime.datetime
+        Sorted times of the images
+
+    Returns
+    -------
+    numpy array of int
+        Position of the nearest image for each sample
+        (the earlier one if two images are equally close)
+    """
+    index_times = np.array(index_times, dtype="M8[ms]")
+    times = times.astype("M8[ms]")
+    after = np.clip(np.searchsorted(index_times, times), 0, len(index_times) - 1)
+    before = np.clip(after - 1, 0, len(index_times) - 1)
+    use_before = np.abs(times - index_times[before]) <= np.abs(
+        index_times[after] - times
+    )
+    return np.where(use_before, before, after)
+
+
+def colocate_track(
+    track,
+    sat_opt,
+    arch_dir=None,
+    sic_dir=None,
+    stride=1,
+    max_offset=None,
+    extents=None,
+    images=None,
+):
+    """
+    Co-locate a flight track with satellite images and sea ice concentration
+
+    Arguments
+    ---------
+    track: dict
+        Flight track from `masin.load_track()` (lon, lat and time are used)
+    sat_opt: dict
+        Satellite image options: instrument, channel, platform
+    arch_dir: pathlib.Path, optional
+        Directory with Dundee day archives; defaults to `mypaths.dundee_dir`
+    sic_dir: pathlib.Path, optional
+        Directory of the AMSR2 store (see `amsr2`); if None, sea ice
+        concentration is not added
+    stride: int, optional
+        Use every `stride`-th sample of the track
+    max_offset: numpy.timedelta64, optional
+        Maximum time between a sample and its image; pixel values of samples
+        further away in time are set to NaN
+    extents: dict, optional
+        Area of the images to read for each day (see `day_extents()`);
+        defaults to the area around the track
+    images: dict, optional
+        Images read so far, shared with other tracks (see `sample_image()`);
+        by default the images are read for this track only
+
+    Returns
+    -------
+    result: dict
+        time, lon, lat: samples of the track
+        sat_value: pixel value of the nearest image
+        sat_time: time of the nearest image
+        time_offset: sample time minus image time
+        sat_file: file name of the nearest image for each sample
+        sic: sea ice concentration (if `sic_dir` is given)
+    """
+    if arch_dir is None:
+        arch_dir = mypaths.dundee_dir
+    time = track["time"][::stride]
+    lons = np.asarray(track["lon"][::stride], dtype="f8")
+    lats = np.asarray(track["lat"][::stride], dtype="f8")
+
+    n = len(time)
+    sat_value = np.full(n, np.nan, dtype="f4")
+    sat_time = np.full(n, np.datetime64("NaT"), dtype="M8[ms]")
+    sat_file = np.full(n, "", dtype=object)
+    sic = np.full(n, np.nan, dtype="f4")
+
+    if extents is None:
+        extents = day_extents([track], stride=stride)
+    if images is None:
+        images = {}
+    key = sat_tools.sat_opt_key(**sat_opt)
+    days = time.astype("M8[D]")
+    for day in np.unique(days):
+        dt = day.astype(datetime)
+        dt = datetime(dt.year, dt.month, dt.day)
+        in_day = np.nonzero(days == day)[0]
+        arch_file = arch_dir / f"{dt:%Y%m%d}.zip"
+        times, fnames = sat_tools.get_sat_index(arch_file)[key]
+        assert len(times) > 0, f"No images found for {key} in {arch_file}"
+
+        nearest = nearest_images(time[in_day], times)
+        for i in np.unique(nearest):
+            samples = in_day[nearest == i]
+            member = sat_tools.zip_member_path(arch_file, f"{dt:%Y%m%d}/{fnames[i]}")
+            sat_value[samples] = sample_image(
+                member, lons[samples], lats[samples], extent=extents[dt], images=images
+            )
+            sat_time[samples] = np.datetime64(times[i], "ms")
+            sat_file[samples] = fnames[i]
+
+        if sic_dir is not None:
+            sic[in_day] = amsr2.sample_sic(
+                lons[in_day], lats[in_day], dt, store_dir=sic_dir
+            )
+
+    time_offset = time.astype("M8[ms]") - sat_time
+    if max_offset is not None:
+        sat_value[np.abs(time_offset) > max_offset] = np.nan
+
+    result = dict(
+        time=time,
+        lon=lons,
+        lat=lats,
+        sat_value=sat_value,
+        sat_time=sat_time,
+        time_offset=time_offset,
+        sat_file=sat_file,
+    )
+    if sic_dir is not None:
+        result["sic"] = sic
+    return result
+
+
+def colocate_flights(flight_ids, sat_opt, sic_dir=None, masin_dir=None, **kwargs):
+    """
+    Co-locate several flights (see `colocate_track()` for the arguments)
+
+    The tracks are read from `masin_dir` (see `masin.load_track()`).
+
+    Flights are processed in order of their dates and the same window
+    of each image (around all the flights of its day) is read for all
+    of them. All images of a day are kept in memory until a flight
+    of another day, so that the images of each day are read only once.
+
+    Returns
+    -------
+    dict of flight_id -> result of `colocate_track()`
+    """
+    tracks = masin.load_tracks(flight_ids, masin_dir=masin_dir)
+    order = sorted(flight_ids, key=lambda i: tracks[i]["time"][0])
+    extents = day_extents(tracks.values(), stride=kwargs.get("stride", 1))
+    images = {}
+    prev_days = set()
+    result = {}
+    for flight_id in order:
+        days = set(np.unique(tracks[flight_id]["time"].astype("M8[D]")).tolist())
+        if not days & prev_days:
+            # images of the previous days are not needed any more
+            images.clear()
+        prev_days = days
+        result[flight_id] = colocate_track(
+            tracks[flight_id],
+            sat_opt,
+            sic_dir=sic_dir,
+            extents=extents,
+            images=images,
+            **kwargs,
+        )
+    return result
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent crawler of directory listings of the Dundee satellite archive
+
+Day directories (see `sat_tools.DUNDEE_URL`) are listed concurrently using
+asyncio, with a bounded number of simultaneous requests. Links are parsed
+with a regular expression instead of a full HTML parser. Listings are kept
+in a persistent JSON cache together with their ETag and Last-Modified
+headers, so that the next sweep sends conditional requests and only
+changed listings are downloaded again.
+
+`aiohttp` is used if it is installed; otherwise the requests are made
+by the shared `requests` session of `sat_tools` in a thread pool.
+"""
+import asyncio
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import json
+import os
+import re
+from urllib.parse import unquote, urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import mypaths
+import sat_tools
+
+# Maximum number of simultaneous requests
+MAX_CONCURRENCY = 8
+# Bump the version if the structure of the cached listings changes
+LISTING_CACHE_VERSION = 1
+# Links in HTML pages, e.g. <a href="noaa19_avhrr_band2_vis_....tif">
+HREF_REGEX = re.compile(r"""<a\s[^>]*?href\s*=\s*["']?([^"'\s>]+)""", re.IGNORECASE)
+
+
+def parse_hrefs(html, ext=""):
+    """
+    Get link targets ending with `ext` from an HTML page
+
+    Only links to files of the listed directory itself are kept: links
+    with a path separator or ".." (subdirectories, parent directories,
+    absolute links) are skipped.
+
+    Returns
+    -------
+    list of str
+        File names in order of appearance
+    """
+    names = {}
+    for href in HREF_REGEX.findall(html):
+        name = unquote(urlsplit(href).path)
+        if not name or "/" in name or ".." in name:
+            continue
+        if name.endswith(ext):
+            names[name] = None
+    return list(names)
+
+
+def listing_cache_file(cache_dir=None):
+    """Path to the JSON file with cached directory listings"""
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    return cache_dir / "listings.json"
+
+
+def load_listing_cache(cache_dir=None):
+    """Read cached listings: URL -> dict(etag, last_modified, names, checked)"""
+    cache_file = listing_cache_file(cache_dir)
+    if not cache_file.is_file():
+        return {}
+    with cache_file.open("r") as f:
+        cached = json.load(f)
+    if cached.get("version") != LISTING_CACHE_VERSION:
+        return {}
+    return cached["listings"]
+
+
+def save_listing_cache(listings, cache_dir=None):
+    """Write cached listings (atomically)"""
+    cache_file = listing_cache_file(cache_dir)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with tmp_file.open("w") as f:
+        json.dump(dict(version=LISTING_CACHE_VERSION, listings=listings), f)
+    tmp_file.replace(cache_file)
+
+
+def _conditional_headers(entry):
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+async def _get_aiohttp(session, url, headers):
+    async with session.get(url, headers=headers) as resp:
+        text = await resp.text() if resp.status == 200 else ""
+        return resp.status, dict(resp.headers), text
+
+
+async def _get_threaded(executor, url, headers):
+    loop = asyncio.get_running_loop()
+    resp = await loop.run_in_executor(
+        executor,
+        partial(
+            sat_tools.get_session().get,
+            url,
+            headers=headers,
+            timeout=sat_tools.DOWNLOAD_TIMEOUT,
+        ),
+    )
+    return resp.status_code, dict(resp.headers), resp.text
+
+
+async def _crawl(urls, listings, max_concurrency):
+    """List directories concurrently, updating `listings` in place"""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    errors = {}
+    statuses = {}
+
+    async def visit(get, url):
+        entry = listings.get(url)
+        async with semaphore:
+            try:
+                status, headers, text = await get(url, _conditional_headers(entry))
+            except Exception as e:
+                errors[url] = e
+                return
+        statuses[url] = status
+        checked = f"{datetime.now(timezone.utc):%Y-%m-%dT%H:%M:%SZ}"
+        if status == 304 and entry is not None:
+            entry["checked"] = checked
+        elif status == 200:
+            listings[url] = dict(
+                etag=headers.get("ETag"),
+                last_modified=headers.get("Last-Modified"),
+                names=parse_hrefs(text),
+                checked=checked,
+            )
+        elif status == 404:
+            # day without images (may appear later, so do not cache)
+            listings.pop(url, None)
+        else:
+            errors[url] = RuntimeError(f"HTTP {status}")
+
+    if aiohttp is not None:
+        timeout = aiohttp.ClientTimeout(total=sat_tools.DOWNLOAD_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=max_concurrency)
+        async with aiohttp.ClientSession(
+            timeout=timeout, connector=connector
+        ) as session:
+            get = partial(_get_aiohttp, session)
+            await asyncio.gather(*(visit(get, url) for url in urls))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_concurrency) as executor:
+            get = partial(_get_threaded, executor)
+            await asyncio.gather(*(visit(get, url) for url in urls))
+    return statuses, errors
+
+
+def crawl(urls, ext="tif", max_concurrency=MAX_CONCURRENCY, cache_dir=None):
+    """
+    List files in many directories of a web server concurrently
+
+    Arguments
+    ---------
+    urls: sequence of str
+        URLs of the directories
+    ext: str, optional
+        Extension of the files
+    max_concurrency: int, optional
+        Maximum number of simultaneous requests
+    cache_dir: pathlib.Path, optional
+        Directory of the listing cache; defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    listing: dict
+        URL -> list of file names (empty for missing directories)
+    """
+    listings = load_listing_cache(cache_dir)
+    urls = list(dict.fromkeys(urls))
+    statuses, errors = asyncio.run(_crawl(urls, listings, max_concurrency))
+    save_listing_cache(listings, cache_dir)
+
+    if errors:
+        summary = "\n".join(f"{url}: {e!r}" for url, e in errors.items())
+        raise RuntimeError(f"Failed to list {len(errors)} directories:\n{summary}")
+    n_new = sum(status == 200 for status in statuses.values())
+    print(f"Listed {len(urls)} directories: {n_new} new or changed")
+    return {
+        url: [
+            name
+            for name in listings.get(url, {}).get("names", [])
+            if name.endswith(ext)
+        ]
+        for url in urls
+    }
+
+
+def day_urls(start, end, project=sat_tools.PROJECT):
+    """URLs of the Dundee day directories from `start` to `end` (inclusive)"""
+    ndays = (end.date() - start.date()).days + 1
+    return [
+        sat_tools.DUNDEE_URL.format(project=project, dt=start + timedelta(days=i))
+        for i in range(ndays)
+    ]
+
+
+def campaign_index(start, end, ext="tif", project=sat_tools.PROJECT, **kwargs):
+    """
+    Build indices of images available on the server for a range of days
+
+    All day directories are listed in one concurrent sweep (see `crawl()`).
+
+    Returns
+    -------
+    dict
+        URL of the day directory -> index (see `sat_tools.build_sat_index()`)
+    """
+    listing = crawl(day_urls(start, end, project=project), ext=ext, **kwargs)
+    return {url: sat_tools.build_sat_index(fnames) for url, fnames in listing.items()}
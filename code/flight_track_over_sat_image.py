@@ -3,231 +3,1108 @@
 """
 Satellite image for each flight day at approximate time of the flight
 with flight track (shaded with altitude) overlaid
+
+What to plot is described by a job spec (a JSON file with any of the keys
+of `DEFAULT_CONFIG`) and command line options, e.g.
+
+    python flight_track_over_sat_image.py --flights 293 294 --workers 4
+    python flight_track_over_sat_image.py --spec spec.json --shard 0/3
+
+The run is planned first as an explicit task graph (see `make_plan()`):
+sea ice data of the flight days are added to the local store, then
+the figures are rendered by independent jobs, which can be split between
+several machines (`--shard`). In the watch mode (`--watch`), the input
+directories are polled and only the figures whose inputs have changed
+are rendered (see `watch()`). Importing this module does no work,
+and the plotting and geospatial libraries are imported only when needed,
+so worker processes start quickly.
 """
+import argparse
 import concurrent.futures
 from datetime import datetime, timedelta
+from functools import lru_cache
+import json
 from pathlib import Path
-from tempfile import mkdtemp
-from zipfile import ZipFile
-
-import cartopy.crs as ccrs
-import numpy as np
-import matplotlib.colors as mcolors
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
-from matplotlib.offsetbox import AnchoredText
-import matplotlib.patheffects as mpe
-import xarray as xr
+import re
+import sys
+import traceback
 
 # local modules
 import mypaths
-from common_defs import SCI_FLIGHTS, MASIN_FILE_MASK
-import sat_tools
-from cart import ukmo_igp_map
-
-# Process images in parallel
-use_concurrent = False
-
-# Use a temporary directory to store unzipped files 
-use_tmp_dir = False
-
-# Add sea ice contours
-# Currently, only AMSR2 data input is implemented
-add_sea_ice = "amsr2"
-
-# Options for satellite channels and instruments
-# (the full list of images available in the archive)
-sat_opts = [
-    # dict(instrument="avhrr", platform="metopb", channel="band2_vis"),
-    # dict(instrument="avhrr", platform="noaa19", channel="band2_vis"),
-    # dict(instrument="avhrr", platform="avhrr", channel="band4_bt"),
-    # dict(instrument="avhrr", platform="noaa19", channel="band4_bt"),
-    # dict(instrument="viirs", platform="j01", channel="m15"),
-    # dict(instrument="viirs", platform="j01", channel="m05"),
-    # dict(instrument="viirs", platform="npp", channel="m15"),
-    dict(instrument="viirs", platform="npp", channel="m05"),
-    # dict(instrument="modis", platform="aqua", channel="bt31"),
-    # dict(instrument="modis", platform="terra", channel="vis02"),
-    # dict(instrument="modis", platform="aqua", channel="vis02"),
-    # dict(instrument="modis", platform="terra", channel="bt31"),
-]
-
-# Paths
-ARCH_DIR = mypaths.dundee_dir
-if use_tmp_dir:
-    EXTRACTDIR = Path(mkdtemp())
-else:
-    EXTRACTDIR = mypaths.dundee_dir  # mkdtemp()
-PLOTDIR = mypaths.plotdir / "flight_track_satellite"
-PLOTDIR.mkdir(parents=True, exist_ok=True)
-SICDIR = None  # Directory with sea ice data files (also used as flag)
-if add_sea_ice.lower() == "amsr2":
-    SICDIR = mypaths.amsr2_dir
-elif add_sea_ice.lower() == "ostia":
-    raise NotImplementedError
-else:
-    pass
+from common_defs import FLIGHTS, SCI_FLIGHTS
+import spans
+from spans import span, traced
+
+# Default job spec (paths set to None are taken from `mypaths`)
+DEFAULT_CONFIG = dict(
+    # Flight numbers (None = all science flights)
+    flights=None,
+    # Options for satellite channels and instruments
+    # (the full list of images available in the archive is in
+    # data/satellite/sat_img_opt.json, see `sat_tools.get_avail_sat_img_opt()`)
+    sat_opts=[dict(instrument="viirs", platform="npp", channel="m05")],
+    # Add sea ice contours: "amsr2" or None
+    # Currently, only AMSR2 data input is implemented
+    sea_ice="amsr2",
+    # Extent of the map and frequency of lon/lat labels
+    extent=[-26, -11, 63, 72],
+    ticks=[3, 1],
+    # Additional string inserted in the file name, e.g. "_zoom"
+    zoom_str="",
+    # Stride for satellite image array (1 = every point is used)
+    sat_stride=1,
+    # Simplify flight tracks, keeping the points needed to draw them within
+    # the horizontal and altitude tolerances [m] (see `masin.simplify_track()`)
+    # or, if the tolerance is None, every `flt_stride`-th point
+    flt_tolerance=100,
+    flt_alt_tolerance=25,
+    flt_simplify="douglas_peucker",
+    flt_stride=10,
+    # Resolution of the figures
+    dpi=300,
+    # Number of worker processes (1 = render in this process,
+    # 0 or None = number of CPUs)
+    workers=1,
+    # Render all figures of a flight with the same base map
+    # (the map, sea ice contours and flight track are drawn only once)
+    sequence=True,
+    # Also save each sequence as an animation: None, "gif" or "mp4"
+    animation=None,
+    # Animation parameters: frames per second and resolution
+    animation_fps=1,
+    animation_dpi=100,
+    # Choose images that cover the flight track (using the catalogue of image
+    # footprints) instead of the images closest in time
+    use_footprints=True,
+    # Maximum time between the flight and the image when using footprints [h]
+    max_sat_offset=3,
+    # Show images reprojected once to the map grid (see `mosaic`): "scene",
+    # "hour" (mosaic of the images of the hour) or None (regrid when drawing);
+    # None is used for maps larger than the grid (see `mosaic.covers()`)
+    mosaic="scene",
+    # Directories of Dundee archives, MASIN data, AMSR2 store and figures
+    arch_dir=None,
+    masin_dir=None,
+    sic_dir=None,
+    output_dir=None,
+    # Render figures even if they are up to date
+    force=False,
+    # Log of the time and memory of each stage of each figure (JSON lines,
+    # see `spans`), relative to `output_dir`; None = keep the records in memory
+    spans_log="spans.jsonl",
+    # Print a table of the stages at the end of the run
+    spans_summary=True,
+    # Profile the jobs whose names contain this string (see `_task_name()`),
+    # e.g. "flight 293 | viirs | npp | m05"; the cProfile statistics are saved
+    # in `output_dir` / "profiles"
+    profile=None,
+)
 
 #
 # Plotting parameters
-# 
-# Figure-saving parameters
-svfigkw = dict(dpi=300, bbox_inches="tight")
-# Standard geodetic transform (do not change!)
-mapkw = dict(transform=ccrs.PlateCarree())
+#
 # Map grid lines style
 gridline_kw = dict(linestyle=(0, (10, 10)), linewidth=0.5, color="C9")
-# Extent of the map and frequency of lon/lat labels
-igp_map_kw = dict(extent=[-26, -11, 63, 72], ticks=[3, 1])
-# Additional string inserted in the file name
-zoom_str = ""  # '_zoom'
 # Coastline style
 COAST = dict(scale="50m", facecolor="none", edgecolor="C8", alpha=0.75)
-# Stride for satellite image array (1 = every point is used)
-sat_stride = 1
-# Stride for flight track points (10 is good enough, because of high time resolution of the data)
-flt_stride = 10
 # Flight track colormap and color levels
-cmap = plt.cm.plasma_r
-cmap.set_over("#36013f")
+CMAP = "plasma_r"
+CMAP_OVER = "#36013f"
 bounds = [0, 200, 300, 500, 1000, 1500, 2000]
-norm = mcolors.BoundaryNorm(boundaries=bounds, ncolors=256)
 # Sea ice contours
 sic_kw = dict(levels=[10, 90], colors=["#00FF00", "#007700"], linewidths=1.25)
 # Sea ice contour labels
 sic_clab_kw = dict(fmt="%2.0f%%", fontsize="small", use_clabeltext=True)
 # Sea ice contours path effects
-path_effects = [mpe.withStroke(linewidth=0.25, foreground="k")]
+path_effect_kw = dict(linewidth=0.25, foreground="k")
+ANIMATION_WRITERS = dict(gif="pillow", mp4="ffmpeg")
 
 
-def plotter(flight_id):
-    flight_datestr = SCI_FLIGHTS[flight_id]
-    flight_date = datetime.strptime(flight_datestr, "%Y%m%d")
-    save_sat_dir = EXTRACTDIR  # / f'{flight_date:%Y%m%d}'
-    masin_data_path = (
-        mypaths.masin_dir
-        / f"flight{flight_id}"
-        / MASIN_FILE_MASK.format(flight_date=flight_date, flight_id=flight_id)
-    )
-    ds = xr.open_dataset(masin_data_path, decode_times=False)
-    ref_date = flight_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    # TODO: decode from ds.Time.units
-    ds.coords["data_point"] = np.array(
-        [
-            np.datetime64(ref_date) + np.timedelta64(timedelta(seconds=int(i)))  # NOQA
-            for i in ds.Time.values
-        ]
+@lru_cache(maxsize=None)
+def _styles():
+    """Plotting objects, created on first use"""
+    import cartopy.crs as ccrs
+    import matplotlib.colors as mcolors
+    import matplotlib.patheffects as mpe
+    import matplotlib.pyplot as plt
+
+    cmap = plt.get_cmap(CMAP).copy()
+    cmap.set_over(CMAP_OVER)
+    return dict(
+        # Standard geodetic transform (do not change!)
+        mapkw=dict(transform=ccrs.PlateCarree()),
+        cmap=cmap,
+        norm=mcolors.BoundaryNorm(boundaries=bounds, ncolors=256),
+        path_effects=[mpe.withStroke(**path_effect_kw)],
     )
-    ds = ds.drop("Time")
-    ds = ds.rename({"data_point": "Time"})
-    masin_x = ds.LON_OXTS[~ds.ALT_OXTS.isnull()][::flt_stride]
-    masin_y = ds.LAT_OXTS[~ds.ALT_OXTS.isnull()][::flt_stride]
-    masin_z = ds.ALT_OXTS[~ds.ALT_OXTS.isnull()][::flt_stride]
-    masin_t = ds.Time[~ds.ALT_OXTS.isnull()]
 
-    flight_hours = sorted(set(masin_t.dt.hour.values))
 
-    seaice_str = ""
-    if add_sea_ice.lower() == "amsr2":
-        (sic_lons, sic_lats, sic_data) = sat_tools.get_amsr2(
-            dt=flight_date, save_dir=SICDIR
-        )
-        seaice_str = "_amsr2"
-
-    print(flight_date)
-    for sat_opt in sat_opts:
-        print(sat_opt)
-        prev_tstamp = ref_date
-        for hour in flight_hours:
-            dt = ref_date + timedelta(hours=int(hour))
-            # Get satellite image with given options closest to the flight time
-            arch_file = ARCH_DIR / f"{dt:%Y%m%d}.zip"
-            with ZipFile(arch_file) as z:
-                zfile, tstamp = sat_tools.get_nearest_zfile(z, dt, **sat_opt)
-
-            if tstamp == prev_tstamp:
-                continue
+def make_config(spec=None, **overrides):
+    """
+    Make the configuration of a run
 
-            sat_image_name = save_sat_dir / zfile
-            if not sat_image_name.is_file():
-                # er = sat_tools.download_file(url=url, save_dir=save_sat_dir)
-                # assert err == 0, 'Downloading the image failed'
-                with ZipFile(arch_file) as z:
-                    z.extract(zfile, save_sat_dir)
-
-            # Open the satellite image and get data, image extent, and CRS
-            im, extent, crs = sat_tools.read_raster_stereo(str(sat_image_name))
-
-            fig = plt.figure(figsize=(12, 8))
-            ax = ukmo_igp_map(fig, coast=COAST, **igp_map_kw, **gridline_kw)
-            ax.tick_params(labelsize="x-large", length=0)
-
-            ax.imshow(
-                im[::sat_stride, ::sat_stride],
-                origin="upper",
-                extent=extent,
-                transform=crs,
-                cmap="gray",
-                interpolation="nearest",
-            )
-            if SICDIR:
-                # Add contours of sea-ice concentration
-                cntr = ax.contour(sic_lons, sic_lats, sic_data, **sic_kw, **mapkw)
-                clbls = ax.clabel(cntr, **sic_clab_kw)
-                plt.setp(cntr.collections + clbls, path_effects=path_effects)
-
-            ax.plot(masin_x, masin_y, linewidth=5, color="k", alpha=0.25, **mapkw)
-            points = np.array([masin_x, masin_y]).T.reshape(-1, 1, 2)
-            segments = np.concatenate([points[:-1], points[1:]], axis=1)
-            lc = LineCollection(
-                segments, cmap=cmap, linewidth=3, zorder=10, norm=norm, **mapkw
+    Arguments
+    ---------
+    spec: dict, optional
+        Job spec with any of the keys of `DEFAULT_CONFIG`
+    overrides: dict, optional
+        Values replacing those of the spec (None values are ignored)
+
+    Returns
+    -------
+    cfg: dict
+        Complete configuration with paths resolved
+    """
+    cfg = dict(DEFAULT_CONFIG)
+    for values in (spec or {}), {k: v for k, v in overrides.items() if v is not None}:
+        unknown = set(values).difference(DEFAULT_CONFIG)
+        assert not unknown, f"Unknown options: {sorted(unknown)}"
+        cfg.update(values)
+
+    if cfg["flights"] is None:
+        cfg["flights"] = list(SCI_FLIGHTS)
+    cfg["flights"] = [str(i) for i in cfg["flights"]]
+    unknown = set(cfg["flights"]).difference(FLIGHTS)
+    assert not unknown, f"Unknown flights: {sorted(unknown)}"
+    assert cfg["animation"] is None or cfg["sequence"], "Animations need sequences"
+
+    if cfg["sea_ice"] is None:
+        cfg["sic_dir"] = None
+    elif cfg["sea_ice"].lower() == "amsr2":
+        cfg["sic_dir"] = Path(cfg["sic_dir"] or mypaths.amsr2_dir)
+    elif cfg["sea_ice"].lower() == "ostia":
+        raise NotImplementedError
+    else:
+        raise ValueError(f"Unknown sea ice data: {cfg['sea_ice']}")
+    cfg["arch_dir"] = Path(cfg["arch_dir"] or mypaths.dundee_dir)
+    cfg["masin_dir"] = Path(cfg["masin_dir"] or mypaths.masin_dir)
+    cfg["output_dir"] = Path(
+        cfg["output_dir"] or mypaths.plotdir / "flight_track_satellite"
+    )
+    if cfg["spans_log"] is not None:
+        cfg["spans_log"] = cfg["output_dir"] / cfg["spans_log"]
+    cfg["max_sat_offset"] = timedelta(hours=cfg["max_sat_offset"])
+    if cfg["mosaic"] is not None:
+        import mosaic
+
+        if not mosaic.covers(_map_bbox(cfg)):
+            print(
+                f"The map extent {cfg['extent']} is outside of the grid of the"
+                " reprojected images, the images are regridded when drawing"
             )
-            lc.set_array(masin_z)
-            h = ax.add_collection(lc)
-
-            cb = fig.colorbar(h, ax=ax, extend="max", pad=0.01, aspect=40)
-            cb.ax.tick_params(labelsize="large")
-            cb.ax.set_ylabel(
-                f"Altitude [{masin_z.units.strip()}]",
-                fontsize="large",
-                rotation=270,
-                labelpad=15,
+            cfg["mosaic"] = None
+    return cfg
+
+
+def _igp_proj():
+    from cart import igp_projection
+
+    return igp_projection()
+
+
+def _map_bbox(cfg):
+    """Extent of the map in the map projection"""
+    from cart import project_extent
+
+    return project_extent(cfg["extent"], _igp_proj())
+
+
+def output_path(cfg, flight_id, tstamp, sat_opt):
+    """Path to the figure for a given flight, satellite image time and options"""
+    sat_opt_str = "_".join(sat_opt.values())
+    seaice_str = "_amsr2" if cfg["sic_dir"] else ""
+    return (
+        cfg["output_dir"]
+        / f"flight{flight_id}"
+        / (
+            f"flight_{flight_id}_{tstamp:%Y%m%d%H%M}"
+            f"_{sat_opt_str}{seaice_str}{cfg['zoom_str']}.png"
+        )
+    )
+
+
+def is_up_to_date(target, inputs):
+    """Check if the target file exists and is newer than all the inputs"""
+    if not target.is_file():
+        return False
+    mtime = target.stat().st_mtime
+    return all(i.stat().st_mtime < mtime for i in inputs if i.exists())
+
+
+@traced("make_tasks")
+def make_tasks(cfg):
+    """
+    Make a list of figures to render
+
+    One task per flight, satellite options and satellite image:
+    for each hour of the flight the image closest in time is chosen
+    or, if `use_footprints` is True, the image covering the track
+    of that hour best within `max_sat_offset` (see `footprints.best_scene()`).
+
+    Returns
+    -------
+    tasks: list of dict
+        Each dict contains index (position in the list), flight_id, sat_opt,
+        arch_file, zfile, tstamp, masin_file, sic_stamp (stamp of the sea ice
+        data of the flight date or None, see `amsr2.date_stamp()`),
+        inputs (paths of all input files) and output (path of the figure)
+    """
+    import numpy as np
+
+    import amsr2
+    import footprints
+    import masin
+    import sat_tools
+
+    arch_dir = cfg["arch_dir"]
+    tasks = []
+    for flight_id in cfg["flights"]:
+        track = masin.load_track(flight_id, masin_dir=cfg["masin_dir"])
+        hours = track["time"].astype("datetime64[h]")
+        flight_hours = np.unique(hours)
+        if cfg["use_footprints"]:
+            arch_files = {
+                arch_dir / f"{dt:%Y%m%d}.zip" for dt in flight_hours.astype(datetime)
+            }
+            catalogue = footprints.build_catalogue(sorted(arch_files))
+        for sat_opt in cfg["sat_opts"]:
+            tstamps = set()
+            for hour, dt in zip(flight_hours, flight_hours.astype(datetime)):
+                arch_file = arch_dir / f"{dt:%Y%m%d}.zip"
+                scene = None
+                if cfg["use_footprints"]:
+                    # Get satellite image with given options covering the track
+                    in_hour = hours == hour
+                    scene = footprints.best_scene(
+                        catalogue,
+                        footprints.track_geometry(
+                            track["lon"][in_hour], track["lat"][in_hour]
+                        ),
+                        dt,
+                        cfg["max_sat_offset"],
+                        sat_opt=sat_opt,
+                    )
+                if scene is not None:
+                    arch_file = scene["arch_file"]
+                    zfile, tstamp = scene["zfile"], scene["time"]
+                else:
+                    # Get satellite image with given options closest to the flight time
+                    zfile, tstamp = sat_tools.get_nearest_zfile(
+                        arch_file, dt, **sat_opt
+                    )
+                if tstamp in tstamps:
+                    continue
+                tstamps.add(tstamp)
+
+                masin_file = masin.masin_file(flight_id, masin_dir=cfg["masin_dir"])
+                inputs = [masin_file, arch_file]
+                sic_stamp = None
+                if cfg["sic_dir"]:
+                    # (not the store, which changes with every ingested date)
+                    flight_date = datetime.strptime(FLIGHTS[flight_id], "%Y%m%d")
+                    sic_stamp = amsr2.date_stamp(flight_date, store_dir=cfg["sic_dir"])
+                    inputs.append(sic_stamp)
+                tasks.append(
+                    dict(
+                        index=len(tasks),
+                        flight_id=flight_id,
+                        sat_opt=sat_opt,
+                        arch_file=arch_file,
+                        zfile=zfile,
+                        tstamp=tstamp,
+                        masin_file=masin_file,
+                        sic_stamp=sic_stamp,
+                        inputs=inputs,
+                        output=output_path(cfg, flight_id, tstamp, sat_opt),
+                    )
+                )
+    return tasks
+
+
+@traced("load_flight")
+def _load_flight(cfg, flight_id):
+    """Flight track and sea ice data shared by all figures of a flight"""
+    import masin
+    import sat_tools
+
+    flight_date = datetime.strptime(FLIGHTS[flight_id], "%Y%m%d")
+    if cfg["flt_tolerance"] is None:
+        track = masin.load_track(
+            flight_id, stride=cfg["flt_stride"], masin_dir=cfg["masin_dir"]
+        )
+    else:
+        track = masin.load_track(flight_id, masin_dir=cfg["masin_dir"])
+        with span("simplify_track"):
+            idx = masin.simplify_track(
+                track,
+                tolerance=cfg["flt_tolerance"],
+                alt_tolerance=cfg["flt_alt_tolerance"],
+                crs=_igp_proj(),
+                method=cfg["flt_simplify"],
             )
+        track = masin.subset_track(track, idx)
+    sic = None
+    if cfg["sic_dir"]:
+        # Read only the part of the grid within the map
+        sic = sat_tools.get_amsr2(
+            dt=flight_date,
+            save_dir=cfg["sic_dir"],
+            bbox=_map_bbox(cfg),
+            crs=_igp_proj(),
+        )
+    return track, sic
+
+
+@traced("base_map")
+def _draw_base_map(cfg, fig, track, sic):
+    """
+    Draw the layers that do not depend on the satellite image:
+    map, sea ice contours, flight track and colorbar
+
+    Returns
+    -------
+    ax: cartopy.mpl.geoaxes.GeoAxes
+        Map axes
+    anno: matplotlib.offsetbox.AnchoredText
+        Annotation box (empty, to be filled by `_annotation()`)
+    """
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    from matplotlib.offsetbox import AnchoredText
+
+    from cart import ukmo_igp_map
+
+    styles = _styles()
+    mapkw = styles["mapkw"]
+    masin_x = track["lon"]
+    masin_y = track["lat"]
+    masin_z = track["alt"]
+
+    ax = ukmo_igp_map(
+        fig, coast=COAST, extent=cfg["extent"], ticks=cfg["ticks"], **gridline_kw
+    )
+    ax.tick_params(labelsize="x-large", length=0)
+
+    if sic is not None:
+        # Add contours of sea-ice concentration
+        sic_lons, sic_lats, sic_data = sic
+        with span("sea_ice_contours"):
+            cntr = ax.contour(sic_lons, sic_lats, sic_data, **sic_kw, **mapkw)
+            clbls = ax.clabel(cntr, **sic_clab_kw)
+            # (a ContourSet is a single artist in matplotlib >= 3.8)
+            plt.setp([cntr, *clbls], path_effects=styles["path_effects"])
+
+    ax.plot(masin_x, masin_y, linewidth=5, color="k", alpha=0.25, **mapkw)
+    points = np.array([masin_x, masin_y]).T.reshape(-1, 1, 2)
+    segments = np.concatenate([points[:-1], points[1:]], axis=1)
+    lc = LineCollection(
+        segments,
+        cmap=styles["cmap"],
+        linewidth=3,
+        zorder=10,
+        norm=styles["norm"],
+        **mapkw,
+    )
+    lc.set_array(masin_z)
+    h = ax.add_collection(lc)
+
+    cb = fig.colorbar(h, ax=ax, extend="max", pad=0.01, aspect=40)
+    cb.ax.tick_params(labelsize="large")
+    cb.ax.set_ylabel(
+        f"Altitude [{track['units']['alt']}]",
+        fontsize="large",
+        rotation=270,
+        labelpad=15,
+    )
+
+    anno = AnchoredText("", prop=dict(size="large"), loc=4)
+    ax.add_artist(anno)
+    return ax, anno
+
+
+def _get_mosaic(cfg, task):
+    """Path to the reprojected image of a task (see `mosaic`)"""
+    import mosaic
+
+    if cfg["mosaic"] == "hour":
+        return mosaic.get_hourly(task["arch_file"], task["tstamp"], task["sat_opt"])
+    return mosaic.get_scene(task["arch_file"], task["zfile"])
+
+
+def _mosaic_key(cfg, task):
+    """Key of the reprojected image of a task (images shared by tasks)"""
+    if cfg["mosaic"] == "hour":
+        return (
+            task["arch_file"],
+            tuple(task["sat_opt"].items()),
+            task["tstamp"].replace(minute=0, second=0, microsecond=0),
+        )
+    return (task["arch_file"], task["zfile"])
+
+
+@traced("sat_image")
+def _draw_sat_image(cfg, ax, task):
+    """Add the satellite image of a task to the map and return the image artist"""
+    import numpy as np
+
+    import mosaic
+    import sat_tools
+
+    bbox = _map_bbox(cfg)
+    fname = None if cfg["mosaic"] is None else _get_mosaic(cfg, task)
+    if fname is not None:
+        # Read the part of the reprojected image within the map at the zoom
+        # level matching the resolution of the figure: the image is
+        # in the map projection, so it is shown without regridding
+        width = ax.get_position().width * ax.figure.get_figwidth() * cfg["dpi"]
+        im, extent = mosaic.read_window(
+            fname, bbox, zoom=mosaic.zoom_level((bbox[1] - bbox[0]) / width)
+        )
+        # empty pixels (outside of the scenes) are left transparent
+        im = np.ma.masked_equal(im, mosaic.NODATA)
+        crs = ax.projection
+    else:
+        # Open the satellite image straight from the archive
+        # and get data, image extent, and CRS
+        # (only the part within the map)
+        im, extent, crs = sat_tools.read_raster_stereo(
+            sat_tools.zip_member_path(task["arch_file"], task["zfile"]),
+            extent=bbox,
+            extent_crs=_igp_proj(),
+            stride=cfg["sat_stride"],
+        )
+    return ax.imshow(
+        im,
+        origin="upper",
+        extent=extent,
+        transform=crs,
+        cmap="gray",
+        interpolation="nearest",
+    )
+
+
+def _annotation(cfg, task, track):
+    """Text of the annotation box"""
+    masin_t = track["time"]
+    txt = f"Flight {task['flight_id']} | {task['tstamp']:%d %b}"
+    txt += (
+        f"\nFlight time: {masin_t.min().astype(datetime):%H:%M}"
+        f"-{masin_t.max().astype(datetime):%H:%M}"
+    )
+    txt += f'\n{" | ".join(task["sat_opt"].values())}'
+    if cfg["mosaic"] == "hour":
+        txt += f"\nSat images: {task['tstamp']:%H}:00-{task['tstamp']:%H}:59"
+    else:
+        txt += f"\nSat image time: {task['tstamp']:%H:%M}"
+    if cfg["sic_dir"]:
+        txt += f"\n{cfg['sea_ice'].upper()} sea ice"
+    return txt
+
+
+def _savefig_kw(cfg):
+    """Figure-saving parameters"""
+    return dict(dpi=cfg["dpi"], bbox_inches="tight")
+
+
+def plotter(cfg, task):
+    """Render one figure described by a task from `make_tasks()`"""
+    import matplotlib.pyplot as plt
+
+    with span("figure", task=_task_name(task)):
+        track, sic = _load_flight(cfg, task["flight_id"])
+
+        fig = plt.figure(figsize=(12, 8))
+        ax, anno = _draw_base_map(cfg, fig, track, sic)
+        _draw_sat_image(cfg, ax, task)
+        # ax.set_title(txt, loc='left', fontsize='large')
+        anno.txt.set_text(_annotation(cfg, task, track))
+
+        task["output"].parent.mkdir(parents=True, exist_ok=True)
+        with span("savefig"):
+            fig.savefig(task["output"], **_savefig_kw(cfg))
+        plt.close(fig)
+    return [task["output"]]
+
+
+def animation_path(cfg, tasks, fmt):
+    """Path to the animation of a sequence of tasks in a given format"""
+    task = tasks[0]
+    sat_opt_str = "_".join(task["sat_opt"].values())
+    seaice_str = "_amsr2" if cfg["sic_dir"] else ""
+    return (
+        cfg["output_dir"]
+        / f"flight{task['flight_id']}"
+        / (
+            f"flight_{task['flight_id']}_{task['tstamp']:%Y%m%d}"
+            f"_{sat_opt_str}{seaice_str}{cfg['zoom_str']}.{fmt}"
+        )
+    )
+
+
+def make_sequences(tasks):
+    """
+    Group tasks into sequences of figures of the same flight
+    and satellite options, sorted by the image time
+    """
+    sequences = {}
+    for task in tasks:
+        key = (task["flight_id"], tuple(task["sat_opt"].items()))
+        sequences.setdefault(key, []).append(task)
+    return [sorted(seq, key=lambda task: task["tstamp"]) for seq in sequences.values()]
+
+
+def render_sequence(cfg, tasks):
+    """
+    Render a sequence of figures of the same flight and satellite options
+
+    The map, sea ice contours, flight track and colorbar are drawn only once;
+    for each figure, only the satellite image and the annotation are replaced.
+    Note that `savefig()` redraws the whole canvas, but the costly part
+    (building the map and the artists) is not repeated.
+    If `cfg["animation"]` is set, the sequence is also saved as an animation.
+
+    Arguments
+    ---------
+    cfg: dict
+        Configuration from `make_config()`
+    tasks: list of dict
+        Tasks from `make_tasks()` with the same flight_id and sat_opt
+
+    Returns
+    -------
+    List of paths to the saved files
+    """
+    import matplotlib.animation as manimation
+    import matplotlib.pyplot as plt
+
+    flight_ids = {task["flight_id"] for task in tasks}
+    assert len(flight_ids) == 1, f"Tasks of several flights: {flight_ids}"
+    animation = cfg["animation"]
+    with span("sequence", task=_task_name(tasks[0])):
+        track, sic = _load_flight(cfg, tasks[0]["flight_id"])
+
+        fig = plt.figure(figsize=(12, 8))
+        ax, anno = _draw_base_map(cfg, fig, track, sic)
 
-            txt = f"Flight {flight_id} | {tstamp:%d %b}"
-            txt += (
-                f"\nFlight time: {str(masin_t.min().values)[11:16]}"
-                f"-{str(masin_t.max().values)[11:16]}"
+        for task in tasks:
+            task["output"].parent.mkdir(parents=True, exist_ok=True)
+        writer = None
+        if animation is not None:
+            writer = manimation.writers[ANIMATION_WRITERS[animation]](
+                fps=cfg["animation_fps"]
             )
-            txt += f'\n{" | ".join(sat_opt.values())}'
-            txt += f"\nSat image time: {tstamp:%H:%M}"
-            if SICDIR:
-                txt += f"\n{add_sea_ice.upper()} sea ice"
-            # ax.set_title(txt, loc='left', fontsize='large')
-            ax.add_artist(AnchoredText(txt, prop=dict(size="large"), loc=4))
-
-            sat_opt_str = "_".join(sat_opt.values())
-            outdir = PLOTDIR / f"flight{flight_id}"
-            outdir.mkdir(exist_ok=True)
-            fig.savefig(
-                outdir
-                / (
-                    f"flight_{flight_id}_{tstamp:%Y%m%d%H%M}"
-                    f"_{sat_opt_str}{seaice_str}{zoom_str}.png"
-                ),
-                **svfigkw,
+            writer.setup(
+                fig, animation_path(cfg, tasks, animation), dpi=cfg["animation_dpi"]
             )
-            prev_tstamp = tstamp
+
+        outputs = []
+        try:
+            for task in tasks:
+                with span("figure", task=_task_name(task)):
+                    img = _draw_sat_image(cfg, ax, task)
+                    anno.txt.set_text(_annotation(cfg, task, track))
+                    with span("savefig"):
+                        fig.savefig(task["output"], **_savefig_kw(cfg))
+                    outputs.append(task["output"])
+                    if writer is not None:
+                        with span("animation_frame"):
+                            writer.grab_frame()
+                    img.remove()
+        finally:
+            if writer is not None:
+                writer.finish()
             plt.close(fig)
+    if writer is not None:
+        outputs.append(animation_path(cfg, tasks, animation))
+    return outputs
+
+
+def _task_name(task):
+    return (
+        f"flight {task['flight_id']} | {' | '.join(task['sat_opt'].values())}"
+        f" | {task['tstamp']:%Y-%m-%d %H:%M}"
+    )
+
+
+def _profile_path(cfg, name):
+    """Path to the cProfile statistics of a job"""
+    return (
+        cfg["output_dir"] / "profiles" / (re.sub(r"[^0-9A-Za-z]+", "_", name) + ".prof")
+    )
+
+
+def _run_job(func, args, profile=None):
+    """Run a job, optionally profiled with cProfile (saved to `profile`)"""
+    if profile is None:
+        return func(*args)
+    with spans.profiled(profile):
+        return func(*args)
+
 
+def _is_stale(task, force=False):
+    return force or not is_up_to_date(task["output"], task["inputs"])
 
-def main():
-    if use_concurrent:
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            executor.map(plotter, SCI_FLIGHTS.keys())
+
+def parse_shard(text):
+    """Parse a shard "i/n" (i-th of n parts, counting from 0)"""
+    i, n = map(int, text.split("/"))
+    assert 0 <= i < n, f"Invalid shard: {text}"
+    return i, n
+
+
+def make_jobs(cfg, tasks, shard=None):
+    """
+    Make a list of rendering jobs, skipping figures that are up to date
+
+    Jobs are numbered in a fixed order (one job per task or, in the sequence
+    mode, per sequence of tasks), and a shard (i, n) keeps the jobs with
+    numbers i, i + n, i + 2n, ..., so that the same plan can be split
+    between several machines.
+
+    Returns
+    -------
+    jobs: list of tuple
+        (name, function, arguments, tasks) for each job
+    """
+    if cfg["sequence"]:
+        groups = make_sequences(tasks)
     else:
-        for flight_id in ["294"]:  # SCI_FLIGHTS.keys():
-            plotter(flight_id)
+        groups = [[task] for task in tasks]
+    if shard is not None:
+        i, n = shard
+        groups = groups[i::n]
+
+    force = cfg["force"]
+    animation = cfg["animation"]
+    jobs = []
+    for seq in groups:
+        if not cfg["sequence"]:
+            if _is_stale(seq[0], force=force):
+                jobs.append((_task_name(seq[0]), plotter, (cfg, seq[0]), seq))
+            continue
+        if animation is not None:
+            # An animation needs all the frames
+            inputs = [i for task in seq for i in task["inputs"]]
+            if not any(_is_stale(task, force=force) for task in seq) and (
+                is_up_to_date(animation_path(cfg, seq, animation), inputs)
+            ):
+                continue
+        else:
+            seq = [task for task in seq if _is_stale(task, force=force)]
+            if len(seq) == 0:
+                continue
+        name = f"{_task_name(seq[0])} (+{len(seq) - 1} more)"
+        jobs.append((name, render_sequence, (cfg, seq), seq))
+    return jobs
+
+
+def make_plan(cfg, shard=None, tasks=None):
+    """
+    Plan a run: what to prepare and which figures to render
+
+    Arguments
+    ---------
+    cfg: dict
+        Configuration (see `make_config()`)
+    shard: tuple, optional
+        Shard (i, n) of the jobs (see `make_jobs()`)
+    tasks: list of dict, optional
+        Figures to plan; defaults to all figures (see `make_tasks()`)
+
+    Returns
+    -------
+    plan: dict
+        sic_dates: dates of sea ice data needed by the figures
+        mosaics: tasks with distinct reprojected images (see `mosaic`)
+        tasks: list of all tasks (see `make_tasks()`)
+        jobs: rendering jobs of this shard (see `make_jobs()`),
+        which depend only on the sea ice data and the reprojected images
+    """
+    if tasks is None:
+        tasks = make_tasks(cfg)
+    jobs = make_jobs(cfg, tasks, shard=shard)
+    sic_dates = []
+    if cfg["sic_dir"]:
+        flight_ids = {task["flight_id"] for *_, seq in jobs for task in seq}
+        sic_dates = sorted(
+            {datetime.strptime(FLIGHTS[i], "%Y%m%d") for i in flight_ids}
+        )
+    mosaics = {}
+    if cfg["mosaic"] is not None:
+        for *_, seq in jobs:
+            for task in seq:
+                mosaics.setdefault(_mosaic_key(cfg, task), task)
+    return dict(
+        sic_dates=sic_dates, mosaics=list(mosaics.values()), tasks=tasks, jobs=jobs
+    )
+
+
+def run_jobs(cfg, jobs):
+    """
+    Render figures in parallel
+
+    Returns
+    -------
+    errors: dict
+        Job name -> exception for the failed jobs
+    """
+    profile = cfg["profile"]
+    profiles = {
+        name: _profile_path(cfg, name) if profile and profile in name else None
+        for name, *_ in jobs
+    }
+    n_todo = sum(len(seq) for *_, seq in jobs)
+    errors = {}
+    n_failed = 0
+    if cfg["workers"] == 1:
+        for name, func, args, seq in jobs:
+            try:
+                for output in _run_job(func, args, profile=profiles[name]):
+                    print(f"Saved {output}")
+            except Exception as e:
+                errors[name] = e
+                n_failed += len(seq)
+    else:
+        # Workers record spans to the same log as this process
+        with concurrent.futures.ProcessPoolExecutor(
+            cfg["workers"] or None,
+            initializer=spans.configure,
+            initargs=(spans.log_file, spans.run_id, spans.enabled),
+        ) as executor:
+            futures = {
+                executor.submit(_run_job, func, args, profiles[name]): (name, seq)
+                for name, func, args, seq in jobs
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    for output in future.result():
+                        print(f"Saved {output}")
+                except Exception as e:
+                    name, seq = futures[future]
+                    errors[name] = e
+                    n_failed += len(seq)
+
+    print(f"{n_todo - n_failed} rendered, {n_failed} failed")
+    for name, e in errors.items():
+        print(f"\n{name}:")
+        print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+    return errors
+
+
+def run_plan(cfg, plan, keep_raw=False):
+    """
+    Prepare the sea ice data and the reprojected images,
+    and render the figures of a plan
+
+    The downloaded AMSR2 files are removed after ingestion
+    unless `keep_raw` is True (see `amsr2.ingest()`).
+    """
+    if plan["sic_dates"]:
+        import amsr2
+
+        # Fetch sea ice data for all flights in one go
+        amsr2.ingest(plan["sic_dates"], store_dir=cfg["sic_dir"], keep_raw=keep_raw)
+    if plan["mosaics"]:
+        # Reproject each image once, before the jobs that share it
+        n = len(plan["mosaics"])
+        if cfg["workers"] == 1:
+            for task in plan["mosaics"]:
+                _get_mosaic(cfg, task)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                cfg["workers"] or None,
+                initializer=spans.configure,
+                initargs=(spans.log_file, spans.run_id, spans.enabled),
+            ) as executor:
+                list(executor.map(_get_mosaic, [cfg] * n, plan["mosaics"]))
+        print(f"{n} reprojected images ready")
+    return run_jobs(cfg, plan["jobs"])
+
+
+# Dates in the names of input files, e.g. 20180301.zip
+DATE_REGEX = re.compile(r"(20[0-9]{6})")
+
+
+def _watch_inputs(cfg, task):
+    """
+    Input files of a figure in the watch mode: the MASIN file, the Dundee
+    archive and the AMSR2 file of the flight day, if there is one
+    in the sea ice directory (instead of the stamp of the store,
+    which is written by this program). Downloaded AMSR2 files are kept
+    in the watch mode, so that they are recorded as inputs.
+    """
+    import amsr2
+
+    inputs = [task["masin_file"], task["arch_file"]]
+    if cfg["sic_dir"]:
+        dt = datetime.strptime(FLIGHTS[task["flight_id"]], "%Y%m%d")
+        raw_file = amsr2.raw_file(dt, download_dir=cfg["sic_dir"])
+        if raw_file is not None:
+            inputs.append(raw_file)
+    return inputs
+
+
+def _affected_flights(cfg, paths):
+    """Flights whose figures may depend on the given input files"""
+    import masin
+
+    masin_files = {
+        str(masin.masin_file(i, masin_dir=cfg["masin_dir"])): i for i in cfg["flights"]
+    }
+    flight_ids = set()
+    for path in paths:
+        if path in masin_files:
+            flight_ids.add(masin_files[path])
+            continue
+        match = DATE_REGEX.search(Path(path).name)
+        if match is None:
+            continue
+        dt = datetime.strptime(match.group(1), "%Y%m%d")
+        for i in cfg["flights"]:
+            # images from the neighbouring days can be used too
+            if abs(datetime.strptime(FLIGHTS[i], "%Y%m%d") - dt) <= timedelta(days=1):
+                flight_ids.add(i)
+    return sorted(flight_ids)
+
+
+def watch(cfg, interval=10):
+    """
+    Render figures as their input files arrive or change
+
+    The Dundee, MASIN and AMSR2 directories are polled every `interval`
+    seconds (see `watcher.poll()`). The figures of the flights affected by
+    new or changed files are planned again, and those made from different
+    inputs (by content, as recorded in the manifest in the output
+    directory) are rendered by the worker pool. Figures that exist and are
+    newer than their inputs are adopted into the manifest without rendering,
+    unless `force` is True. Figures that failed (e.g. sea ice data not
+    available yet) are tried again after each poll. Runs until interrupted.
+    """
+    import watcher
+
+    manifest_file = cfg["output_dir"] / "watch_manifest.json"
+    manifest = watcher.load_manifest(manifest_file)
+    dirs = [cfg["arch_dir"], cfg["masin_dir"]]
+    patterns = ["*.zip", "*.nc"]
+    exclude = []
+    if cfg["sic_dir"]:
+        import amsr2
+
+        dirs.append(cfg["sic_dir"])
+        patterns += ["*.h5", "*.hdf"]
+        exclude.append(amsr2.store_path(store_dir=cfg["sic_dir"]))
+    print(f"Watching {', '.join(map(str, dirs))} every {interval} s")
+
+    force = cfg["force"]
+    # output path -> task of the figures that failed
+    failed = {}
+    for changed in watcher.poll(
+        dirs, manifest, interval=interval, patterns=patterns, exclude=exclude, idle=True
+    ):
+        flight_ids = _affected_flights(cfg, changed)
+        if not flight_ids and not failed:
+            if changed:
+                watcher.save_manifest(manifest, manifest_file)
+            continue
+        t0 = datetime.now()
+        tasks = []
+        for flight_id in flight_ids:
+            try:
+                tasks += make_tasks(dict(cfg, flights=[flight_id]))
+            except Exception as e:
+                # inputs can be incomplete while files are arriving
+                print(f"Flight {flight_id}: unable to plan figures ({e!r})")
+        planned = {task["output"] for task in tasks}
+        tasks += [task for output, task in failed.items() if output not in planned]
+        failed = {}
+        stale = []
+        for task in tasks:
+            inputs = _watch_inputs(cfg, task)
+            if watcher.is_current(manifest, task["output"], inputs):
+                continue
+            if not force and is_up_to_date(task["output"], inputs):
+                watcher.record(manifest, task["output"], inputs)
+                continue
+            stale.append(task)
+        force = False
+        for i, task in enumerate(stale):
+            task["index"] = i
+        print(
+            f"{len(changed)} changed files: {len(stale)} of {len(tasks)} figures"
+            f" of flights {', '.join(sorted({t['flight_id'] for t in tasks}))}"
+            " to render"
+        )
+        if stale:
+            plan = make_plan(dict(cfg, force=True), tasks=stale)
+            try:
+                errors = run_plan(cfg, plan, keep_raw=True)
+            except Exception as e:
+                # e.g. sea ice data not available yet: try again after the next poll
+                print(f"Unable to prepare the figures ({e!r})")
+                errors = {name: e for name, *_ in plan["jobs"]}
+            for name, func, args, seq in plan["jobs"]:
+                for task in seq:
+                    if name in errors:
+                        failed[task["output"]] = task
+                        continue
+                    inputs = _watch_inputs(cfg, task)
+                    # (e.g. the AMSR2 file downloaded for the figure)
+                    watcher.add_files(manifest, inputs)
+                    watcher.record(manifest, task["output"], inputs)
+            print(f"Done in {(datetime.now() - t0).total_seconds():.1f} s")
+        watcher.save_manifest(manifest, manifest_file)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("--spec", type=Path, help="JSON file with the job spec")
+    ap.add_argument("--flights", nargs="+", help="Flight numbers")
+    ap.add_argument(
+        "--sat-opts",
+        nargs="+",
+        metavar="INSTRUMENT/PLATFORM/CHANNEL",
+        help="Satellite image options, e.g. viirs/npp/m05",
+    )
+    ap.add_argument("--sea-ice", choices=["amsr2", "none"], help="Sea ice data")
+    ap.add_argument(
+        "--extent", nargs=4, type=float, metavar=("LON0", "LON1", "LAT0", "LAT1")
+    )
+    ap.add_argument("--ticks", nargs=2, type=float, metavar=("DLON", "DLAT"))
+    ap.add_argument("--zoom-str", help="String added to the file names")
+    ap.add_argument("--sat-stride", type=int, help="Stride of image pixels")
+    ap.add_argument(
+        "--flt-tolerance",
+        type=float,
+        help="Horizontal tolerance of flight track simplification [m]",
+    )
+    ap.add_argument(
+        "--flt-alt-tolerance",
+        type=float,
+        help="Altitude tolerance of flight track simplification [m]",
+    )
+    ap.add_argument(
+        "--flt-simplify",
+        choices=["douglas_peucker", "visvalingam"],
+        help="Flight track simplification algorithm",
+    )
+    ap.add_argument(
+        "--flt-stride",
+        type=int,
+        help="Stride of flight track points (used with --flt-tolerance 0)",
+    )
+    ap.add_argument("--dpi", type=int, help="Resolution of the figures")
+    ap.add_argument("--workers", type=int, help="Number of worker processes")
+    ap.add_argument(
+        "--sequence",
+        action=argparse.BooleanOptionalAction,
+        help="Render figures of a flight with the same base map",
+    )
+    ap.add_argument("--animation", choices=list(ANIMATION_WRITERS))
+    ap.add_argument(
+        "--footprints",
+        dest="use_footprints",
+        action=argparse.BooleanOptionalAction,
+        help="Choose images covering the flight track",
+    )
+    ap.add_argument(
+        "--mosaic",
+        choices=["scene", "hour", "none"],
+        help="Show images reprojected to the map grid",
+    )
+    ap.add_argument("--arch-dir", type=Path, help="Directory of Dundee archives")
+    ap.add_argument("--masin-dir", type=Path, help="Directory of MASIN data")
+    ap.add_argument("--sic-dir", type=Path, help="Directory of the AMSR2 store")
+    ap.add_argument("--output-dir", type=Path, help="Directory of the figures")
+    ap.add_argument("--force", action="store_true", default=None)
+    ap.add_argument("--profile", metavar="NAME", help="Profile the matching jobs")
+    ap.add_argument("--shard", type=parse_shard, metavar="I/N", help="Run a shard")
+    ap.add_argument(
+        "--watch",
+        type=float,
+        nargs="?",
+        const=10,
+        metavar="SECONDS",
+        help="Keep rendering figures as input files arrive, polling every SECONDS",
+    )
+    ap.add_argument(
+        "--dry-run", action="store_true", help="Print the plan without rendering"
+    )
+    ap.add_argument(
+        "--print-spec", action="store_true", help="Print the full job spec and exit"
+    )
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spec = {}
+    if args.spec is not None:
+        with args.spec.open("r") as f:
+            spec = json.load(f)
+    # (None values of the options mean "not given")
+    for key in ("sea_ice", "mosaic"):
+        if getattr(args, key) == "none":
+            spec[key] = None
+            setattr(args, key, None)
+    if args.flt_tolerance == 0:
+        spec["flt_tolerance"] = None
+        args.flt_tolerance = None
+    sat_opts = None
+    if args.sat_opts is not None:
+        sat_opts = [
+            dict(zip(("instrument", "platform", "channel"), i.split("/")))
+            for i in args.sat_opts
+        ]
+    options = {
+        key: getattr(args, key)
+        for key in DEFAULT_CONFIG
+        if key != "sat_opts" and hasattr(args, key)
+    }
+    cfg = make_config(spec, sat_opts=sat_opts, **options)
+    if args.print_spec:
+        # (can be saved and used as --spec)
+        spec = dict(cfg, max_sat_offset=cfg["max_sat_offset"] / timedelta(hours=1))
+        print(json.dumps(spec, indent=2, default=str))
+        return
+
+    spans.configure(
+        log=cfg["spans_log"],
+        # without a log file, the summary needs the records in memory
+        keep=(
+            spans.SUMMARY_RECORDS
+            if cfg["spans_summary"] and cfg["spans_log"] is None
+            else 0
+        ),
+    )
+    if args.watch is not None:
+        try:
+            watch(cfg, interval=args.watch)
+        except KeyboardInterrupt:
+            pass
+        return
+    plan = make_plan(cfg, shard=args.shard)
+    n_todo = sum(len(seq) for *_, seq in plan["jobs"])
+    print(
+        f"{len(plan['tasks'])} figures: {n_todo} to render"
+        f" in {len(plan['jobs'])} jobs"
+    )
+    if args.dry_run:
+        for name, *_ in plan["jobs"]:
+            print(name)
+        return
+    errors = run_plan(cfg, plan)
+    if cfg["spans_summary"]:
+        # records of all processes of this run
+        spans.summary(
+            None
+            if cfg["spans_log"] is None
+            else spans.read_log(cfg["spans_log"], run=spans.run_id)
+        )
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Catalogue of footprints of satellite images
+
+The footprint of an image is the polygon of its valid (non-empty) pixels.
+Footprints are extracted once per day archive from a decimated read of each
+image and stored in a JSON file in the cache directory, like the image
+indices in `sat_tools.get_sat_index()`. A catalogue of many archives has
+a spatial index (STRtree) and a time index, so questions like "which image
+covers this flight track best within 3 hours of this time" are answered
+without opening any image.
+"""
+from datetime import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+from zipfile import ZipFile
+
+import cartopy.crs as ccrs
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+import rasterio.features
+import shapely
+import shapely.geometry as sgeom
+from shapely.strtree import STRtree
+
+import mypaths
+import sat_tools
+
+# Bump the version if the structure of the cached footprints changes
+FOOTPRINTS_VERSION = 1
+# Common projection of the footprints (all Dundee images are polar stereographic)
+CATALOGUE_CRS = ccrs.NorthPolarStereo()
+# Size of the decimated image used to find the valid pixels
+MASK_SIZE = 256
+# Value of empty pixels if the image does not define it
+DEFAULT_NODATA = 0
+
+
+def _to_catalogue_crs(geom, src_crs):
+    """Transform a shapely geometry to `CATALOGUE_CRS`"""
+    return shapely.transform(
+        geom,
+        lambda xy: CATALOGUE_CRS.transform_points(src_crs, xy[:, 0], xy[:, 1])[:, :2],
+    )
+
+
+def image_footprint(filename, mask_size=MASK_SIZE):
+    """
+    Get the footprint of a satellite image
+
+    Only the header and a decimated copy of the image are read.
+
+    Arguments
+    ---------
+    filename: str
+        Path to the GeoTIFF file, or to a member of a zip archive
+        (see `sat_tools.zip_member_path()`)
+    mask_size: int, optional
+        Maximum size of the decimated image
+
+    Returns
+    -------
+    shapely geometry in `CATALOGUE_CRS` (empty if there are no valid pixels)
+    """
+    with rasterio.open(filename, "r") as src:
+        crs = sat_tools.stereo_crs(src.crs)
+        step = max(src.width / mask_size, src.height / mask_size, 1)
+        shape = (max(int(src.height / step), 1), max(int(src.width / step), 1))
+        data = src.read(1, out_shape=shape, resampling=Resampling.nearest)
+        nodata = DEFAULT_NODATA if src.nodata is None else src.nodata
+        transform = src.transform * src.transform.scale(
+            src.width / shape[1], src.height / shape[0]
+        )
+    valid = (data != nodata).astype("u1")
+    polygons = [
+        sgeom.shape(geom)
+        for geom, _ in rasterio.features.shapes(valid, mask=valid, transform=transform)
+    ]
+    footprint = shapely.union_all(polygons).simplify(abs(transform[0]))
+    return _to_catalogue_crs(footprint, crs)
+
+
+def build_footprints(arch_file, ext="tif"):
+    """
+    Get footprints of all images in a Dundee day archive
+
+    Returns
+    -------
+    entries: list of dict
+        Each dict contains fname (file name), zfile (archive member),
+        time, keys (satellite options, see `sat_tools.sat_opt_key()`)
+        and footprint (shapely geometry in `CATALOGUE_CRS`)
+    """
+    with ZipFile(arch_file) as z:
+        members = [i for i in z.namelist() if i.endswith(ext)]
+    fnames = [Path(i).name for i in members]
+    keys = {fname: [] for fname in fnames}
+    for key, (_, selected) in sat_tools.build_sat_index(fnames).items():
+        for fname in selected:
+            keys[fname].append(key)
+
+    entries = []
+    for member, fname in zip(members, fnames):
+        timestamp = sat_tools.parse_sat_timestamp(fname)
+        if timestamp is None:
+            continue
+        entries.append(
+            dict(
+                fname=fname,
+                zfile=member,
+                time=timestamp,
+                keys=keys[fname],
+                footprint=image_footprint(sat_tools.zip_member_path(arch_file, member)),
+            )
+        )
+    return entries
+
+
+def get_footprints(arch_file, ext="tif", cache_dir=None):
+    """
+    Get footprints of all images in a Dundee day archive
+
+    Footprints are extracted once and then kept in a JSON file
+    in the cache directory, which is refreshed when the size or the
+    modification time of the archive changes.
+
+    Returns
+    -------
+    entries: list of dict
+        see `build_footprints()`
+    """
+    arch_file = Path(arch_file).resolve()
+    stat = arch_file.stat()
+    stamp = dict(
+        version=FOOTPRINTS_VERSION,
+        source=str(arch_file),
+        ext=ext,
+        mtime=stat.st_mtime_ns,
+        size=stat.st_size,
+    )
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    path_hash = hashlib.sha1(f"{arch_file}:{ext}".encode()).hexdigest()[:12]
+    cache_file = cache_dir / "footprints" / f"{arch_file.stem}_{path_hash}.json"
+
+    if cache_file.is_file():
+        with cache_file.open("r") as f:
+            cached = json.load(f)
+        if cached.get("stamp") == stamp:
+            return [
+                dict(
+                    entry,
+                    time=datetime.strptime(entry["time"], sat_tools.SAT_TIMESTAMP_FMT),
+                    footprint=shapely.from_wkt(entry["footprint"]),
+                )
+                for entry in cached["entries"]
+            ]
+
+    entries = build_footprints(arch_file, ext=ext)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with tmp_file.open("w") as f:
+        json.dump(
+            dict(
+                stamp=stamp,
+                entries=[
+                    dict(
+                        entry,
+                        time=f"{entry['time']:{sat_tools.SAT_TIMESTAMP_FMT}}",
+                        footprint=shapely.to_wkt(
+                            entry["footprint"], rounding_precision=0
+                        ),
+                    )
+                    for entry in entries
+                ],
+            ),
+            f,
+        )
+    tmp_file.replace(cache_file)
+    return entries
+
+
+def build_catalogue(arch_files, ext="tif", cache_dir=None):
+    """
+    Build a catalogue of footprints of images in several Dundee day archives
+
+    Returns
+    -------
+    catalogue: dict
+        entries: list of dict (see `build_footprints()`), sorted by time
+        times: numpy array of datetime64 of the entries
+        tree: shapely.strtree.STRtree of the footprints
+    """
+    entries = []
+    for arch_file in arch_files:
+        for entry in get_footprints(arch_file, ext=ext, cache_dir=cache_dir):
+            entries.append(dict(entry, arch_file=Path(arch_file)))
+    entries.sort(key=lambda entry: entry["time"])
+    return dict(
+        entries=entries,
+        times=np.array([entry["time"] for entry in entries], dtype="M8[s]"),
+        tree=STRtree([entry["footprint"] for entry in entries]),
+    )
+
+
+def track_geometry(lons, lats):
+    """Line of a flight track (or a point) in `CATALOGUE_CRS`"""
+    xyz = CATALOGUE_CRS.transform_points(
+        ccrs.Geodetic(), np.asarray(lons, dtype="f8"), np.asarray(lats, dtype="f8")
+    )
+    xy = xyz[np.isfinite(xyz[:, :2]).all(axis=1), :2]
+    if len(xy) == 1:
+        return sgeom.Point(xy[0])
+    return sgeom.LineString(xy)
+
+
+def extent_geometry(extent, crs=None):
+    """Polygon of an extent (x0, x1, y0, y1) in `CATALOGUE_CRS`"""
+    if crs is None:
+        crs = ccrs.PlateCarree()
+    x0, x1, y0, y1 = extent
+    xs = np.linspace(x0, x1, 50)
+    ys = np.linspace(y0, y1, 50)
+    xx = np.concatenate([xs, np.full(50, x1), xs[::-1], np.full(50, x0)])
+    yy = np.concatenate([np.full(50, y0), ys, np.full(50, y1), ys[::-1]])
+    xyz = CATALOGUE_CRS.transform_points(crs, xx, yy)
+    return sgeom.Polygon(xyz[:, :2])
+
+
+def coverage(footprint, geom):
+    """Fraction of a geometry (area, length or point) covered by a footprint"""
+    if geom.area > 0:
+        return footprint.intersection(geom).area / geom.area
+    if geom.length > 0:
+        return footprint.intersection(geom).length / geom.length
+    return float(footprint.intersects(geom))
+
+
+def find_scenes(catalogue, geom, start, end, sat_opt=None):
+    """
+    Find images intersecting a geometry within a time window
+
+    Arguments
+    ---------
+    catalogue: dict
+        Output of `build_catalogue()`
+    geom: shapely geometry
+        Area of interest in `CATALOGUE_CRS` (see `track_geometry()`
+        and `extent_geometry()`)
+    start, end: datetime.datetime
+        Time window
+    sat_opt: dict, optional
+        Satellite image options: instrument, channel, platform
+
+    Returns
+    -------
+    list of dict
+        Matching entries of the catalogue with their `coverage` of `geom`
+    """
+    times = catalogue["times"]
+    i0 = np.searchsorted(times, np.datetime64(start))
+    i1 = np.searchsorted(times, np.datetime64(end), side="right")
+    in_window = np.arange(i0, i1)
+    candidates = np.intersect1d(catalogue["tree"].query(geom), in_window)
+    key = None if sat_opt is None else sat_tools.sat_opt_key(**sat_opt)
+    found = []
+    for i in candidates:
+        entry = catalogue["entries"][i]
+        if key is not None and key not in entry["keys"]:
+            continue
+        frac = coverage(entry["footprint"], geom)
+        if frac > 0:
+            found.append(dict(entry, coverage=frac))
+    return found
+
+
+def best_scene(catalogue, geom, dt, max_offset, sat_opt=None, min_coverage=0):
+    """
+    Find the image covering a geometry best within `max_offset` of `dt`
+
+    Images with larger coverage (in percent, rounded) are preferred;
+    of equally covering images, the one closest in time is chosen.
+
+    Arguments
+    ---------
+    catalogue: dict
+        Output of `build_catalogue()`
+    geom: shapely geometry
+        Area of interest in `CATALOGUE_CRS`
+    dt: datetime.datetime
+        Target time
+    max_offset: datetime.timedelta
+        Half-width of the time window
+    sat_opt: dict, optional
+        Satellite image options: instrument, channel, platform
+    min_coverage: float, optional
+        Minimum fraction of `geom` covered by the image
+
+    Returns
+    -------
+    dict or None
+        Entry of the catalogue with its `coverage`, or None if nothing is found
+    """
+    found = [
+        entry
+        for entry in find_scenes(
+            catalogue, geom, dt - max_offset, dt + max_offset, sat_opt=sat_opt
+        )
+        if entry["coverage"] >= min_coverage
+    ]
+    if len(found) == 0:
+        return None
+    return max(
+        found,
+        key=lambda entry: (round(100 * entry["coverage"]), -abs(entry["time"] - dt)),
+    )
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to load MASIN aircraft data
+"""
+from datetime import datetime
+import re
+
+import numpy as np
+import xarray as xr
+
+import mypaths
+from common_defs import FLIGHTS, MASIN_FILE_MASK
+
+# Variables of a flight track: track key -> MASIN variable name
+TRACK_VARS = dict(lon="LON_OXTS", lat="LAT_OXTS", alt="ALT_OXTS")
+# Time units of MASIN files, e.g. "seconds since 2018-03-01 00:00:00 +0000"
+TIME_UNITS_REGEX = re.compile(
+    r"seconds since\s+(?P<date>[0-9]{4}-[0-9]{2}-[0-9]{2})"
+    r"(?:[ T](?P<time>[0-9]{2}:[0-9]{2}:[0-9]{2}))?"
+)
+
+
+def masin_file(flight_id, masin_dir=None):
+    """Path to the 1 Hz MASIN file of a given flight"""
+    if masin_dir is None:
+        masin_dir = mypaths.masin_dir
+    flight_date = datetime.strptime(FLIGHTS[flight_id], "%Y%m%d")
+    return (
+        masin_dir
+        / f"flight{flight_id}"
+        / MASIN_FILE_MASK.format(flight_date=flight_date, flight_id=flight_id)
+    )
+
+
+def decode_time(values, units, ref_date=None):
+    """
+    Convert MASIN time values to numpy datetime64 in one operation
+
+    Arguments
+    ---------
+    values: numpy array
+        Number of seconds since the reference time
+    units: str
+        Units attribute of the time variable
+    ref_date: datetime.datetime, optional
+        Reference time used if it cannot be read from `units`
+
+    Returns
+    -------
+    numpy array of datetime64[ms]
+    """
+    match = TIME_UNITS_REGEX.match(units.strip())
+    if match is not None:
+        ref = np.datetime64(
+            f"{match.group('date')}T{match.group('time') or '00:00:00'}"
+        )
+    else:
+        assert ref_date is not None, f"Unable to decode time units: {units}"
+        ref = np.datetime64(ref_date)
+    offset = np.round(np.asarray(values, dtype="f8") * 1e3).astype("timedelta64[ms]")
+    return ref.astype("datetime64[ms]") + offset
+
+
+def load_track(flight_id, stride=1, variables=None, masin_dir=None, valid_only=True):
+    """
+    Load a flight track from a MASIN file
+
+    Only the requested variables are read from the file.
+
+    Arguments
+    ---------
+    flight_id: str
+        Flight number, e.g. "294"
+    stride: int, optional
+        Use every `stride`-th point of the track
+    variables: dict, optional
+        Track key -> MASIN variable name; defaults to `TRACK_VARS`
+        (must contain "alt" if `valid_only` is True)
+    masin_dir: pathlib.Path, optional
+        Directory with MASIN data; defaults to `mypaths.masin_dir`
+    valid_only: bool, optional
+        Drop the points with missing altitude
+
+    Returns
+    -------
+    track: dict
+        flight_id: flight number
+        time: numpy array of datetime64[ms]
+        <key>: numpy array for each of `variables`
+        units: dict of units of the variables
+    """
+    if variables is None:
+        variables = TRACK_VARS
+    flight_date = datetime.strptime(FLIGHTS[flight_id], "%Y%m%d")
+    with xr.open_dataset(
+        masin_file(flight_id, masin_dir=masin_dir), decode_times=False
+    ) as ds:
+        time = ds["Time"]
+        time_values = decode_time(
+            time.values, time.attrs.get("units", ""), ref_date=flight_date
+        )
+        data = {key: ds[name].values for key, name in variables.items()}
+        units = {
+            key: ds[name].attrs.get("units", "").strip()
+            for key, name in variables.items()
+        }
+
+    if valid_only:
+        (idx,) = np.nonzero(~np.isnan(data["alt"]))
+        idx = idx[::stride]
+    else:
+        idx = slice(None, None, stride)
+
+    track = dict(flight_id=flight_id, time=time_values[idx], units=units)
+    for key, values in data.items():
+        track[key] = values[idx]
+    return track
+
+
+def load_tracks(flight_ids, **kwargs):
+    """Load several flight tracks (see `load_track()` for the arguments)"""
+    return {flight_id: load_track(flight_id, **kwargs) for flight_id in flight_ids}
+
+
+def _vertical_errors(z, t, i, i0, i1, alt_tolerance):
+    """
+    Deviation of the altitude of points `i` from its linear interpolation
+    in time between points `i0` and `i1`, in units of `alt_tolerance`
+    """
+    dt = t[i1] - t[i0]
+    w = np.where(dt > 0, (t[i] - t[i0]) / np.where(dt > 0, dt, 1), 0)
+    return np.abs(z[i] - (z[i0] + w * (z[i1] - z[i0]))) / alt_tolerance
+
+
+def douglas_peucker(x, y, tolerance, z=None, t=None, alt_tolerance=None):
+    """
+    Simplify a line by the Douglas-Peucker algorithm
+
+    Instead of recursing into each segment, all segments of the simplified
+    line are split at once, so each step is a few array operations
+    over all points.
+
+    Arguments
+    ---------
+    x, y: numpy array
+        Projected coordinates of the points [m]
+    tolerance: float
+        Maximum distance between the points and the simplified line [m]
+    z: numpy array, optional
+        Altitude of the points [m]
+    t: numpy array, optional
+        Time of the points [s] (used to interpolate the altitude);
+        defaults to the point number
+    alt_tolerance: float, optional
+        Maximum difference between the altitude and its linear interpolation
+        between the retained points [m] (required with `z`)
+
+    Returns
+    -------
+    numpy array of int
+        Sorted indices of the retained points (including the first and the last)
+    """
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+    if z is not None:
+        assert alt_tolerance is not None, "Altitude tolerance is required"
+        if t is None:
+            t = np.arange(n, dtype="f8")
+    points = np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    while True:
+        idx = np.flatnonzero(keep)
+        # segment of the simplified line to which each point belongs
+        seg = np.minimum(np.searchsorted(idx, points, side="right") - 1, len(idx) - 2)
+        i0, i1 = idx[seg], idx[seg + 1]
+        # distance to the segment (not the whole line, for closed loops)
+        dx, dy = x[i1] - x[i0], y[i1] - y[i0]
+        px, py = x - x[i0], y - y[i0]
+        len2 = dx * dx + dy * dy
+        u = np.clip((px * dx + py * dy) / np.where(len2 > 0, len2, 1), 0, 1)
+        err = np.hypot(px - u * dx, py - u * dy) / tolerance
+        if z is not None:
+            err = np.maximum(err, _vertical_errors(z, t, points, i0, i1, alt_tolerance))
+        err[idx] = 0
+        # split each segment at its farthest point beyond the tolerance
+        seg_max = np.maximum.reduceat(err, idx[:-1])
+        (split,) = np.nonzero((err > 1) & (err == seg_max[seg]))
+        if len(split) == 0:
+            return idx
+        _, first = np.unique(seg[split], return_index=True)
+        keep[split[first]] = True
+
+
+def visvalingam(x, y, tolerance, z=None, t=None, alt_tolerance=None):
+    """
+    Simplify a line by the Visvalingam-Whyatt algorithm
+
+    Points are removed in rounds: in each round, all points that are local
+    minima of the effective area (and not next to each other) are removed
+    at once, so a round is a few array operations over all points.
+
+    Arguments
+    ---------
+    x, y: numpy array
+        Projected coordinates of the points [m]
+    tolerance: float
+        Square root of the smallest effective area of the retained points [m]
+    z, t, alt_tolerance: optional
+        Altitude, time and altitude tolerance (see `douglas_peucker()`)
+
+    Returns
+    -------
+    numpy array of int
+        Sorted indices of the retained points (including the first and the last)
+    """
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+    if z is not None:
+        assert alt_tolerance is not None, "Altitude tolerance is required"
+        if t is None:
+            t = np.arange(n, dtype="f8")
+    idx = np.arange(n)
+    while len(idx) > 2:
+        i0, i, i1 = idx[:-2], idx[1:-1], idx[2:]
+        area = 0.5 * np.abs(
+            (x[i] - x[i0]) * (y[i1] - y[i0]) - (x[i1] - x[i0]) * (y[i] - y[i0])
+        )
+        err = area / tolerance**2
+        if z is not None:
+            err = np.maximum(err, _vertical_errors(z, t, i, i0, i1, alt_tolerance))
+        padded = np.concatenate([[np.inf], err, [np.inf]])
+        cand = (err < 1) & (err <= padded[:-2]) & (err <= padded[2:])
+        if not cand.any():
+            break
+        # of two neighbouring candidates (equal areas), remove only one
+        cand_pad = np.concatenate([[False], cand, [False]])
+        lonely = ~(cand_pad[:-2] | cand_pad[2:])
+        remove = cand & (lonely | (np.arange(len(cand)) % 2 == 0))
+        idx = np.concatenate([idx[:1], i[~remove], idx[-1:]])
+    return idx
+
+
+# Line simplification algorithms (see `simplify_track()`)
+SIMPLIFY_METHODS = dict(douglas_peucker=douglas_peucker, visvalingam=visvalingam)
+
+
+def simplify_track(
+    track, tolerance=100, alt_tolerance=25, crs=None, method="douglas_peucker"
+):
+    """
+    Select the points of a flight track needed to draw it within given tolerances
+
+    Straight transits are reduced to a few points, while turns and
+    profiles keep as many as they need.
+
+    Arguments
+    ---------
+    track: dict
+        Flight track (see `load_track()`) without missing values
+    tolerance: float, optional
+        Horizontal tolerance [m] (see `douglas_peucker()` and `visvalingam()`)
+    alt_tolerance: float, optional
+        Altitude tolerance [m]; None to simplify the horizontal track only
+    crs: cartopy.crs.Projection, optional
+        Projection in metres, e.g. of the map; defaults to an azimuthal
+        equidistant projection centred on the track
+    method: str, optional
+        Algorithm, one of `SIMPLIFY_METHODS`
+
+    Returns
+    -------
+    numpy array of int
+        Sorted indices of the retained points, to be used with all variables
+        of the track (see `subset_track()`)
+    """
+    import cartopy.crs as ccrs
+
+    assert method in SIMPLIFY_METHODS, f"Unknown simplification method: {method}"
+    lon, lat = np.asarray(track["lon"]), np.asarray(track["lat"])
+    if len(lon) == 0:
+        return np.arange(0)
+    if crs is None:
+        crs = ccrs.AzimuthalEquidistant(
+            central_longitude=float(np.mean(lon)), central_latitude=float(np.mean(lat))
+        )
+    xyz = crs.transform_points(ccrs.Geodetic(), lon, lat)
+    kw = {}
+    if alt_tolerance is not None:
+        kw = dict(
+            z=np.asarray(track["alt"], dtype="f8"),
+            t=(track["time"] - track["time"][0]) / np.timedelta64(1, "s"),
+            alt_tolerance=alt_tolerance,
+        )
+    return SIMPLIFY_METHODS[method](xyz[:, 0], xyz[:, 1], tolerance, **kw)
+
+
+def subset_track(track, idx):
+    """Select points of a flight track, keeping all of its variables aligned"""
+    return {
+        key: value[idx] if isinstance(value, np.ndarray) else value
+        for key, value in track.items()
+    }
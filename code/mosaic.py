@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Satellite images reprojected to the IGP map grid
+
+Drawing a polar stereographic Dundee image on a map in the IGP projection
+(see `cart.igp_projection()`) makes cartopy regrid the image every time
+a figure is drawn. Here, each image is instead reprojected once to a fixed
+grid in the IGP projection and stored in the cache directory as a
+Cloud-Optimized GeoTIFF: tiled (`TILE_SIZE`), compressed, with overviews
+for the coarser zoom levels. Images from the same hour can also be
+combined into a mosaic. Figures then read only the window within the map
+at the zoom level matching their resolution and show it with a plain
+`imshow` in the map projection, without any warping at draw time.
+
+The grid covers the default area of `cart.ukmo_igp_map()` at the native
+resolution of the images (`GRID_RES`, zoom level 0); zoom level z
+has pixels 2**z times larger. Maps of larger areas cannot use the grid
+(see `covers()`). Tiles are numbered from the upper left
+corner of the grid (see `tile_bounds()` and `read_tile()`).
+"""
+from datetime import timedelta
+from functools import lru_cache
+import os
+from pathlib import Path
+
+from affine import Affine
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
+
+import cart
+import mypaths
+import sat_tools
+from spans import traced
+
+# Bump the version if the reprojected images change
+MOSAIC_VERSION = 1
+# Area of the grid (lon0, lon1, lat0, lat1), see `cart.ukmo_igp_map()`
+GRID_EXTENT = (-34, -7.8, 61, 75.2)
+# Pixel size at zoom level 0 [m] (same as the Dundee mapping6_500 images)
+GRID_RES = 500
+# Size of the tiles [pixels]
+TILE_SIZE = 256
+# Number of zoom levels (level 0 and the overviews)
+ZOOM_LEVELS = 4
+# Value of empty pixels
+NODATA = 0
+# Creation options of the GeoTIFF files
+COG_PROFILE = dict(
+    driver="COG",
+    compress="deflate",
+    predictor=2,
+    blocksize=TILE_SIZE,
+    overview_resampling="nearest",
+    overview_count=ZOOM_LEVELS - 1,
+)
+
+
+@lru_cache(maxsize=1)
+def grid():
+    """
+    Grid of the mosaics in the IGP projection
+
+    The grid is aligned to `GRID_RES * TILE_SIZE` and has a whole number
+    of tiles.
+
+    Returns
+    -------
+    dict
+        crs (cartopy projection), rio_crs (rasterio CRS), transform
+        (affine transform of zoom level 0), width and height [pixels]
+    """
+    proj = cart.igp_projection()
+    x0, x1, y0, y1 = cart.project_extent(GRID_EXTENT, proj)
+    step = GRID_RES * TILE_SIZE
+    x0, y0 = np.floor(x0 / step) * step, np.floor(y0 / step) * step
+    x1, y1 = np.ceil(x1 / step) * step, np.ceil(y1 / step) * step
+    return dict(
+        crs=proj,
+        rio_crs=CRS.from_wkt(proj.to_wkt()),
+        transform=Affine(GRID_RES, 0, x0, 0, -GRID_RES, y1),
+        width=int(round((x1 - x0) / GRID_RES)),
+        height=int(round((y1 - y0) / GRID_RES)),
+    )
+
+
+def covers(bounds):
+    """Check if the grid covers given bounds (x0, x1, y0, y1) in the IGP projection"""
+    g = grid()
+    x0, x1, y0, y1 = bounds
+    gx0, gy1 = g["transform"] * (0, 0)
+    gx1, gy0 = g["transform"] * (g["width"], g["height"])
+    return gx0 <= x0 and x1 <= gx1 and gy0 <= y0 and y1 <= gy1
+
+
+def zoom_level(res):
+    """Coarsest zoom level with pixels not larger than `res` [m]"""
+    level = int(np.floor(np.log2(max(res / GRID_RES, 1))))
+    return min(level, ZOOM_LEVELS - 1)
+
+
+def tile_bounds(z, x, y):
+    """Bounds (x0, x1, y0, y1) of tile column `x` and row `y` at zoom level `z`"""
+    g = grid()
+    size = TILE_SIZE * GRID_RES * 2**z
+    x0 = g["transform"].c + x * size
+    y1 = g["transform"].f - y * size
+    return x0, x0 + size, y1 - size, y1
+
+
+def grid_window(bounds):
+    """
+    Window of the grid covering given bounds (x0, x1, y0, y1),
+    aligned to the tiles, or None if it is outside of the grid
+    """
+    g = grid()
+    x0, x1, y0, y1 = bounds
+    window = from_bounds(x0, y0, x1, y1, transform=g["transform"])
+    col0 = max(int(np.floor(window.col_off / TILE_SIZE)) * TILE_SIZE, 0)
+    row0 = max(int(np.floor(window.row_off / TILE_SIZE)) * TILE_SIZE, 0)
+    col1 = min(
+        int(np.ceil((window.col_off + window.width) / TILE_SIZE)) * TILE_SIZE,
+        g["width"],
+    )
+    row1 = min(
+        int(np.ceil((window.row_off + window.height) / TILE_SIZE)) * TILE_SIZE,
+        g["height"],
+    )
+    if col1 <= col0 or row1 <= row0:
+        return None
+    return Window(col0, row0, col1 - col0, row1 - row0)
+
+
+def _source_stamp(arch_file):
+    stat = Path(arch_file).stat()
+    return dict(
+        MOSAIC_VERSION=str(MOSAIC_VERSION),
+        SOURCE=str(Path(arch_file).resolve()),
+        SOURCE_MTIME=str(stat.st_mtime_ns),
+        SOURCE_SIZE=str(stat.st_size),
+    )
+
+
+def _is_valid(target, stamp):
+    """Check if a stored image was made from the current version of the source"""
+    if not target.is_file():
+        return False
+    with rasterio.open(target, "r") as src:
+        tags = src.tags()
+    return all(tags.get(key) == value for key, value in stamp.items())
+
+
+def _write(target, data, window, stamp):
+    """Write a window of the grid as a Cloud-Optimized GeoTIFF (atomically)"""
+    g = grid()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = target.with_suffix(f".{os.getpid()}.tmp")
+    with rasterio.open(
+        tmp_file,
+        "w",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        crs=g["rio_crs"],
+        transform=rasterio.windows.transform(window, g["transform"]),
+        nodata=NODATA,
+        **COG_PROFILE,
+    ) as dst:
+        dst.write(data, 1)
+        dst.update_tags(**stamp)
+    tmp_file.replace(target)
+    return target
+
+
+def mosaic_dir(arch_file, cache_dir=None):
+    """Directory of the reprojected images of a Dundee day archive"""
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    return cache_dir / "mosaic" / Path(arch_file).stem
+
+
+@traced("reproject_scene")
+def reproject_scene(filename):
+    """
+    Reproject a satellite image to the grid
+
+    Arguments
+    ---------
+    filename: str
+        Path to the GeoTIFF file, or to a member of a zip archive
+        (see `sat_tools.zip_member_path()`)
+
+    Returns
+    -------
+    data: numpy array
+        Image on the window of the grid covering it (0 = no data)
+    window: rasterio.windows.Window or None
+        Window of the grid (None if the image is outside of the grid)
+    """
+    g = grid()
+    with rasterio.open(filename, "r") as src:
+        x0, y0, x1, y1 = transform_bounds(
+            src.crs, g["rio_crs"], *src.bounds, densify_pts=21
+        )
+        window = grid_window((x0, x1, y0, y1))
+        if window is None:
+            return None, None
+        data = np.full((window.height, window.width), NODATA, dtype=src.dtypes[0])
+        reproject(
+            source=rasterio.band(src, 1),
+            destination=data,
+            src_nodata=NODATA if src.nodata is None else src.nodata,
+            dst_transform=rasterio.windows.transform(window, g["transform"]),
+            dst_crs=g["rio_crs"],
+            dst_nodata=NODATA,
+            resampling=Resampling.nearest,
+        )
+    return data, window
+
+
+def get_scene(arch_file, zfile, cache_dir=None):
+    """
+    Get a satellite image of a Dundee day archive reprojected to the grid
+
+    The image is reprojected once and then read from the cache directory.
+
+    Arguments
+    ---------
+    arch_file: pathlib.Path
+        Path to the archive
+    zfile: str
+        Name of the archive member
+    cache_dir: pathlib.Path, optional
+        Defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    Path to the reprojected image (None if it is outside of the grid)
+    """
+    target = mosaic_dir(arch_file, cache_dir=cache_dir) / Path(zfile).name
+    stamp = _source_stamp(arch_file)
+    if _is_valid(target, stamp):
+        return target
+    data, window = reproject_scene(sat_tools.zip_member_path(arch_file, zfile))
+    if window is None:
+        return None
+    return _write(target, data, window, stamp)
+
+
+def hour_path(arch_file, hour, sat_opt, cache_dir=None):
+    """Path to the mosaic of images with given options from one hour"""
+    key = sat_tools.sat_opt_key(**sat_opt).replace("/", "_")
+    return mosaic_dir(arch_file, cache_dir=cache_dir) / f"{key}_{hour:%Y%m%d%H}.tif"
+
+
+@traced("hourly_mosaic")
+def get_hourly(arch_file, hour, sat_opt, cache_dir=None):
+    """
+    Get a mosaic of the images with given options from one hour
+
+    Images are combined in time order, so where they overlap,
+    the latest valid pixel is used.
+
+    Arguments
+    ---------
+    arch_file: pathlib.Path
+        Path to the Dundee day archive
+    hour: datetime.datetime
+        Beginning of the hour
+    sat_opt: dict
+        Satellite image options: instrument, channel, platform
+    cache_dir: pathlib.Path, optional
+        Defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    Path to the mosaic (None if there are no images in the grid)
+    """
+    hour = hour.replace(minute=0, second=0, microsecond=0)
+    target = hour_path(arch_file, hour, sat_opt, cache_dir=cache_dir)
+    stamp = _source_stamp(arch_file)
+    if _is_valid(target, stamp):
+        return target
+
+    times, fnames = sat_tools.get_sat_index(arch_file)[sat_tools.sat_opt_key(**sat_opt)]
+    scenes = [
+        get_scene(arch_file, f"{hour:%Y%m%d}/{fname}", cache_dir=cache_dir)
+        for t, fname in zip(times, fnames)
+        if hour <= t < hour + timedelta(hours=1)
+    ]
+    scenes = [i for i in scenes if i is not None]
+    if len(scenes) == 0:
+        return None
+
+    g = grid()
+    windows = []
+    for scene in scenes:
+        with rasterio.open(scene, "r") as src:
+            windows.append(
+                from_bounds(*src.bounds, transform=g["transform"]).round_offsets()
+            )
+    window = rasterio.windows.union(*windows).round_lengths()
+    data = None
+    for scene, scene_window in zip(scenes, windows):
+        with rasterio.open(scene, "r") as src:
+            scene_data = src.read(1)
+        if data is None:
+            data = np.full(
+                (int(window.height), int(window.width)),
+                NODATA,
+                dtype=scene_data.dtype,
+            )
+        row = int(scene_window.row_off - window.row_off)
+        col = int(scene_window.col_off - window.col_off)
+        part = data[row : row + scene_data.shape[0], col : col + scene_data.shape[1]]
+        valid = scene_data != NODATA
+        part[valid] = scene_data[valid]
+    return _write(target, data, window, stamp)
+
+
+def read_window(filename, bounds=None, zoom=0):
+    """
+    Read a reprojected image or mosaic within given bounds
+
+    Arguments
+    ---------
+    filename: pathlib.Path
+        Output of `get_scene()` or `get_hourly()`
+    bounds: sequence, optional
+        Area (x0, x1, y0, y1) in the IGP projection; defaults to the whole image
+    zoom: int, optional
+        Zoom level (see `zoom_level()`)
+
+    Returns
+    -------
+    im: numpy array
+        Image data (0 = no data)
+    extent: list
+        Extent (x0, x1, y0, y1) of the image in the IGP projection,
+        to be shown by `ax.imshow(im, extent=extent, transform=grid()["crs"])`
+    """
+    with rasterio.open(filename, "r") as src:
+        full_window = Window(0, 0, src.width, src.height)
+        window = full_window
+        if bounds is not None:
+            x0, x1, y0, y1 = bounds
+            window = from_bounds(x0, y0, x1, y1, transform=src.transform)
+            window = window.round_offsets(op="floor").round_lengths(op="ceil")
+            if not rasterio.windows.intersect(window, full_window):
+                return np.zeros((0, 0), dtype=src.dtypes[0]), [x0, x1, y0, y1]
+            window = window.intersection(full_window)
+        scale = 2**zoom
+        out_shape = (
+            max(int(np.ceil(window.height / scale)), 1),
+            max(int(np.ceil(window.width / scale)), 1),
+        )
+        im = src.read(1, window=window, out_shape=out_shape)
+        left, bottom, right, top = rasterio.windows.bounds(window, src.transform)
+    return im, [left, right, bottom, top]
+
+
+def read_tile(filename, z, x, y):
+    """
+    Read a tile of a reprojected image or mosaic
+
+    Arguments
+    ---------
+    filename: pathlib.Path
+        Output of `get_scene()` or `get_hourly()`
+    z, x, y: int
+        Zoom level, column and row of the tile (see `tile_bounds()`)
+
+    Returns
+    -------
+    numpy array of shape (TILE_SIZE, TILE_SIZE) (0 outside of the image)
+    """
+    x0, x1, y0, y1 = tile_bounds(z, x, y)
+    with rasterio.open(filename, "r") as src:
+        window = from_bounds(x0, y0, x1, y1, transform=src.transform)
+        return src.read(
+            1,
+            window=window.round_offsets().round_lengths(),
+            out_shape=(TILE_SIZE, TILE_SIZE),
+            boundless=True,
+            fill_value=NODATA,
+        )
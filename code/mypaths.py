@@ -8,10 +8,14 @@ from pathlib import Path
 # Root of the current repository
 curdir = Path(".").absolute().parent
 sample_dir = curdir / "data"
+buoy_dir = sample_dir / "buoy"
+sonde_dir = sample_dir / "radiosonde"
 
 # External data directories
 igp_data_dir = Path("/media") / os.getenv("USER") / "Elements" / "IGP" / "data"
 alliance_dir = igp_data_dir / "total_backup_Alliance_20180308"
+nmea_dir = igp_data_dir / "nmea_logs"
+windcube_dir = igp_data_dir / "Windcube"
 masin_dir = igp_data_dir / "masin"
 dundee_dir = igp_data_dir / "dundee"
 ostia_dir = igp_data_dir / "ostia"
@@ -19,3 +23,6 @@ amsr2_dir = igp_data_dir / "amsr2"
 
 # Output directories
 plotdir = curdir / "figures"
+
+# Cache directory (indices, parsed tables and other derived files)
+cache_dir = curdir / "cache"
@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to read NMEA logs of the ship (R/V Alliance)
+
+Logs are read in chunks and only the sentences used in the analysis
+(GGA, HDT and MWV) are parsed. Each line may be preceded by a timestamp
+written by the logger, either as Unix time (e.g. "1519344000.12 $GPGGA,...")
+or in an NMEA 4 TAG block (e.g. "\\c:1519344000*5A\\$GPGGA,...").
+If there is no such timestamp, GGA sentences are timed using the UTC time
+in the sentence and the date of the log, and the other sentences get the time
+of the last GGA sentence before them.
+"""
+import concurrent.futures
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from cache import cached
+import mypaths
+
+# Sentences of interest and their fields: field number -> (name, dtype)
+# (field 0 is the talker and sentence type, e.g. "GPGGA")
+SENTENCES = dict(
+    GGA={
+        1: ("utc", "f8"),
+        2: ("lat", "f8"),
+        3: ("lat_dir", "str"),
+        4: ("lon", "f8"),
+        5: ("lon_dir", "str"),
+        6: ("quality", "f4"),
+        7: ("num_sats", "f4"),
+        8: ("hdop", "f4"),
+        9: ("altitude", "f4"),
+    },
+    HDT={1: ("heading", "f4")},
+    MWV={
+        1: ("wind_angle", "f4"),
+        2: ("reference", "str"),
+        3: ("wind_speed", "f4"),
+        4: ("wind_speed_units", "str"),
+        5: ("status", "str"),
+    },
+)
+# Size of a chunk of the log read at once
+CHUNK_SIZE = 1 << 20  # bytes
+# Maximum width of a numeric field (wider fields are read as NaN)
+FIELD_WIDTH = 16  # bytes
+# Initial number of rows of the column buffers (see `read_log()`)
+BUFFER_ROWS = 1 << 14
+LOG_FILE_MASK = "{date:%Y%m%d}.log"
+# Version of the parser (bump if the output changes, see `cache.cached()`)
+PARSER_VERSION = 2
+
+# Sentence types (sorted) and the integers of their three letters
+_KINDS = np.array(sorted(SENTENCES))
+_KIND_CODES = np.array([int.from_bytes(i.encode("ascii"), "big") for i in _KINDS])
+# Values of hexadecimal digits (-1 for other bytes)
+_HEX_VALUES = np.full(256, -1, dtype="i2")
+_HEX_VALUES[np.frombuffer(b"0123456789ABCDEF", dtype="u1")] = np.arange(16)
+_HEX_VALUES[np.frombuffer(b"abcdef", dtype="u1")] = np.arange(10, 16)
+
+
+def log_file(date, log_dir=None):
+    """Path to the NMEA log of a given day"""
+    if log_dir is None:
+        log_dir = mypaths.nmea_dir
+    return log_dir / LOG_FILE_MASK.format(date=date)
+
+
+def checksum(sentences):
+    """
+    Calculate NMEA checksums of many sentences at once
+
+    Arguments
+    ---------
+    sentences: sequence of str
+        Non-empty sentences without the leading "$" and the trailing "*hh"
+
+    Returns
+    -------
+    numpy array of uint8
+    """
+    lengths = np.fromiter(map(len, sentences), dtype="i8", count=len(sentences))
+    if len(lengths) == 0:
+        return np.zeros(0, dtype="u1")
+    buf = np.frombuffer("".join(sentences).encode("latin-1"), dtype="u1")
+    starts = np.concatenate([[0], np.cumsum(lengths[:-1])])
+    return np.bitwise_xor.reduceat(buf, starts)
+
+
+def _dm_to_deg(values, hemispheres, negative):
+    """Convert (d)ddmm.mmmm coordinates to decimal degrees"""
+    deg = np.trunc(values / 100)
+    deg = deg + (values - 100 * deg) / 60
+    return np.where(hemispheres == negative, -deg, deg)
+
+
+def _take(buf, pos):
+    """Bytes of a buffer at given positions (0 beyond its end)"""
+    return np.where(pos < len(buf), buf[np.minimum(pos, len(buf) - 1)], 0)
+
+
+def parse_numbers(buf, starts, ends, strict=True):
+    """
+    Parse decimal numbers (e.g. "-12.345") in byte ranges of a buffer
+
+    Arguments
+    ---------
+    buf: numpy array of uint8
+        Bytes of the text
+    starts, ends: numpy arrays of int
+        Ranges of the numbers
+    strict: bool, optional
+        If True, a range with anything else than a number is NaN;
+        otherwise the number at its start is parsed
+
+    Returns
+    -------
+    numpy array of float64 (NaN for empty or invalid ranges)
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype="f8")
+    k = np.arange(FIELD_WIDTH)
+    inside = starts[:, None] + k < ends[:, None]
+    chars = np.where(inside, _take(buf, starts[:, None] + k), 0)
+    digits = chars.astype("i2") - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    is_point = chars == ord(".")
+    negative = chars[:, 0] == ord("-")
+    allowed = is_digit | is_point | ((k == 0) & negative[:, None])
+    if strict:
+        valid = (allowed | ~inside).all(axis=1) & (ends - starts <= FIELD_WIDTH)
+    else:
+        # the number ends at the first other byte
+        inside &= np.logical_and.accumulate(allowed, axis=1)
+        is_digit &= inside
+        is_point &= inside
+        valid = np.ones(len(starts), dtype=bool)
+    valid &= is_digit.any(axis=1) & (is_point.sum(axis=1) <= 1)
+    # all the digits as one integer, divided by a power of ten: as precise
+    # as the C parser for up to 15 significant digits
+    rank = np.cumsum(is_digit[:, ::-1], axis=1)[:, ::-1] - 1
+    mantissa = np.where(is_digit, digits * 10 ** np.maximum(rank, 0), 0).sum(axis=1)
+    after_point = np.logical_or.accumulate(is_point, axis=1)
+    n_decimals = (is_digit & after_point).sum(axis=1)
+    values = mantissa / 10.0**n_decimals
+    values = np.where(negative, -values, values)
+    return np.where(valid, values, np.nan)
+
+
+def _find_sentences(buf):
+    """
+    Find GGA, HDT and MWV sentences with valid checksums
+
+    Returns
+    -------
+    line_starts, dollars, stars: numpy arrays of int
+        Position of the start of the line, "$" and "*" of the sentences
+    kinds: numpy array of str
+        Sentence types
+    """
+    line_ends = np.flatnonzero(buf == ord("\n"))
+    if len(line_ends) == 0 or line_ends[-1] != len(buf) - 1:
+        line_ends = np.append(line_ends, len(buf))
+    line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+    # the first "$" of each line
+    dollars = np.flatnonzero(buf == ord("$"))
+    if len(dollars) == 0:
+        empty = np.zeros(0, dtype="i8")
+        return empty, empty, empty, np.zeros(0, dtype="U3")
+    dollars = dollars[
+        np.minimum(np.searchsorted(dollars, line_starts), len(dollars) - 1)
+    ]
+    found = (dollars >= line_starts) & (dollars + 7 < line_ends)
+    line_starts, line_ends, dollars = (
+        i[found] for i in (line_starts, line_ends, dollars)
+    )
+    # prefix check: "$", talker, sentence type of interest and ","
+    talker = _take(buf, dollars[:, None] + np.arange(1, 3))
+    codes = (
+        (_take(buf, dollars + 3).astype("u4") << 16)
+        | (_take(buf, dollars + 4).astype("u4") << 8)
+        | _take(buf, dollars + 5)
+    )
+    found = (
+        ((talker >= ord("A")) & (talker <= ord("Z"))).all(axis=1)
+        & np.isin(codes, _KIND_CODES)
+        & (_take(buf, dollars + 6) == ord(","))
+    )
+    line_starts, line_ends, dollars = (
+        i[found] for i in (line_starts, line_ends, dollars)
+    )
+    codes = codes[found]
+    # the first "*" after the "$", followed by two hexadecimal digits
+    stars = np.flatnonzero(buf == ord("*"))
+    stars = np.append(stars, len(buf))[np.searchsorted(stars, dollars)]
+    found = stars + 3 <= line_ends
+    hi = _HEX_VALUES[_take(buf, stars + 1)]
+    lo = _HEX_VALUES[_take(buf, stars + 2)]
+    # XOR of the bytes between "$" and "*" from the cumulative XOR
+    cum_xor = np.bitwise_xor.accumulate(buf)
+    sums = cum_xor[np.minimum(stars - 1, len(buf) - 1)] ^ cum_xor[dollars]
+    found &= (hi >= 0) & (lo >= 0) & (hi * 16 + lo == sums)
+    kinds = _KINDS[np.searchsorted(_KIND_CODES, codes[found])]
+    return line_starts[found], dollars[found], stars[found], kinds
+
+
+def _field_ranges(buf, commas, dollars, stars, number):
+    """Byte ranges of a field of sentences (empty if the field is missing)"""
+    # the first comma of each sentence follows its type (see `_find_sentences()`)
+    first = np.searchsorted(commas, dollars + 6)
+    padded = np.append(commas, len(buf))
+    before = padded[np.minimum(first + number - 1, len(commas))]
+    after = padded[np.minimum(first + number, len(commas))]
+    starts = np.where(before < stars, before + 1, stars)
+    ends = np.maximum(np.minimum(after, stars), starts)
+    return starts, ends
+
+
+def parse_chunk(buf, date=None, last_time=None):
+    """
+    Parse GGA, HDT and MWV sentences in a piece of an NMEA log
+
+    Sentences are found and their checksums checked with vectorized
+    operations on the bytes of the text, and their fields are parsed into
+    typed columns in the same way (see `parse_numbers()`). Text fields are
+    single characters, e.g. "N" or "A".
+
+    Arguments
+    ---------
+    buf: bytes
+        Complete lines of the log
+    date: datetime.datetime, optional
+        Date of the log, needed if lines are not timestamped by the logger
+    last_time: numpy.datetime64, optional
+        Time of the last GGA sentence in the previous chunk
+
+    Returns
+    -------
+    columns: dict
+        Sentence type -> dict of numpy arrays, including "time"
+    last_time: numpy.datetime64
+        Time of the last GGA sentence (to be passed to the next chunk)
+    """
+    buf = np.frombuffer(buf, dtype="u1")
+    line_starts, dollars, stars, kinds = _find_sentences(buf)
+
+    # Logger timestamps: Unix time at the start of the line or in a TAG block
+    tagged = (
+        (_take(buf, line_starts) == ord("\\"))
+        & (_take(buf, line_starts + 1) == ord("c"))
+        & (_take(buf, line_starts + 2) == ord(":"))
+    )
+    epoch = parse_numbers(buf, line_starts + 3 * tagged, dollars, strict=False)
+    times = np.full(len(epoch), np.datetime64("NaT"), dtype="M8[ms]")
+    # (at least 9 digits)
+    stamped = epoch >= 1e8
+    times[stamped] = np.round(epoch[stamped] * 1e3).astype("i8").astype("M8[ms]")
+
+    commas = np.flatnonzero(buf == ord(","))
+    columns = {}
+    for kind, fields in SENTENCES.items():
+        rows = kinds == kind
+        columns[kind] = {}
+        for number, (name, dtype) in fields.items():
+            starts, ends = _field_ranges(
+                buf, commas, dollars[rows], stars[rows], number
+            )
+            if dtype == "str":
+                chars = np.where(ends > starts, _take(buf, starts), 0)
+                columns[kind][name] = chars.astype("u1").view("S1")
+            else:
+                columns[kind][name] = parse_numbers(buf, starts, ends)
+    gga = columns["GGA"]
+    gga["lat"] = _dm_to_deg(gga["lat"], gga.pop("lat_dir"), b"S")
+    gga["lon"] = _dm_to_deg(gga["lon"], gga.pop("lon_dir"), b"W")
+
+    is_gga = kinds == "GGA"
+    missing = np.isnat(times)
+    if missing.any():
+        assert date is not None, "The log is not timestamped, date is required"
+        # Time of GGA sentences from their UTC field (hhmmss.ss)
+        utc = gga["utc"]
+        seconds = utc // 10000 * 3600 + utc // 100 % 100 * 60 + utc % 100
+        gga_times = np.datetime64(date, "ms") + np.round(seconds * 1e3).astype("m8[ms]")
+        gga_rows = np.nonzero(is_gga)[0]
+        fill = np.full(len(times), np.datetime64("NaT"), dtype="M8[ms]")
+        fill[gga_rows] = gga_times
+        # other sentences get the time of the preceding GGA sentence
+        last_gga = np.maximum.accumulate(np.where(is_gga, np.arange(len(times)), -1))
+        if last_time is None:
+            last_time = np.datetime64("NaT", "ms")
+        fill = np.where(last_gga >= 0, fill[np.maximum(last_gga, 0)], last_time)
+        times = np.where(missing, fill, times)
+    if is_gga.any():
+        last_time = times[is_gga][-1]
+
+    for kind, cols in columns.items():
+        cols["time"] = times[kinds == kind]
+        for name, dtype in SENTENCES[kind].values():
+            if name in cols and dtype != "str":
+                cols[name] = cols[name].astype(dtype)
+    return columns, last_time
+
+
+def _append(buffers, columns):
+    """
+    Copy parsed columns to the end of column buffers
+
+    The buffers are preallocated (`BUFFER_ROWS`) and their size is doubled
+    when they are full.
+    """
+    for kind, cols in columns.items():
+        if kind not in buffers:
+            buffers[kind] = dict(
+                size=0,
+                columns={
+                    name: np.empty(BUFFER_ROWS, dtype=col.dtype)
+                    for name, col in cols.items()
+                },
+            )
+        buffer = buffers[kind]
+        size = buffer["size"]
+        n_rows = len(cols["time"])
+        capacity = len(buffer["columns"]["time"])
+        if size + n_rows > capacity:
+            capacity = max(2 * capacity, size + n_rows)
+            for name, col in buffer["columns"].items():
+                buffer["columns"][name] = np.empty(capacity, dtype=col.dtype)
+                buffer["columns"][name][:size] = col[:size]
+        for name, col in cols.items():
+            buffer["columns"][name][size : size + n_rows] = col
+        buffer["size"] = size + n_rows
+
+
+def _to_frames(buffers):
+    """Data frames indexed by time from column buffers"""
+    frames = {}
+    for kind, buffer in buffers.items():
+        cols = {name: col[: buffer["size"]] for name, col in buffer["columns"].items()}
+        index = pd.DatetimeIndex(cols.pop("time"), name="time")
+        for name, col in cols.items():
+            if col.dtype.kind == "S":
+                # text fields, NaN if empty
+                text = col.astype("U1").astype(object)
+                text[col == b""] = np.nan
+                cols[name] = pd.Series(text, index=index, dtype="str")
+        frames[kind] = pd.DataFrame(cols, index=index)
+    return frames
+
+
+@cached(version=PARSER_VERSION)
+def read_log(fname, date=None, chunk_size=CHUNK_SIZE):
+    """
+    Read GGA, HDT and MWV sentences from an NMEA log
+
+    The file is read in chunks of complete lines, which are parsed into
+    column buffers (see `parse_chunk()`), so the memory usage does not
+    depend on the size of the log. Parsed logs are cached
+    (see `cache.cached()`).
+
+    Arguments
+    ---------
+    fname: pathlib.Path
+        Path to the log
+    date: datetime.datetime, optional
+        Date of the log; by default, it is taken from the file name
+    chunk_size: int, optional
+        Number of bytes read at once
+
+    Returns
+    -------
+    frames: dict
+        Sentence type -> pandas.DataFrame indexed by time
+    """
+    if date is None:
+        date = datetime.strptime(fname.stem, "%Y%m%d")
+    buffers = {}
+    last_time = None
+    tail = b""
+    with fname.open("rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            # Complete lines only; the rest goes to the next chunk
+            data, nl, tail = (tail + data).rpartition(b"\n")
+            if not nl:
+                continue
+            columns, last_time = parse_chunk(data + nl, date=date, last_time=last_time)
+            _append(buffers, columns)
+    columns, _ = parse_chunk(tail, date=date, last_time=last_time)
+    _append(buffers, columns)
+    return _to_frames(buffers)
+
+
+def read_logs(dates, log_dir=None, max_workers=None):
+    """
+    Read NMEA logs of several days in parallel
+
+    Arguments
+    ---------
+    dates: sequence of datetime.datetime
+        Days of the logs
+    log_dir: pathlib.Path, optional
+        Directory with the logs; defaults to `mypaths.nmea_dir`
+    max_workers: int, optional
+        Number of worker processes (1 = read in this process);
+        defaults to the number of CPUs
+
+    Returns
+    -------
+    frames: dict
+        Sentence type -> pandas.DataFrame indexed by time
+    """
+    fnames = [log_file(date, log_dir=log_dir) for date in dates]
+    if max_workers == 1 or len(fnames) == 1:
+        results = [read_log(fname, date) for fname, date in zip(fnames, dates)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            results = list(executor.map(read_log, fnames, dates))
+    return {
+        kind: pd.concat([frames[kind] for frames in results]).sort_index(kind="stable")
+        for kind in SENTENCES
+    }
+
+
+def align(frames, start=None, end=None, freq="1s"):
+    """
+    Put sentences of different types on a common time grid
+
+    The first sentence of each type within each time step is used.
+
+    Arguments
+    ---------
+    frames: dict
+        Output of `read_log()` or `read_logs()`
+    start, end: datetime.datetime, optional
+        Time range; by default, the range of the data
+    freq: str, optional
+        Time step
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    aligned = []
+    for df in frames.values():
+        steps = df.index.floor(freq)
+        first = ~steps.duplicated()
+        aligned.append(df[first].set_axis(steps[first].rename("time")))
+    if start is None:
+        start = min(df.index.min() for df in aligned)
+    if end is None:
+        end = max(df.index.max() for df in aligned)
+    index = pd.date_range(start=start, end=end, freq=freq, name="time")
+    return pd.concat([df.reindex(index) for df in aligned], axis=1)
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+Overview maps of all science flights
+
+The tracks of all flights are read from the MASIN files once, projected
+onto the IGP map (see `cart.igp_projection()`) and stored in a single
+Feather file in the cache directory (see `load_track_store()`). Any number
+of map variants (e.g. the whole domain and a zoom on the flight area,
+see `VARIANTS`) are then rendered from this store. The layers shared by
+all variants (simplified tracks, place names, the buoy and the mean sea ice)
+are prepared once in map coordinates (see `make_layers()`), so each variant
+only draws them:
+
+    layers = make_layers()
+    for name in VARIANTS:
+        render(name, layers)
+
+or from the command line:
+
+    python overview.py --variants full zoom
+"""
+import argparse
+from datetime import datetime
+import hashlib
+import itertools
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+import mypaths
+from common_defs import FLIGHTS, SCI_FLIGHTS, toponyms, zoom_kw
+from spans import span, traced
+
+# Bump the version if the structure of the track store changes
+TRACK_STORE_VERSION = 1
+# Colours of the flight tracks
+COLORS = [
+    "#1fa774",
+    "C1",
+    "C2",
+    "C3",
+    "C4",
+    "C5",
+    "C6",
+    "#21fc0d",
+    "#0339f8",
+    "#fe019a",
+    "#fe2c54",
+    "C0",
+    "#faee66",
+]
+# Extent of the largest map (default of `cart.ukmo_igp_map()`)
+FULL_EXTENT = [-34, -7.8, 61, 75.2]
+# Horizontal tolerance of the track simplification [m] (see `masin.douglas_peucker()`)
+TRACK_TOLERANCE = 200
+gridline_kw = dict(linestyle=(0, (10, 10)), linewidth=0.5, color="C9")
+COAST = dict(scale="50m", facecolor="#CCCCCC", edgecolor="#888888", alpha=0.75)
+# Position of place names relative to their markers [points]
+TOPONYM_OFFSETS = {
+    "Akureyri": dict(x=40, y=-25),
+    "Constable Point": dict(x=-75, y=-25),
+    "Reykjavik": dict(x=0, y=-25),
+}
+# Location of the met buoy
+BUOY_LONLAT = (-15 + 24.580 / 60, 70 + 38.376 / 60)
+BUOY_KW = dict(marker="X", ms=14, mec="#333333", mfc="#fedf08")
+# Style of the mean sea ice fraction
+SIF_LEVELS = np.arange(0.0, 1.2, 0.2)
+# Size of the logo (see `plot_utils.add_igp_logo()`)
+LOGO_ZOOM = dict(S=0.25, M=0.5, L=1)
+# Map variants: extent and ticks (see `cart.ukmo_igp_map()`), location of
+# the legend, location and size of the logo, optional layers and location
+# of the sea ice colorbar
+VARIANTS = dict(
+    full=dict(legend_loc=3, logo_loc=2, logo_size="M", buoy=True, sea_ice=False),
+    zoom=dict(
+        **zoom_kw, legend_loc=4, logo_loc=3, logo_size="S", buoy=False, sea_ice=False
+    ),
+    full_mean_seaice=dict(
+        legend_loc=3, logo_loc=1, logo_size="M", buoy=False, sea_ice=True, cbar_loc=2
+    ),
+    zoom_mean_seaice=dict(
+        **zoom_kw,
+        legend_loc=4,
+        logo_loc=3,
+        logo_size="S",
+        buoy=True,
+        sea_ice=True,
+        cbar_loc=1,
+    ),
+)
+
+
+def _source_stamps(flight_ids, masin_dir=None):
+    import cache
+    import masin
+
+    return {
+        flight_id: cache.source_stamp(masin.masin_file(flight_id, masin_dir=masin_dir))
+        for flight_id in flight_ids
+    }
+
+
+def track_store_file(flight_ids, masin_dir=None, cache_dir=None):
+    """
+    Path to the track store of given flights
+
+    The name of the file depends on the MASIN files (path, size and
+    modification time), so changing any of them leads to a new store.
+    """
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    key = dict(
+        version=TRACK_STORE_VERSION, sources=_source_stamps(flight_ids, masin_dir)
+    )
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return cache_dir / "tracks" / f"tracks_{digest}.feather"
+
+
+@traced("build_track_store")
+def build_track_store(flight_ids, masin_dir=None):
+    """
+    Read flight tracks from MASIN files into one table
+
+    Returns
+    -------
+    pandas.DataFrame
+        flight_id (categorical), x and y (in the IGP projection) [m],
+        alt [m] and time columns, sorted by flight and time
+    """
+    import cartopy.crs as ccrs
+
+    import cart
+    import masin
+
+    proj = cart.igp_projection()
+    frames = []
+    for flight_id in flight_ids:
+        track = masin.load_track(flight_id, masin_dir=masin_dir)
+        xyz = proj.transform_points(ccrs.Geodetic(), track["lon"], track["lat"])
+        frames.append(
+            pd.DataFrame(
+                dict(
+                    flight_id=flight_id,
+                    x=xyz[:, 0].astype("f4"),
+                    y=xyz[:, 1].astype("f4"),
+                    alt=track["alt"].astype("f4"),
+                    time=track["time"],
+                )
+            )
+        )
+    df = pd.concat(frames, ignore_index=True)
+    df["flight_id"] = pd.Categorical(df["flight_id"], categories=list(flight_ids))
+    return df
+
+
+def load_track_store(flight_ids=None, masin_dir=None, cache_dir=None):
+    """
+    Get the tracks of many flights from the track store
+
+    The store is built from the MASIN files on the first call (or after
+    they change) and read memory-mapped afterwards. If `pyarrow` is not
+    installed, the MASIN files are read every time.
+
+    Arguments
+    ---------
+    flight_ids: sequence of str, optional
+        Flight numbers; defaults to all science flights (`SCI_FLIGHTS`)
+    masin_dir: pathlib.Path, optional
+        Directory with MASIN data; defaults to `mypaths.masin_dir`
+    cache_dir: pathlib.Path, optional
+        Defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    pandas.DataFrame
+        See `build_track_store()`
+    """
+    if flight_ids is None:
+        flight_ids = list(SCI_FLIGHTS)
+    flight_ids = list(flight_ids)
+    if feather is None:
+        return build_track_store(flight_ids, masin_dir=masin_dir)
+    target = track_store_file(flight_ids, masin_dir=masin_dir, cache_dir=cache_dir)
+    if target.is_file():
+        with span("read_track_store"):
+            df = feather.read_table(target, memory_map=True).to_pandas()
+        return df
+    df = build_track_store(flight_ids, masin_dir=masin_dir)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = target.with_suffix(f".{os.getpid()}.tmp")
+    # Uncompressed files can be memory-mapped when reading
+    feather.write_feather(df, tmp_file, compression="uncompressed")
+    tmp_file.replace(target)
+    return df
+
+
+def _ostia_mean(start, end):
+    """Mean OSTIA sea ice fraction between two dates"""
+    import xarray as xr
+
+    with xr.open_mfdataset(sorted(mypaths.ostia_dir.glob("*"))) as ds:
+        sif = ds.sea_ice_fraction.loc[start:end].mean("time").load()
+    return sif.lon.values, sif.lat.values, sif.values
+
+
+def _project_grid(lons, lats, proj, extent, margin=2):
+    """Coordinates of a lon/lat grid within an extent (plus a margin) in a projection"""
+    import cartopy.crs as ccrs
+
+    lon0, lon1, lat0, lat1 = extent
+    ix = np.flatnonzero((lons >= lon0 - margin) & (lons <= lon1 + margin))
+    iy = np.flatnonzero((lats >= lat0 - margin) & (lats <= lat1 + margin))
+    lon2d, lat2d = np.meshgrid(lons[ix], lats[iy])
+    xyz = proj.transform_points(ccrs.PlateCarree(), lon2d, lat2d)
+    return xyz[..., 0], xyz[..., 1], np.ix_(iy, ix)
+
+
+@traced("layers")
+def make_layers(
+    flight_ids=None,
+    sea_ice=True,
+    tolerance=TRACK_TOLERANCE,
+    masin_dir=None,
+    cache_dir=None,
+):
+    """
+    Prepare the layers shared by all overview maps
+
+    Everything is projected onto the IGP map once, so the maps draw
+    the layers without transforming them.
+
+    Arguments
+    ---------
+    flight_ids: sequence of str, optional
+        Flight numbers; defaults to all science flights (`SCI_FLIGHTS`)
+    sea_ice: bool, optional
+        Compute the mean OSTIA sea ice fraction of the campaign
+    tolerance: float, optional
+        Horizontal tolerance of the track simplification [m]
+    masin_dir, cache_dir: pathlib.Path, optional
+        See `load_track_store()`
+
+    Returns
+    -------
+    dict
+        tracks: list of dict(flight_id, label, color, x, y)
+        toponyms: dict of name -> (x, y)
+        buoy: (x, y)
+        sea_ice: (x, y, fraction) or None
+    """
+    import cartopy.crs as ccrs
+
+    import cart
+    import masin
+
+    if flight_ids is None:
+        flight_ids = list(SCI_FLIGHTS)
+    df = load_track_store(flight_ids, masin_dir=masin_dir, cache_dir=cache_dir)
+    proj = cart.igp_projection()
+
+    tracks = []
+    with span("simplify_tracks"):
+        # (colours are reused if there are more flights than colours)
+        for color, (flight_id, group) in zip(
+            itertools.cycle(COLORS),
+            df.groupby("flight_id", observed=True, sort=False),
+        ):
+            x, y = group["x"].values, group["y"].values
+            idx = masin.douglas_peucker(x, y, tolerance)
+            flight_date = datetime.strptime(FLIGHTS[flight_id], "%Y%m%d")
+            tracks.append(
+                dict(
+                    flight_id=flight_id,
+                    label=f"Flt.{flight_id} ({flight_date:%d %b})",
+                    color=color,
+                    x=x[idx],
+                    y=y[idx],
+                )
+            )
+
+    lonlat = np.array([*toponyms.values(), BUOY_LONLAT])
+    xyz = proj.transform_points(ccrs.Geodetic(), lonlat[:, 0], lonlat[:, 1])
+    points = {name: tuple(xy) for name, xy in zip(toponyms, xyz[:, :2])}
+
+    sic = None
+    if sea_ice:
+        dates = [FLIGHTS[i] for i in flight_ids]
+        with span("sea_ice"):
+            lons, lats, sif = _ostia_mean(min(dates), max(dates))
+            x, y, idx = _project_grid(lons, lats, proj, FULL_EXTENT)
+            sic = (x, y, sif[idx])
+    return dict(
+        tracks=tracks,
+        toponyms=points,
+        buoy=tuple(xyz[-1, :2]),
+        sea_ice=sic,
+    )
+
+
+@traced("overview")
+def render(variant, layers, output_dir=None, fmt="png", dpi=300):
+    """
+    Draw an overview map of flight tracks and save it
+
+    Arguments
+    ---------
+    variant: str or dict
+        Name of one of `VARIANTS` or a dictionary of the same form
+    layers: dict
+        Output of `make_layers()`
+    output_dir: pathlib.Path, optional
+        Defaults to `mypaths.plotdir`
+    fmt: str, optional
+        Format of the figure
+    dpi: int, optional
+        Resolution of the figure
+
+    Returns
+    -------
+    pathlib.Path
+        Path to the figure
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.transforms import offset_copy
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+
+    from cart import ukmo_igp_map
+    from plot_utils import add_igp_logo
+
+    name = variant if isinstance(variant, str) else "custom"
+    if isinstance(variant, str):
+        variant = VARIANTS[variant]
+    if output_dir is None:
+        output_dir = mypaths.plotdir
+    map_kw = {key: variant[key] for key in ("extent", "ticks") if key in variant}
+
+    fig = plt.figure(figsize=(15, 15))
+    ax = ukmo_igp_map(fig, coast=COAST, **map_kw, **gridline_kw)
+
+    if variant["sea_ice"]:
+        assert layers["sea_ice"] is not None, "Sea ice layer is not prepared"
+        cmap = plt.get_cmap("Blues").copy()
+        cmap.set_under("w", alpha=0)
+        h = ax.contourf(
+            *layers["sea_ice"],
+            levels=SIF_LEVELS,
+            extend="both",
+            cmap=cmap,
+            transform=ax.projection,
+        )
+        cax = inset_axes(
+            ax, borderpad=3.5, width="40%", height="2%", loc=variant["cbar_loc"]
+        )
+        cb = fig.colorbar(h, cax=cax, orientation="horizontal")
+        cb.ax.set_title("OSTIA sea ice fraction\n(Flight campaign average)")
+        cb.ax.tick_params(labelsize=12)
+
+    # Layers are already in map coordinates
+    for track in layers["tracks"]:
+        ax.plot(
+            track["x"],
+            track["y"],
+            color=track["color"],
+            linewidth=2,
+            label=track["label"],
+            transform=ax.projection,
+        )
+    ax.legend(fontsize="xx-large", loc=variant["legend_loc"])
+
+    if variant["buoy"]:
+        ax.plot(*layers["buoy"], **BUOY_KW, transform=ax.projection)
+
+    data_transform = ax.projection._as_mpl_transform(ax)
+    for toponym, xy in layers["toponyms"].items():
+        ax.plot(
+            *xy, marker="o", color="#333333", markersize=12, transform=ax.projection
+        )
+        text_transform = offset_copy(
+            data_transform, fig=fig, units="points", **TOPONYM_OFFSETS[toponym]
+        )
+        ax.text(
+            *xy,
+            toponym,
+            verticalalignment="center",
+            horizontalalignment="center",
+            transform=text_transform,
+            fontsize=16,
+            bbox=dict(facecolor="#EEEEEE", alpha=0.5, boxstyle="round"),
+        )
+    ax.tick_params(labelsize="x-large")
+    add_igp_logo(
+        ax,
+        loc=variant["logo_loc"],
+        image_bg="transparent",
+        zoom=LOGO_ZOOM[variant["logo_size"]],
+    )
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    fname = output_dir / f"igp_all_sci_flights_map_grid_{name}.{fmt}"
+    with span("savefig"):
+        fig.savefig(fname, dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    print(f"Saved to {fname}")
+    return fname
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0].strip(),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ap.add_argument(
+        "--variants",
+        nargs="+",
+        choices=list(VARIANTS),
+        default=["full", "zoom"],
+        help="Map variants to render",
+    )
+    ap.add_argument("--flights", nargs="+", help="Flight numbers")
+    ap.add_argument(
+        "--tolerance",
+        type=float,
+        default=TRACK_TOLERANCE,
+        help="Tolerance of track simplification [m]",
+    )
+    ap.add_argument("--masin-dir", type=Path, help="Directory of MASIN data")
+    ap.add_argument("--output-dir", type=Path, help="Output directory")
+    ap.add_argument("--format", default="png", help="Format of the figures")
+    ap.add_argument("--dpi", type=int, default=300, help="Resolution of the figures")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    layers = make_layers(
+        flight_ids=args.flights,
+        sea_ice=any(VARIANTS[name]["sea_ice"] for name in args.variants),
+        tolerance=args.tolerance,
+        masin_dir=args.masin_dir,
+    )
+    for name in args.variants:
+        render(name, layers, output_dir=args.output_dir, fmt=args.format, dpi=args.dpi)
+
+
+if __name__ == "__main__":
+    main()
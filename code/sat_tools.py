@@ -2,20 +2,31 @@
 """
 Functions to work with satellite imagery
 """
+import bisect
+import concurrent.futures
 from datetime import datetime
+from functools import lru_cache
+import hashlib
 import json
+import os
 from pathlib import Path
 import re
 import subprocess as sb
+import time
+from zipfile import ZipFile
 
 from bs4 import BeautifulSoup
 import cartopy.crs as ccrs
-import h5py
 import numpy as np
 import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window, from_bounds
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import mypaths
+from spans import traced
 
 DUNDEE_URL = "http://www.sat.dundee.ac.uk/customers/{project}/data/{dt:%Y%m%d}"
 PROJECT = "renfrew_afis"
@@ -23,25 +34,82 @@ PROJECT = "renfrew_afis"
 AMSR2_URL_BASE = "https://seaice.uni-bremen.de/data/amsr2/asi_daygrid_swath/"
 COORD_URL_BASE = "https://seaice.uni-bremen.de/data/grid_coordinates/"
 
-
-def get_amsr2(dt, save_dir=None, res="n6250", mask_invalid=True):
+# Download settings
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF = 0.5  # seconds
+DOWNLOAD_TIMEOUT = 60  # seconds
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # bytes
+
+# Satellite image names contain a timestamp, e.g.
+# noaa19_avhrr_band2_vis_20180301_110931_mapping6_500.tif
+SAT_TIMESTAMP_REGEX = re.compile(r"_([0-9]{8}_[0-9]{6})_")
+SAT_TIMESTAMP_FMT = "%Y%m%d_%H%M%S"
+# Bump the version if the structure of the cached index changes
+SAT_INDEX_VERSION = 1
+# In-memory copies of the day indices (see `get_sat_index()`)
+_SAT_INDEX_CACHE = {}
+
+
+@traced("amsr2_load")
+def get_amsr2(dt, save_dir=None, res="n6250", mask_invalid=True, bbox=None, crs=None):
     """
-    Get AMSR2 data and matching coordinates from an HDF file originally
+    Get AMSR2 data and matching coordinates originally
     downloaded from the University of Bremen sea ice data archive
 
-    Basically a wrapper of get_amsr2_coords_file and get_amsr2_data_file funcs
+    Basically a wrapper of `amsr2.get_amsr2()`, which ingests the data
+    into a compact local store in `save_dir` on the first call
+    and can read only the part of the grid covering `bbox`
     """
-    # TODO: different directories for coords and data
-    coords_file = get_amsr2_coords_file(save_dir=save_dir, res=res)
-    with h5py.File(coords_file) as f:
-        lons = f["Longitudes"].value
-        lats = f["Latitudes"].value
-    data_file = get_amsr2_data_file(dt=dt, save_dir=save_dir, res=res)
-    with h5py.File(data_file) as f:
-        data = f["ASI Ice Concentration"].value
-    if mask_invalid:
-        data = np.ma.masked_invalid(data)
-    return lons, lats, data
+    # imported here, because amsr2 module depends on this one
+    import amsr2
+
+    return amsr2.get_amsr2(
+        dt,
+        store_dir=save_dir,
+        res=res,
+        mask_invalid=mask_invalid,
+        bbox=bbox,
+        crs=crs,
+    )
+
+
+def amsr2_coords_url(res="n6250"):
+    """URL of the file with AMSR2 grid coordinates"""
+    return f"{COORD_URL_BASE}/{res}/LongitudeLatitudeGrid-{res}-Arctic.hdf"
+
+
+def amsr2_data_url(dt, res="n6250"):
+    """URL of the AMSR2 sea ice concentration file for a given date"""
+    mon_str = f"{dt:%b}".lower()
+    return (
+        f"{AMSR2_URL_BASE}/{res}/{dt:%Y}/{mon_str}"
+        f"/Arctic/asi-AMSR2-{res}-{dt:%Y%m%d}-v5.hdf"
+    )
+
+
+def _h4toh5(target):
+    completed = sb.run(["h4toh5", target])
+    assert completed.returncode == 0, f"{completed.args} failed"
+    return target.with_suffix(".h5")
+
+
+def _get_amsr2_files(urls, save_dir=None, h5=True, workers=DOWNLOAD_WORKERS):
+    """Download the missing AMSR2 files in parallel and convert them to HDF5"""
+    targets = []
+    missing = []
+    for url in urls:
+        target = make_save_dir(Path(url).name, save_dir=save_dir)
+        if h5:
+            target = target.with_suffix(".h5")
+        targets.append(target)
+        if not target.is_file():
+            missing.append(url)
+    downloaded = download_many(missing, save_dir=save_dir, workers=workers)
+    if h5:
+        for target in downloaded:
+            _h4toh5(target)
+    return targets
 
 
 def get_amsr2_coords_file(save_dir=None, res="n6250", h5=True):
@@ -63,20 +131,7 @@ def get_amsr2_coords_file(save_dir=None, res="n6250", h5=True):
     -------
     Full Path to the file
     """
-    url = f"{COORD_URL_BASE}/{res}/LongitudeLatitudeGrid-{res}-Arctic.hdf"
-    if h5:
-        target = make_save_dir(Path(url).name, save_dir=save_dir).with_suffix(".h5")
-    else:
-        target = make_save_dir(Path(url).name, save_dir=save_dir)
-    if target.is_file():
-        return target
-    else:
-        target = download_file(url, save_dir=save_dir)
-        if h5:
-            completed = sb.run(["h4toh5", target])
-            assert completed.returncode == 0, f"{completed.args} failed"
-            target = target.with_suffix(".h5")
-    return target
+    return _get_amsr2_files([amsr2_coords_url(res)], save_dir=save_dir, h5=h5)[0]
 
 
 def get_amsr2_data_file(dt, save_dir=None, res="n6250", h5=True):
@@ -99,40 +154,45 @@ def get_amsr2_data_file(dt, save_dir=None, res="n6250", h5=True):
     -------
     Full Path to the file
     """
-    mon_str = f"{dt:%b}".lower()
-    url = (
-        f"{AMSR2_URL_BASE}/{res}/{dt:%Y}/{mon_str}"
-        f"/Arctic/asi-AMSR2-{res}-{dt:%Y%m%d}-v5.hdf"
-    )
-    if h5:
-        target = make_save_dir(Path(url).name, save_dir=save_dir).with_suffix(".h5")
-    else:
-        target = make_save_dir(Path(url).name, save_dir=save_dir)
-    if target.is_file():
-        return target
-    else:
-        target = download_file(url, save_dir=save_dir)
-        if h5:
-            completed = sb.run(["h4toh5", target])
-            assert completed.returncode == 0, f"{completed.args} failed"
-            target = target.with_suffix(".h5")
-    return target
+    return _get_amsr2_files([amsr2_data_url(dt, res=res)], save_dir=save_dir, h5=h5)[0]
 
 
+def get_amsr2_data_files(dts, save_dir=None, res="n6250", h5=True, workers=None):
+    """
+    Download AMSR2 sea ice data for several dates in one parallel job
+
+    Arguments
+    ---------
+    dts: sequence of datetime.datetime
+        Dates of the required sea ice data
+    save_dir: pathlib.Path, optional
+        Save destination
+    res: str, optional
+        Resolution ([n|s][2500|3125|6250|12500])
+    h5: bool, optional
+        Convert from HDF4 to HDF5 using h4toh5 command (should be installed!)
+    workers: int, optional
+        Maximum number of simultaneous downloads
+
+    Returns
+    -------
+    List of full Paths to the files (in the order of `dts`)
+    """
+    if workers is None:
+        workers = DOWNLOAD_WORKERS
+    urls = [amsr2_data_url(dt, res=res) for dt in dts]
+    return _get_amsr2_files(urls, save_dir=save_dir, h5=h5, workers=workers)
+
+
+@lru_cache(maxsize=1)
 def get_avail_sat_img_opt():
     with (mypaths.sample_dir / "satellite" / "sat_img_opt.json").open("r") as f:
         sat_img_opt = json.load(f)
     return sat_img_opt
 
 
-def sort_by_timedelta(x, other):
-    _x = datetime.strptime(
-        re.findall(r"_([0-9]{8}_[0-9]{6})_", str(x))[0], "%Y%m%d_%H%M%S"
-    )
-    return abs(_x - other).total_seconds()
-
-
-def get_nearest_zfile(zip_obj, dt, instrument, channel, platform, ext="tif"):
+def check_sat_opt(instrument, channel, platform):
+    """Check that the combination of satellite image options is available"""
     sat_img_opt = get_avail_sat_img_opt()
 
     opt = sat_img_opt[instrument]
@@ -144,60 +204,228 @@ def get_nearest_zfile(zip_obj, dt, instrument, channel, platform, ext="tif"):
         f"    channel    = {channel}\n"
         f"is not correct;\n\nAvailable:\n{sat_img_opt}"
     )
-    sat_opt = dict(instrument=instrument, **_d)
 
-    regex = re.compile(
-        r"^(?=.*_[0-9]{8}_[0-9]{6}_)"
-        + "".join([f"(?=.*{v})" for v in sat_opt.values()])
-        + ".+"
+
+def sat_opt_key(instrument, channel, platform):
+    """Key of the satellite image index for a given combination of options"""
+    return f"{instrument}/{platform}/{channel}"
+
+
+def parse_sat_timestamp(fname):
+    """Get the timestamp of a satellite image from its file name"""
+    match = SAT_TIMESTAMP_REGEX.search(str(fname))
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), SAT_TIMESTAMP_FMT)
+
+
+def build_sat_index(fnames):
+    """
+    Build an index of satellite images for all available combinations of
+    instrument, platform and channel (see `get_avail_sat_img_opt()`)
+
+    Arguments
+    ---------
+    fnames: sequence of str
+        File names, e.g. members of a Dundee day archive
+
+    Returns
+    -------
+    index: dict
+        Dictionary of `sat_opt_key()` -> (timestamps, file names),
+        both sorted by time
+    """
+    stamped = []
+    for fname in fnames:
+        timestamp = parse_sat_timestamp(fname)
+        if timestamp is not None:
+            stamped.append((timestamp, fname))
+    # stable sort by time only, so that names with equal timestamps
+    # keep their original order
+    stamped.sort(key=lambda x: x[0])
+
+    index = {}
+    for instrument, opts in get_avail_sat_img_opt().items():
+        for opt in opts:
+            # same as matching the name against all of the option values
+            values = (instrument, opt["channel"], opt["platform"])
+            selected = [
+                (timestamp, fname)
+                for timestamp, fname in stamped
+                if all(v in fname for v in values)
+            ]
+            index[sat_opt_key(instrument, **opt)] = (
+                [timestamp for timestamp, _ in selected],
+                [fname for _, fname in selected],
+            )
+    return index
+
+
+def _sat_index_to_json(index):
+    return {
+        key: [[f"{t:{SAT_TIMESTAMP_FMT}}" for t in times], fnames]
+        for key, (times, fnames) in index.items()
+    }
+
+
+def _sat_index_from_json(obj):
+    return {
+        key: ([datetime.strptime(t, SAT_TIMESTAMP_FMT) for t in times], fnames)
+        for key, (times, fnames) in obj.items()
+    }
+
+
+def _listdir_sat_source(source, ext):
+    """List image file names in a zip archive or a directory"""
+    if source.is_dir():
+        return sorted(i.name for i in source.rglob(f"*{ext}"))
+    with ZipFile(source) as z:
+        return [Path(i).name for i in z.namelist() if i.endswith(ext)]
+
+
+@traced("sat_index")
+def get_sat_index(source, ext="tif", cache_dir=None):
+    """
+    Get the index of satellite images stored in a day archive or a directory
+
+    The index is built once and then kept in memory and in a JSON file
+    in the cache directory. The cached index is rebuilt when the size or the
+    modification time of the source changes.
+
+    Arguments
+    ---------
+    source: str or pathlib.Path
+        Path to a Dundee `YYYYMMDD.zip` archive or to a directory with images
+    ext: str, optional
+        Extension of the image files
+    cache_dir: pathlib.Path, optional
+        Directory to store the index; defaults to `mypaths.cache_dir`
+
+    Returns
+    -------
+    index: dict
+        see `build_sat_index()`
+    """
+    source = Path(source).resolve()
+    stat = source.stat()
+    stamp = dict(
+        version=SAT_INDEX_VERSION,
+        source=str(source),
+        ext=ext,
+        mtime=stat.st_mtime_ns,
+        size=stat.st_size,
     )
-    fnames = [Path(i).name for i in zip_obj.namelist() if i.endswith(ext)]
-    filename = sorted(
-        filter(regex.match, fnames), key=lambda x: sort_by_timedelta(x, dt)
-    )[0]
+    mem_key = tuple(stamp.values())
+    if mem_key in _SAT_INDEX_CACHE:
+        return _SAT_INDEX_CACHE[mem_key]
+
+    if cache_dir is None:
+        cache_dir = mypaths.cache_dir
+    path_hash = hashlib.sha1(f"{source}:{ext}".encode()).hexdigest()[:12]
+    cache_file = cache_dir / "sat_index" / f"{source.stem}_{path_hash}.json"
+
+    index = None
+    if cache_file.is_file():
+        with cache_file.open("r") as f:
+            cached = json.load(f)
+        if cached.get("stamp") == stamp:
+            index = _sat_index_from_json(cached["index"])
+    if index is None:
+        index = build_sat_index(_listdir_sat_source(source, ext))
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with tmp_file.open("w") as f:
+            json.dump(dict(stamp=stamp, index=_sat_index_to_json(index)), f)
+        tmp_file.replace(cache_file)
+
+    _SAT_INDEX_CACHE[mem_key] = index
+    return index
+
+
+def nearest_in_sat_index(index, dt, instrument, channel, platform):
+    """
+    Find the image closest in time to `dt` using bisection
+
+    Returns
+    -------
+    fname: str
+        File name of the image
+    timestamp: datetime.datetime
+        Time of the image
+    """
+    check_sat_opt(instrument=instrument, channel=channel, platform=platform)
+    key = sat_opt_key(instrument=instrument, channel=channel, platform=platform)
+    times, fnames = index[key]
+    assert len(times) > 0, f"No images found for {key}"
+
+    i = bisect.bisect_left(times, dt)
+    candidates = [j for j in (i - 1, i) if 0 <= j < len(times)]
+    nearest = min(candidates, key=lambda j: abs(times[j] - dt))
+    return fnames[nearest], times[nearest]
+
+
+@traced("zip_lookup")
+def get_nearest_zfile(zip_obj, dt, instrument, channel, platform, ext="tif"):
+    """
+    Find the image in a Dundee day archive closest in time to `dt`
+
+    Arguments
+    ---------
+    zip_obj: zipfile.ZipFile or path-like
+        Opened archive or path to it (the latter avoids opening the archive
+        if its index is already cached)
+    dt: datetime.datetime
+        Target time
+    instrument, channel, platform: str
+        Satellite image options (see `get_avail_sat_img_opt()`)
+    ext: str, optional
+        Extension of the image files
+
+    Returns
+    -------
+    zfile: str
+        Name of the archive member
+    timestamp: datetime.datetime
+        Time of the image
+    """
+    if isinstance(zip_obj, ZipFile):
+        if zip_obj.filename is not None:
+            index = get_sat_index(zip_obj.filename, ext=ext)
+        else:
+            index = build_sat_index(
+                [Path(i).name for i in zip_obj.namelist() if i.endswith(ext)]
+            )
+    else:
+        index = get_sat_index(zip_obj, ext=ext)
 
-    timestamp = datetime.strptime(
-        re.findall(r"(_[0-9]{8}_[0-9]{6}_)", str(filename))[0], "_%Y%m%d_%H%M%S_"
+    filename, timestamp = nearest_in_sat_index(
+        index, dt, instrument=instrument, channel=channel, platform=platform
     )
     return f"{dt:%Y%m%d}/{filename}", timestamp
 
 
-def get_nearest_url(dt, instrument, channel, platform, project=PROJECT, ext="tif"):
-    sat_img_opt = get_avail_sat_img_opt()
+@lru_cache(maxsize=64)
+def _get_url_sat_index(url_dir, ext):
+    # imported here to avoid a circular import
+    import crawler
 
-    opt = sat_img_opt[instrument]
-    _d = dict(channel=channel, platform=platform)
-    assert _d in opt, (
-        "Combination\n"
-        f"    instrument = {instrument}\n"
-        f"    platform   = {platform}\n"
-        f"    channel    = {channel}\n"
-        f"is not correct;\n\nAvailable:\n{sat_img_opt}"
-    )
-    sat_opt = dict(instrument=instrument, **_d)
+    # the listing is cached on disk and refreshed with a conditional request
+    return build_sat_index(crawler.crawl([url_dir], ext=ext)[url_dir])
 
-    regex = re.compile(
-        r"^(?=.*_[0-9]{8}_[0-9]{6}_)"
-        + "".join([f"(?=.*{v})" for v in sat_opt.values()])
-        + ".+"
-    )
 
+def get_nearest_url(dt, instrument, channel, platform, project=PROJECT, ext="tif"):
     url_dir = DUNDEE_URL.format(project=project, dt=dt)
-    fnames = url_listdir(url_dir, ext="tif")
-    filename = sorted(
-        filter(regex.match, map(str, fnames)), key=lambda x: sort_by_timedelta(x, dt)
-    )[0]
-
-    timestamp = datetime.strptime(
-        re.findall(r"(_[0-9]{8}_[0-9]{6}_)", str(filename))[0], "_%Y%m%d_%H%M%S_"
+    index = _get_url_sat_index(url_dir, ext)
+    filename, timestamp = nearest_in_sat_index(
+        index, dt, instrument=instrument, channel=channel, platform=platform
     )
-
     return f"{url_dir}/{filename}", timestamp
 
 
 def url_listdir(url, ext, parser="html.parser"):
-    html = requests.get(url).text
-    soup = BeautifulSoup(html, parser)
+    resp = get_session().get(url, timeout=DOWNLOAD_TIMEOUT)
+    resp.raise_for_status()
+    soup = BeautifulSoup(resp.text, parser)
     return [
         Path(node.get("href"))
         for node in soup.find_all("a")
@@ -215,28 +443,193 @@ def make_save_dir(file_name, save_dir=None):
     return save_to
 
 
+@lru_cache(maxsize=None)
+def get_session(pool_size=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES):
+    """
+    Get a `requests.Session` with a connection pool of a given size
+
+    The session is created once per process and reused by all downloads.
+    Responses with "retryable" status codes (429, 5xx) are retried with
+    an exponential backoff. Failed connections are not retried here:
+    downloads retry them and resume where they stopped (see `_fetch()`).
+    """
+    retry = Retry(
+        total=retries,
+        connect=0,
+        read=0,
+        backoff_factor=DOWNLOAD_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _fetch(url, save_to, session, retries=DOWNLOAD_RETRIES, **req_kw):
+    """
+    Stream `url` to a temporary ".part" file and rename it to `save_to`
+
+    If the download is interrupted (or the connection fails), it is resumed
+    using an HTTP Range request starting from the size of the partially
+    downloaded file, at most `retries` times.
+    """
+    part = save_to.with_name(save_to.name + ".part")
+    headers = dict(req_kw.pop("headers", {}))
+    req_kw.setdefault("timeout", DOWNLOAD_TIMEOUT)
+    for attempt in range(retries + 1):
+        offset = part.stat().st_size if part.is_file() else 0
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+        else:
+            headers.pop("Range", None)
+        try:
+            with session.get(url, headers=headers, stream=True, **req_kw) as resp:
+                if resp.status_code == 416 and offset > 0:
+                    # The requested range is beyond the end of the file,
+                    # i.e. the partial file is actually complete
+                    break
+                resp.raise_for_status()
+                if resp.status_code != 206:
+                    # The server ignored the Range header: start from scratch
+                    offset = 0
+                with part.open("ab" if offset > 0 else "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                size = resp.headers.get("Content-Length")
+                if size is not None and part.stat().st_size < offset + int(size):
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Incomplete download of {url}"
+                    )
+            break
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout,
+        ):
+            if attempt == retries:
+                raise
+            time.sleep(DOWNLOAD_BACKOFF * 2**attempt)
+    part.replace(save_to)
+    return save_to
+
+
+@traced("download")
 def download_file(url, save_dir=None, overwrite=False, **req_kw):
     """
     Download file using requests if it doesn't exist or overwrite is True
+
+    The file is streamed to disk in chunks and only appears under its final
+    name when the download is complete. Raises `requests.HTTPError`
+    if the server responds with an error.
     """
     # save destination
     save_to = make_save_dir(Path(url).name, save_dir=save_dir)
 
     if not save_to.is_file() or overwrite:
-        # get request
-        img_req = requests.get(url, **req_kw)
-
-        if img_req.status_code == 200:
-            # open in binary mode
-            with save_to.open("wb") as file:
-                # write to file
-                file.write(img_req.content)
-        else:
-            print("Failed with {} ({})".format(img_req.status_code, img_req.reason))
+        _fetch(url, save_to, get_session(), **req_kw)
     return save_to
 
 
-def read_raster_stereo(filename):
+def download_many(urls, save_dir=None, workers=None, overwrite=False, **req_kw):
+    """
+    Download many files in parallel using a pool of HTTP connections
+
+    Arguments
+    ---------
+    urls: sequence of str
+        URLs of the files
+    save_dir: pathlib.Path or sequence of pathlib.Path, optional
+        Save destination (one for all files or one per file)
+    workers: int, optional
+        Maximum number of simultaneous downloads
+    overwrite: bool, optional
+        Download the files that already exist
+    req_kw: dict, optional
+        Keyword arguments passed to `requests.Session.get()`
+
+    Returns
+    -------
+    List of full Paths to the files (in the order of `urls`)
+    """
+    if workers is None:
+        workers = DOWNLOAD_WORKERS
+    if save_dir is None or isinstance(save_dir, Path):
+        save_dirs = [save_dir] * len(urls)
+    else:
+        save_dirs = list(save_dir)
+        assert len(save_dirs) == len(urls), "save_dir and urls lengths differ"
+    if len(urls) == 0:
+        return []
+
+    session = get_session(pool_size=max(workers, DOWNLOAD_WORKERS))
+    targets = [
+        make_save_dir(Path(url).name, save_dir=_dir)
+        for url, _dir in zip(urls, save_dirs)
+    ]
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_fetch, url, target, session, **req_kw): url
+            for url, target in zip(urls, targets)
+            if overwrite or not target.is_file()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+    if errors:
+        summary = "\n".join(f"    {url}: {e}" for url, e in errors.items())
+        raise RuntimeError(
+            f"{len(errors)} of {len(urls)} downloads failed:\n{summary}"
+        ) from next(iter(errors.values()))
+    return targets
+
+
+def zip_member_path(arch_file, member):
+    """
+    Path to a member of a zip archive in GDAL's virtual file system
+
+    Such paths can be opened by rasterio without extracting the file:
+    stored (uncompressed) members are read directly from the archive
+    and compressed ones are decompressed on the fly.
+    """
+    return f"/vsizip/{Path(arch_file).resolve()}/{member}"
+
+
+def stereo_crs(rio_crs):
+    """Convert the stereographic CRS of a Dundee GeoTIFF to a cartopy projection"""
+    proj = rio_crs.to_dict()
+    return ccrs.Stereographic(
+        central_latitude=proj["lat_0"],
+        central_longitude=proj["lon_0"],
+        false_easting=proj["x_0"],
+        false_northing=proj["y_0"],
+        true_scale_latitude=proj["lat_ts"],
+        globe=ccrs.Globe(datum=proj["datum"]),
+    )
+
+
+def transform_bbox(bbox, src_crs, dst_crs, npts=50):
+    """Bounding box (x0, x1, y0, y1) of a box transformed to another CRS"""
+    x0, x1, y0, y1 = bbox
+    xs = np.linspace(x0, x1, npts)
+    ys = np.linspace(y0, y1, npts)
+    xx = np.concatenate([xs, np.full(npts, x1), xs[::-1], np.full(npts, x0)])
+    yy = np.concatenate([np.full(npts, y0), ys, np.full(npts, y1), ys[::-1]])
+    xyz = dst_crs.transform_points(src_crs, xx, yy)
+    xyz = xyz[np.isfinite(xyz[:, :2]).all(axis=1)]
+    return xyz[:, 0].min(), xyz[:, 0].max(), xyz[:, 1].min(), xyz[:, 1].max()
+
+
+@traced("read_raster")
+def read_raster_stereo(filename, extent=None, extent_crs=None, stride=1, res=None):
     """
     Read the image and essential metadata from a GeoTIFF file
 
@@ -244,10 +637,23 @@ def read_raster_stereo(filename):
     from NERC Satellite Receiving Station, Dundee University, Scotland
     (http://www.sat.dundee.ac.uk/)
 
+    Only the part of the image within `extent` is read, at a resolution
+    reduced by `stride` or to `res` (GDAL uses overviews if the file has any).
+
     Parameters
     ----------
     filename: str or path-like
-        path to the GeoTIFF file
+        path to the GeoTIFF file, or to a member of a zip archive
+        (see `zip_member_path()`)
+    extent: sequence, optional
+        area (x0, x1, y0, y1) to read, in coordinates of `extent_crs`
+    extent_crs: cartopy.crs.CRS, optional
+        coordinate system of `extent`; defaults to `ccrs.PlateCarree()`
+    stride: int, optional
+        read every `stride`-th pixel (1 = full resolution)
+    res: float, optional
+        target pixel size in units of the image projection
+        (overrides `stride`)
 
     Returns
     -------
@@ -259,18 +665,44 @@ def read_raster_stereo(filename):
         Stereographic projection of the image
     """
     with rasterio.open(filename, "r") as src:
-        proj = src.crs.to_dict()
-        crs = ccrs.Stereographic(
-            central_latitude=proj["lat_0"],
-            central_longitude=proj["lon_0"],
-            false_easting=proj["x_0"],
-            false_northing=proj["y_0"],
-            true_scale_latitude=proj["lat_ts"],
-            globe=ccrs.Globe(datum=proj["datum"]),
-        )
+        crs = stereo_crs(src.crs)
+
+        # find the window of the image to read
+        full_window = Window(0, 0, src.width, src.height)
+        if extent is None:
+            window = full_window
+        else:
+            if extent_crs is None:
+                extent_crs = ccrs.PlateCarree()
+            x0, x1, y0, y1 = transform_bbox(extent, extent_crs, crs)
+            window = from_bounds(x0, y0, x1, y1, transform=src.transform)
+            # pad by one pixel, because the bounds are rounded outwards
+            window = (
+                Window(
+                    window.col_off - 1,
+                    window.row_off - 1,
+                    window.width + 2,
+                    window.height + 2,
+                )
+                .round_offsets(op="floor")
+                .round_lengths(op="ceil")
+            )
+            assert rasterio.windows.intersect(
+                window, full_window
+            ), f"{filename} does not intersect the extent {extent}"
+            window = window.intersection(full_window)
 
         # read image into ndarray
-        im = src.read().squeeze()
+        if res is not None:
+            stride = max(res / abs(src.transform[0]), 1)
+        out_shape = (
+            src.count,
+            max(int(np.ceil(window.height / stride)), 1),
+            max(int(np.ceil(window.width / stride)), 1),
+        )
+        im = src.read(
+            window=window, out_shape=out_shape, resampling=Resampling.nearest
+        ).squeeze()
 
         # calculate extent of raster
         # --------------------------
@@ -284,10 +716,11 @@ def read_raster_stereo(filename):
         #               d, e, f)
         # and a GDAL geotransform looks like:
         # (c, a, b, f, d, e)
-        xmin = src.transform[2]
-        xmax = src.transform[2] + src.transform[0] * src.width
-        ymin = src.transform[5] + src.transform[4] * src.height
-        ymax = src.transform[5]
+        transform = src.window_transform(window)
+        xmin = transform[2]
+        xmax = transform[2] + transform[0] * window.width
+        ymin = transform[5] + transform[4] * window.height
+        ymax = transform[5]
         extent = [xmin, xmax, ymin, ymax]
 
     return im, extent, crs
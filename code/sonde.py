@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to read and process radiosonde data
+
+EDT files (1 s resolution) start with a header of metadata,
+followed by a blank line, a row of column names and a row of units:
+
+    EDT
+        Sonde serial number                  	N4820389
+        Release point latitude               	67.890327°N
+        ...
+    <blank line>
+    Elapsed time	 TimeUTC	    P	 Temp	...
+               s	hh:mm:ss	  hPa	   °C	...
+               0	11:39:16	979.8	  0.0	...
+
+The files are written in Latin-1 (degree signs).
+"""
+import concurrent.futures
+from datetime import datetime
+import re
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import mypaths
+from cache import cached
+
+ENCODING = "latin-1"
+# Header entries: EDT name -> short name
+HEADER_KEYS = {
+    "Sonde serial number": "serial",
+    "Release point latitude": "lat",
+    "Release point longitude": "lon",
+    "Release point height from sea level": "height",
+    "Balloon release date": "release_date",
+    "Balloon release time": "release_time",
+    "Surface pressure": "surface_pressure",
+    "Surface temperature": "surface_temperature",
+    "Surface relative humidity": "surface_relative_humidity",
+    "Surface wind speed": "surface_wind_speed",
+    "Surface wind direction": "surface_wind_direction",
+}
+# Number and units of a header value, e.g. "979.8 hPa" or "67.890327°N"
+HEADER_VALUE_REGEX = re.compile(r"^(?P<value>[-+]?[0-9]*\.?[0-9]+)\s*(?P<units>.*)$")
+RELEASE_TIME_FMT = "%d/%m/%y %H:%M:%S"
+# Columns that are not read as float32
+TIME_COLUMN = "TimeUTC"
+FLOAT64_COLUMNS = ["Lat", "Lon"]
+
+# Physical constants
+RD = 287.04749  # gas constant of dry air [J kg-1 K-1]
+CP_D = 1004.6662  # specific heat of dry air at constant pressure [J kg-1 K-1]
+LV = 2.501e6  # latent heat of vaporization [J kg-1]
+EPS = 0.62195691  # ratio of molecular weights of water and dry air
+KAPPA = RD / CP_D
+T0C = 273.15  # [K]
+
+
+def edt_files(sonde_dir=None):
+    """Sorted list of EDT files in a directory"""
+    if sonde_dir is None:
+        sonde_dir = mypaths.sonde_dir
+    return sorted(sonde_dir.glob("edt_1s_*.txt"))
+
+
+def _parse_header(lines):
+    """Convert header lines to a dict of values and a dict of their units"""
+    raw = {}
+    for line in lines:
+        key, _, value = line.partition("\t")
+        raw[HEADER_KEYS.get(key.strip(), key.strip())] = value.strip()
+
+    header = {}
+    units = {}
+    for key, value in raw.items():
+        match = HEADER_VALUE_REGEX.match(value)
+        if key in ("serial", "release_date", "release_time") or match is None:
+            header[key] = value
+            continue
+        header[key] = float(match.group("value"))
+        units[key] = match.group("units")
+        if key in ("lat", "lon"):
+            # Coordinates have the hemisphere at the end, e.g. "°N"
+            if units[key].endswith(("S", "W")):
+                header[key] = -header[key]
+            units[key] = units[key].rstrip("NSEW")
+    if "release_date" in header and "release_time" in header:
+        release_time = datetime.strptime(
+            f"{header.pop('release_date')} {header['release_time']}",
+            RELEASE_TIME_FMT,
+        )
+        # ISO string, so that the header can be stored as metadata
+        header["release_time"] = release_time.isoformat()
+    return header, units
+
+
+@cached(version=2)
+def read_edt(fname):
+    """
+    Read a radiosonde profile from an EDT file
+
+    The header is parsed into metadata and the table is read in one pass,
+    with all the columns as float32 except for latitude and longitude
+    (float64). The time of each row is calculated from the release time.
+
+    Arguments
+    ---------
+    fname: pathlib.Path
+        Path to the file
+
+    Returns
+    -------
+    pandas.DataFrame
+        Profile data, with metadata in `attrs`:
+        header: dict of header values (with keys from `HEADER_KEYS`)
+        header_units: dict of units of the header values
+        units: dict of units of the columns
+    """
+    with open(fname, "r", encoding=ENCODING) as f:
+        header_lines = []
+        for line in f:
+            if line.strip() == "EDT":
+                continue
+            if line.strip() == "":
+                break
+            header_lines.append(line)
+        columns = [i.strip() for i in f.readline().split("\t")]
+        col_units = [i.strip() for i in f.readline().split("\t")]
+        dtype = {col: "f4" for col in columns}
+        dtype.update({col: "f8" for col in FLOAT64_COLUMNS if col in columns})
+        df = pd.read_csv(
+            f,
+            sep="\t",
+            header=None,
+            names=columns,
+            usecols=[col for col in columns if col != TIME_COLUMN],
+            dtype=dtype,
+        )
+
+    header, header_units = _parse_header(header_lines)
+    if "release_time" in header and "Elapsed time" in df:
+        df.insert(
+            0,
+            "time",
+            np.datetime64(header["release_time"], "ms")
+            + np.round(df["Elapsed time"].to_numpy() * 1e3).astype("m8[ms]"),
+        )
+    df.index.name = "level"
+    df.attrs = dict(
+        header=header,
+        header_units=header_units,
+        units={col: unit for col, unit in zip(columns, col_units) if col in df},
+    )
+    return df
+
+
+def to_dataset(profiles):
+    """
+    Combine radiosonde profiles into one dataset
+
+    Profiles are padded with NaN to the same number of levels.
+
+    Arguments
+    ---------
+    profiles: list of pandas.DataFrame
+        Output of `read_edt()`
+
+    Returns
+    -------
+    xarray.Dataset
+        Profile variables with dimensions (release_time, level)
+        and metadata from the headers as coordinates along release_time
+    """
+    nlev = max(len(df) for df in profiles)
+    release_times = np.array(
+        [df.attrs["header"]["release_time"] for df in profiles], dtype="M8[ns]"
+    )
+    order = np.argsort(release_times, kind="stable")
+    profiles = [profiles[i] for i in order]
+
+    data_vars = {}
+    for col in profiles[0].columns:
+        first = profiles[0][col].to_numpy()
+        fill = np.datetime64("NaT") if first.dtype.kind == "M" else np.nan
+        values = np.full((len(profiles), nlev), fill, dtype=first.dtype)
+        for i, df in enumerate(profiles):
+            values[i, : len(df)] = df[col].to_numpy()
+        attrs = {}
+        if col in profiles[0].attrs["units"]:
+            attrs["units"] = profiles[0].attrs["units"][col]
+        data_vars[col] = (("release_time", "level"), values, attrs)
+
+    coords = dict(release_time=release_times[order], level=np.arange(nlev))
+    header_units = profiles[0].attrs["header_units"]
+    for key in profiles[0].attrs["header"]:
+        if key == "release_time":
+            continue
+        values = np.array([df.attrs["header"].get(key) for df in profiles])
+        attrs = {"units": header_units[key]} if key in header_units else {}
+        coords[key] = ("release_time", values, attrs)
+    return xr.Dataset(data_vars, coords=coords)
+
+
+def load_soundings(fnames=None, sonde_dir=None, max_workers=None):
+    """
+    Read many EDT files in parallel into one dataset
+
+    Arguments
+    ---------
+    fnames: list of pathlib.Path, optional
+        Paths to the files; by default, all files in `sonde_dir`
+    sonde_dir: pathlib.Path, optional
+        Directory with the files; defaults to `mypaths.sonde_dir`
+    max_workers: int, optional
+        Number of worker processes (1 = read in this process);
+        defaults to the number of CPUs
+
+    Returns
+    -------
+    xarray.Dataset (see `to_dataset()`)
+    """
+    if fnames is None:
+        fnames = edt_files(sonde_dir=sonde_dir)
+    assert len(fnames) > 0, "No radiosonde files found"
+    if max_workers == 1 or len(fnames) == 1:
+        profiles = [read_edt(fname) for fname in fnames]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            profiles = list(executor.map(read_edt, fnames))
+    return to_dataset(profiles)
+
+
+def saturation_vapor_pressure(temperature):
+    """Saturation vapour pressure [hPa] over water at temperature [K] (Bolton, 1980)"""
+    tc = temperature - T0C
+    return 6.112 * np.exp(17.67 * tc / (tc + 243.5))
+
+
+def saturation_mixing_ratio(pressure, temperature):
+    """Saturation mixing ratio [kg kg-1] at pressure [hPa] and temperature [K]"""
+    e = saturation_vapor_pressure(temperature)
+    return EPS * e / (pressure - e)
+
+
+def lcl(pressure, temperature, dewpoint):
+    """
+    Lifting condensation level of parcels (Bolton, 1980, eq. 15)
+
+    Arguments
+    ---------
+    pressure, temperature, dewpoint: numpy arrays
+        Initial state of the parcels [hPa, K, K]
+
+    Returns
+    -------
+    lcl_pressure, lcl_temperature: numpy arrays
+        [hPa, K]
+    """
+    lcl_temperature = (
+        1 / (1 / (dewpoint - 56) + np.log(temperature / dewpoint) / 800) + 56
+    )
+    lcl_pressure = pressure * (lcl_temperature / temperature) ** (1 / KAPPA)
+    return lcl_pressure, lcl_temperature
+
+
+def _moist_lapse_rate(pressure, temperature):
+    """Saturated adiabatic lapse rate dT/dp [K hPa-1]"""
+    rs = saturation_mixing_ratio(pressure, temperature)
+    return (RD * temperature + LV * rs) / (
+        pressure * (CP_D + LV**2 * rs * EPS / (RD * temperature**2))
+    )
+
+
+def _moist_step(p0, t0, p1):
+    """Integrate the moist lapse rate from p0 to p1 (2nd order Runge-Kutta)"""
+    dp = p1 - p0
+    t_mid = t0 + 0.5 * dp * _moist_lapse_rate(p0, t0)
+    return t0 + dp * _moist_lapse_rate(p0 + 0.5 * dp, t_mid)
+
+
+def parcel_profile(pressure, temperature, dewpoint):
+    """
+    Temperature of parcels lifted from the first level of profiles
+
+    Parcels are lifted dry-adiabatically to the LCL and moist-adiabatically
+    above it. All profiles are processed at once, level by level.
+
+    Arguments
+    ---------
+    pressure: numpy array
+        Pressure [hPa] of shape (profile, level); NaN for missing levels
+    temperature, dewpoint: numpy arrays
+        Initial temperature and dew point [K] of shape (profile,)
+
+    Returns
+    -------
+    parcel: numpy array
+        Parcel temperature [K] of shape (profile, level)
+    lcl_pressure, lcl_temperature: numpy arrays
+        [hPa, K] of shape (profile,)
+    """
+    p0 = pressure[:, 0]
+    lcl_p, lcl_t = lcl(p0, temperature, dewpoint)
+    parcel = np.full(pressure.shape, np.nan)
+    # Dry adiabat below the LCL
+    dry = pressure >= lcl_p[:, None]
+    parcel[dry] = (temperature[:, None] * (pressure / p0[:, None]) ** KAPPA)[dry]
+
+    # Moist adiabat above the LCL, starting from the LCL
+    p_prev, t_prev = lcl_p.copy(), lcl_t.copy()
+    for k in range(pressure.shape[1]):
+        p = pressure[:, k]
+        moist = (p < lcl_p) & ~np.isnan(p)
+        if not moist.any():
+            continue
+        t = _moist_step(p_prev[moist], t_prev[moist], p[moist])
+        parcel[moist, k] = t
+        p_prev[moist], t_prev[moist] = p[moist], t
+    return parcel, lcl_p, lcl_t
+
+
+def virtual_temperature(temperature, mixing_ratio):
+    """Virtual temperature [K] from temperature [K] and mixing ratio [kg kg-1]"""
+    return temperature * (mixing_ratio + EPS) / (EPS * (1 + mixing_ratio))
+
+
+def _compact(valid, *arrays):
+    """Move the valid levels of profiles to the front (NaN after them)"""
+    order = np.argsort(~valid, axis=1, kind="stable")
+    valid = np.take_along_axis(valid, order, axis=1)
+    return [
+        np.where(valid, np.take_along_axis(a, order, axis=1), np.nan) for a in arrays
+    ]
+
+
+def _zero_crossings(log_p, y):
+    """
+    Pressure where y changes sign between levels (interpolated in log-pressure)
+
+    Returns
+    -------
+    pressure, direction: numpy arrays of shape (profile, level - 1)
+        NaN and 0 where y does not change sign, direction is 1 where y
+        becomes positive and -1 where it becomes negative (upwards)
+    """
+    y0, y1 = y[:, :-1], y[:, 1:]
+    crossed = (np.sign(y0) != np.sign(y1)) & ~np.isnan(y0) & ~np.isnan(y1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        log_x = (y1 * log_p[:, :-1] - y0 * log_p[:, 1:]) / (y1 - y0)
+    return np.where(crossed, np.exp(log_x), np.nan), np.where(crossed, np.sign(y1), 0)
+
+
+def _less_or_close(a, b):
+    return (a < b) | np.isclose(a, b)
+
+
+def _greater_or_close(a, b):
+    return (a > b) | np.isclose(a, b)
+
+
+def cape_cin(pressure, temperature, dewpoint, parcel):
+    """
+    Convective available potential energy and convective inhibition
+
+    Same as `metpy.calc.cape_cin()` (with the default bottom LFC and top EL)
+    for many profiles at once: the difference of the virtual temperatures
+    of the parcel and of the environment is integrated over log-pressure,
+    with the points where it changes sign interpolated in log-pressure.
+    CAPE is integrated between the level of free convection (LFC,
+    the lowest level above the LCL where the parcel becomes warmer than
+    the environment) and the equilibrium level (EL, the highest level
+    where it becomes colder, or the top of the profile), CIN below the LFC.
+
+    Arguments
+    ---------
+    pressure: numpy array
+        Pressure [hPa] of shape (profile, level); NaN for missing levels
+    temperature, dewpoint, parcel: numpy arrays
+        Environment temperature and dew point and parcel temperature [K]
+        of shape (profile, level)
+
+    Returns
+    -------
+    cape, cin: numpy arrays
+        [J kg-1] of shape (profile,); CIN is negative or zero
+    """
+    valid = ~(
+        np.isnan(pressure)
+        | np.isnan(temperature)
+        | np.isnan(dewpoint)
+        | np.isnan(parcel)
+    )
+    p, temp, dewp, parcel = _compact(valid, pressure, temperature, dewpoint, parcel)
+    nprof, nlev = p.shape
+    rows = np.arange(nprof)
+    last = np.maximum(valid.sum(axis=1) - 1, 0)
+    p0, dewp0 = p[:, 0], dewp[:, 0]
+
+    # Virtual temperatures; the parcel keeps its initial mixing ratio below
+    # the LCL and is saturated above it
+    lcl_p, _ = lcl(p0, temp[:, 0], dewp0)
+    parcel_w = np.where(
+        p > lcl_p[:, None],
+        saturation_mixing_ratio(p0, dewp0)[:, None],
+        saturation_mixing_ratio(p, parcel),
+    )
+    tv_env = virtual_temperature(temp, saturation_mixing_ratio(p, dewp))
+    tv_parcel = virtual_temperature(parcel, parcel_w)
+    y = tv_parcel - tv_env
+    log_p = np.log(p)
+    x, direction = _zero_crossings(log_p, y)
+    layer = np.arange(nlev - 1)
+
+    # LFC (like MetPy, the LCL of the parcel virtual temperature is used;
+    # the first layer is skipped if the profiles start at the same point)
+    lfc_lcl, _ = lcl(p0, tv_parcel[:, 0], dewp0)
+    start = np.where(np.isclose(tv_parcel[:, 0], tv_env[:, 0]), 1, 0)
+    rising = (direction > 0) & (layer >= start[:, None])
+    rising_above = rising & (x < lfc_lcl[:, None])
+    falling = (direction < 0) & (layer >= 1)
+    # no crossing: the LFC is the LCL if the parcel is warmer somewhere above it
+    warmer_above = (
+        ~_less_or_close(tv_parcel, tv_env) & (p < lfc_lcl[:, None]) & ~np.isnan(p)
+    ).any(axis=1)
+    # crossings below the LCL only: the LFC is the LCL unless the EL is below it
+    el_below = falling.any(axis=1) & (
+        np.where(falling, x, np.inf).min(axis=1) > lfc_lcl
+    )
+    has_lfc = np.where(
+        rising_above.any(axis=1),
+        True,
+        np.where(rising.any(axis=1), ~el_below, warmer_above),
+    )
+    lfc = np.where(
+        rising_above.any(axis=1), x[rows, rising_above.argmax(axis=1)], lfc_lcl
+    )
+
+    # EL (the LCL of the environment virtual temperature, like MetPy);
+    # the top of the profile if the parcel is warmer there
+    el_lcl, _ = lcl(p0, tv_env[:, 0], dewp0)
+    top_falling = x[rows, nlev - 2 - falling[:, ::-1].argmax(axis=1)]
+    has_el = (
+        (tv_parcel[rows, last] <= tv_env[rows, last])
+        & falling.any(axis=1)
+        & (top_falling < el_lcl)
+    )
+    el = np.where(has_el, top_falling, p[rows, last])
+
+    # Levels and crossings (above the first layer, like MetPy) in one profile
+    points = np.full((nprof, 2 * nlev - 1), np.nan)
+    values = np.full((nprof, 2 * nlev - 1), np.nan)
+    points[:, ::2], values[:, ::2] = p, y
+    points[:, 1::2] = np.where(layer >= 1, x, np.nan)
+    values[:, 1::2] = np.where(np.isnan(points[:, 1::2]), np.nan, 0)
+    points, values = _compact(~np.isnan(points), points, values)
+
+    # Trapezoidal rule between the points within the limits
+    log_x = np.log(points)
+    area = 0.5 * (values[:, 1:] + values[:, :-1]) * (log_x[:, :-1] - log_x[:, 1:])
+    in_cape = _less_or_close(points, lfc[:, None]) & _greater_or_close(
+        points, el[:, None]
+    )
+    in_cin = _greater_or_close(points, lfc[:, None])
+    cape = RD * np.where(in_cape[:, 1:] & in_cape[:, :-1], area, 0).sum(axis=1)
+    cin = RD * np.where(in_cin[:, 1:] & in_cin[:, :-1], area, 0).sum(axis=1)
+    cape = np.where(has_lfc, cape, 0)
+    cin = np.where(has_lfc, np.minimum(cin, 0), 0)
+    return cape, cin
+
+
+def add_parcel_diagnostics(ds, ptop=None):
+    """
+    Add surface parcel temperature, LCL, CAPE and CIN to a dataset of soundings
+
+    Arguments
+    ---------
+    ds: xarray.Dataset
+        Output of `load_soundings()`
+    ptop: float, optional
+        Pressure [hPa] above which the profiles are not used
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    p = ds["P"].values.astype("f8")
+    if ptop is not None:
+        p = np.where(p > ptop, p, np.nan)
+    temp = ds["Temp"].values.astype("f8") + T0C
+    dewp = ds["Dewp"].values.astype("f8") + T0C
+
+    parcel, lcl_p, lcl_t = parcel_profile(p, temp[:, 0], dewp[:, 0])
+    cape, cin = cape_cin(p, temp, dewp, parcel)
+
+    dims = ("release_time", "level")
+    return ds.assign(
+        parcel_temperature=(dims, (parcel - T0C).astype("f4"), {"units": "°C"}),
+        lcl_pressure=(dims[:1], lcl_p.astype("f4"), {"units": "hPa"}),
+        lcl_temperature=(dims[:1], (lcl_t - T0C).astype("f4"), {"units": "°C"}),
+        cape=(dims[:1], cape.astype("f4"), {"units": "J kg-1"}),
+        cin=(dims[:1], cin.astype("f4"), {"units": "J kg-1"}),
+    )
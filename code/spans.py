@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight timing and memory instrumentation
+
+A span is a named stage of work, e.g. reading a raster or saving a figure:
+
+    with spans.span("savefig", task=name):
+        fig.savefig(...)
+
+    @spans.traced("read_raster")
+    def read_raster_stereo(...):
+        ...
+
+For each span, the wall time, the number of bytes read by the process
+(Linux only), its current and maximum resident set size are recorded.
+Spans can be nested; nested spans inherit the fields (e.g. the task name)
+of the enclosing ones and their names are joined into a path,
+e.g. "figure/sat_image/read_raster".
+
+If `log_file` is set (see `configure()`), records are appended to it
+as JSON lines through a file handle kept open. The last `keep_records`
+records are also kept in memory for `summary()` (none by default, so
+long runs do not accumulate them). A span costs a few microseconds,
+so instrumentation can be left on in batch runs.
+"""
+from collections import deque
+import cProfile
+from contextlib import contextmanager
+import contextvars
+from datetime import datetime, timezone
+from functools import wraps
+import json
+import os
+from pathlib import Path
+import resource
+import sys
+import time
+
+# Record spans (if False, spans do nothing)
+enabled = True
+# JSON lines file with the records (None = no log file)
+log_file = None
+# Identifier of the run, added to the records
+run_id = None
+# Number of the last records of this process kept in memory
+keep_records = 0
+# Number of records kept in memory when a summary is needed
+SUMMARY_RECORDS = 100_000
+# Records of this process
+_records = deque(maxlen=keep_records)
+# Open log file: (path, unbuffered binary file)
+_log = None
+# Path and fields of the current span
+_current = contextvars.ContextVar("span", default=("", {}))
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def configure(log=None, run=None, enable=True, keep=0):
+    """
+    Set up the recording of spans (e.g. in worker processes)
+
+    Arguments
+    ---------
+    log: str or path-like, optional
+        JSON lines file to append the records to
+    run: str, optional
+        Identifier of the run; defaults to the current UTC time
+    enable: bool, optional
+        Record spans
+    keep: int, optional
+        Number of the last records to keep in memory for `summary()`
+    """
+    global enabled, log_file, run_id, keep_records, _records
+    enabled = enable
+    log_file = None if log is None else Path(log)
+    run_id = run or f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}"
+    keep_records = keep
+    _records = deque(_records, maxlen=keep)
+    _close_log()
+    if log_file is not None:
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+
+
+def _close_log():
+    global _log
+    if _log is not None:
+        _log[1].close()
+        _log = None
+
+
+def read_bytes():
+    """Number of bytes read by this process so far (None if unknown)"""
+    try:
+        with open("/proc/self/io", "rb") as f:
+            for line in f:
+                if line.startswith(b"rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb():
+    """Current resident set size of this process [MiB] (None if unknown)"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2**20
+    except OSError:
+        return None
+
+
+def max_rss_mb():
+    """Maximum resident set size of this process so far [MiB]"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def _emit(record):
+    global _log
+    if keep_records:
+        _records.append(record)
+    if log_file is not None:
+        if _log is None or _log[0] != log_file:
+            _close_log()
+            _log = (log_file, open(log_file, "ab", buffering=0))
+        # one write per record to a file in append mode,
+        # so that processes can share the file
+        _log[1].write((json.dumps(record, default=str) + "\n").encode())
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Record the duration and memory usage of a block of code
+
+    Arguments
+    ---------
+    name: str
+        Name of the stage
+    fields: dict, optional
+        Additional fields of the record (inherited by nested spans)
+    """
+    if not enabled:
+        yield
+        return
+    parent_path, parent_fields = _current.get()
+    path = f"{parent_path}/{name}" if parent_path else name
+    fields = {**parent_fields, **fields}
+    token = _current.set((path, fields))
+    start = datetime.now(timezone.utc)
+    bytes0 = read_bytes()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - t0
+        bytes1 = read_bytes()
+        _current.reset(token)
+        _emit(
+            dict(
+                name=name,
+                path=path,
+                **fields,
+                start=f"{start:%Y-%m-%dT%H:%M:%S.%fZ}",
+                duration=duration,
+                read_bytes=None if bytes0 is None else bytes1 - bytes0,
+                rss_mb=rss_mb(),
+                max_rss_mb=max_rss_mb(),
+                pid=os.getpid(),
+                run=run_id,
+                error=error,
+            )
+        )
+
+
+def traced(name=None):
+    """Decorator recording each call of a function as a span (see `span()`)"""
+
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def read_log(fname, run=None):
+    """Read records from a JSON lines file, optionally of one run only"""
+    records = []
+    with open(fname, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            if run is None or record.get("run") == run:
+                records.append(record)
+    return records
+
+
+def summary(records=None):
+    """
+    Print a table of the spans grouped by their paths
+
+    Arguments
+    ---------
+    records: list of dict, optional
+        Records of spans; defaults to the records of this process kept
+        in memory (see `configure()`)
+    """
+    if records is None:
+        records = _records
+    groups = {}
+    for record in records:
+        groups.setdefault(record["path"], []).append(record)
+    print(
+        f"{'span':<48} {'count':>6} {'total, s':>9} {'mean, s':>8} {'max, s':>8}"
+        f" {'read, MiB':>10} {'max RSS':>8}"
+    )
+    for path in sorted(groups):
+        group = groups[path]
+        durations = [record["duration"] for record in group]
+        nbytes = sum(record["read_bytes"] or 0 for record in group)
+        print(
+            f"{path:<48} {len(group):6d} {sum(durations):9.3f}"
+            f" {sum(durations) / len(group):8.3f} {max(durations):8.3f}"
+            f" {nbytes / 2**20:10.1f}"
+            f" {max(record['max_rss_mb'] for record in group):8.1f}"
+        )
+
+
+@contextmanager
+def profiled(fname):
+    """
+    Profile a block of code with cProfile and save the statistics
+
+    The file can be inspected with `pstats` or turned into a flame graph,
+    e.g. by `flameprof` or `snakeviz`.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        Path(fname).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(fname)
+        print(f"Saved profile to {fname}")
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the buoy data store, with downloads from a local FTP server
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import buoy
+
+HEAD = "Buoy 31505, test data\ntime;windSpeed;windDirection;airTemperature\n"
+
+
+def rows(start, n):
+    """Lines of buoy data every 10 minutes from row `start`"""
+    times = pd.date_range("2018-03-01", periods=start + n, freq="10min")[start:]
+    return "".join(
+        f"{t:%d.%m.%Y %H:%M:%S};{i % 7 + 0.5};{i * 37 % 360};{-i / 10}\n"
+        for i, t in zip(range(start, start + n), times)
+    )
+
+
+@pytest.fixture
+def server(tmp_path):
+    """FTP server of a directory, recording the REST offsets"""
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("pyftpdlib")
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import FTPServer
+
+    remote_dir = tmp_path / "remote"
+    remote_dir.mkdir()
+    offsets = []
+
+    class Handler(FTPHandler):
+        def ftp_REST(self, line):
+            offsets.append(int(line))
+            return super().ftp_REST(line)
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(remote_dir))
+    Handler.authorizer = authorizer
+    ftpd = FTPServer(("127.0.0.1", 0), Handler)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            ftpd.serve_forever(timeout=0.05, blocking=False)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield dict(
+        remote_file=remote_dir / buoy.BUOY_FILE,
+        offsets=offsets,
+        fetch_kw=dict(host="127.0.0.1", port=ftpd.address[1], buoy_dir=tmp_path),
+    )
+    stop.set()
+    thread.join()
+    ftpd.close_all()
+
+
+def expected(text, tmp_path):
+    fname = tmp_path / "expected.csv"
+    fname.write_text(text)
+    return buoy.read_buoy(fname, use_cache=False)
+
+
+def test_update(server, tmp_path):
+    cache_dir = tmp_path / "cache"
+    remote_file = server["remote_file"]
+    local_file = buoy.buoy_file(tmp_path)
+    text = HEAD + rows(0, 20)
+    remote_file.write_text(text)
+    df = buoy.update(server["fetch_kw"], cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(df, expected(text, tmp_path))
+    assert server["offsets"] == []
+
+    # REST: only the new bytes are downloaded
+    size = len(text)
+    text += rows(20, 10)
+    remote_file.write_text(text)
+    assert buoy.fetch(**server["fetch_kw"]) == len(text) - size
+    assert server["offsets"] == [size]
+    assert local_file.read_text() == text
+    assert buoy.ingest(local_file, cache_dir=cache_dir) == 10
+
+    # nothing new: no download and no new part
+    mtime = local_file.stat().st_mtime_ns
+    assert buoy.fetch(**server["fetch_kw"]) == 0
+    assert local_file.stat().st_mtime_ns == mtime
+    assert buoy.ingest(local_file, cache_dir=cache_dir) == 0
+    store = buoy.store_dir(local_file, cache_dir=cache_dir)
+    assert len(list(store.glob("part_*.feather"))) == 2
+    pd.testing.assert_frame_equal(
+        buoy.read_store(local_file, cache_dir=cache_dir), expected(text, tmp_path)
+    )
+
+    # replaced (smaller) file: downloaded again and the store rebuilt
+    text = HEAD + rows(100, 5)
+    remote_file.write_text(text)
+    df = buoy.update(server["fetch_kw"], cache_dir=cache_dir)
+    assert server["offsets"] == [size]
+    assert local_file.read_text() == text
+    pd.testing.assert_frame_equal(df, expected(text, tmp_path))
+    assert len(list(store.glob("part_*.feather"))) == 1
+
+
+def test_update_merge(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(buoy, "MAX_PARTS", 3)
+    cache_dir = tmp_path / "cache"
+    local_file = buoy.buoy_file(tmp_path)
+    store = buoy.store_dir(local_file, cache_dir=cache_dir)
+    text = HEAD
+    for i in range(5):
+        text += rows(i * 4, 4)
+        server["remote_file"].write_text(text)
+        df = buoy.update(server["fetch_kw"], cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(df, expected(text, tmp_path))
+        n_parts = len(list(store.glob("part_*.feather")))
+        # the 4th part is merged with the others
+        assert n_parts == [1, 2, 3, 1, 2][i]
+    assert len(server["offsets"]) == 4
+
+
+def test_resample_directions():
+    df = pd.DataFrame(
+        dict(windSpeed=[2.0, 2.0, 1.0, 3.0], windDirection=[350.0, 10.0, 90.0, 270.0]),
+        index=pd.to_datetime(
+            ["2018-03-01 00:00", "2018-03-01 00:30", "2018-03-01 01:00"]
+            + ["2018-03-01 01:30"]
+        ),
+    )
+    hourly = buoy.resample(df, "1h")
+    # vector means, weighted by the speed, in [0, 360)
+    np.testing.assert_allclose(hourly["windDirection"], [0.0, 270.0])
+    np.testing.assert_allclose(hourly["windSpeed"], [2.0, 2.0])
+    assert (hourly["windDirection"] < 360).all()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the directory crawler against a local HTTP server
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+
+import crawler
+import sat_tools
+
+LAST_MODIFIED = "Thu, 01 Mar 2018 12:00:00 GMT"
+# Fake directory indexes: path -> (ETag, file names)
+INDEXES = {
+    "/20180301/": ('"a1"', ["a.tif", "b.tif", "notes.txt"]),
+    "/20180302/": ('"b1"', ["c.tif"]),
+}
+
+
+def index_page(names):
+    links = "\n".join(f'<a href="{name}">{name}</a>' for name in names)
+    return (
+        '<html><body><a href="?C=N;O=D">Name</a>\n<a href="../">Parent</a>\n'
+        f'<a href="sub/">sub/</a>\n<a href="sub/d.tif">d.tif</a>\n{links}\n'
+        "</body></html>"
+    )
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serve `INDEXES` with ETag and Last-Modified headers (404 otherwise)"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(
+            (
+                self.path,
+                self.headers.get("If-None-Match"),
+                self.headers.get("If-Modified-Since"),
+            )
+        )
+        if self.path not in server.indexes:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag, names = server.indexes[self.path]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = index_page(names).encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    httpd.indexes = dict(INDEXES)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(params=["aiohttp", "threaded"])
+def client(request, monkeypatch):
+    if request.param == "aiohttp":
+        pytest.importorskip("aiohttp")
+    else:
+        monkeypatch.setattr(crawler, "aiohttp", None)
+        # a new session (not the one cached for the process)
+        session = sat_tools.get_session.__wrapped__()
+        monkeypatch.setattr(sat_tools, "get_session", lambda: session)
+    return request.param
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_parse_hrefs():
+    html = index_page(["a.tif", "b%20c.tif", "a.tif"]) + '<a href="/x/e.tif">'
+    assert crawler.parse_hrefs(html, "tif") == ["a.tif", "b c.tif"]
+    assert crawler.parse_hrefs('<a href="..tif">') == []
+
+
+def test_crawl(server, client, tmp_path):
+    urls = [url(server, path) for path in ["/20180301/", "/20180302/", "/20180303/"]]
+    # 200: new listings
+    listing = crawler.crawl(urls, cache_dir=tmp_path)
+    assert listing == {urls[0]: ["a.tif", "b.tif"], urls[1]: ["c.tif"], urls[2]: []}
+    assert sorted(server.requests) == [
+        ("/20180301/", None, None),
+        ("/20180302/", None, None),
+        ("/20180303/", None, None),
+    ]
+    cached = crawler.load_listing_cache(tmp_path)
+    assert cached[urls[0]]["etag"] == '"a1"'
+    assert cached[urls[0]]["last_modified"] == LAST_MODIFIED
+    # 404 is not cached
+    assert urls[2] not in cached
+
+    # 304: the validators are sent back and the cached listings are used
+    server.requests.clear()
+    server.indexes["/20180302/"] = ('"b2"', ["c.tif", "e.tif"])
+    assert crawler.crawl(urls, cache_dir=tmp_path) == {
+        urls[0]: ["a.tif", "b.tif"],
+        urls[1]: ["c.tif", "e.tif"],
+        urls[2]: [],
+    }
+    assert sorted(server.requests) == [
+        ("/20180301/", '"a1"', LAST_MODIFIED),
+        ("/20180302/", '"b1"', LAST_MODIFIED),
+        ("/20180303/", None, None),
+    ]
+    assert crawler.load_listing_cache(tmp_path)[urls[1]]["etag"] == '"b2"'
+
+    # 404 of a listed directory drops it from the cache
+    del server.indexes["/20180301/"]
+    assert crawler.crawl(urls[:1], cache_dir=tmp_path) == {urls[0]: []}
+    assert urls[0] not in crawler.load_listing_cache(tmp_path)
+
+
+def test_crawl_cache_version(server, client, tmp_path):
+    urls = [url(server, "/20180301/")]
+    crawler.crawl(urls, cache_dir=tmp_path)
+    cache_file = crawler.listing_cache_file(tmp_path)
+    cached = json.loads(cache_file.read_text())
+    cached["version"] = crawler.LISTING_CACHE_VERSION - 1
+    cache_file.write_text(json.dumps(cached))
+    assert crawler.load_listing_cache(tmp_path) == {}
+
+    # a cache of another version is not used: no conditional requests
+    server.requests.clear()
+    assert crawler.crawl(urls, cache_dir=tmp_path) == {urls[0]: ["a.tif", "b.tif"]}
+    assert server.requests == [("/20180301/", None, None)]
+    assert json.loads(cache_file.read_text())["version"] == (
+        crawler.LISTING_CACHE_VERSION
+    )
+
+
+def test_crawl_error(server, client, tmp_path):
+    urls = [url(server, "/20180301/"), "http://127.0.0.1:1/"]
+    with pytest.raises(RuntimeError, match="Failed to list 1 directories"):
+        crawler.crawl(urls, cache_dir=tmp_path)
+    # the successful listings are still cached
+    assert list(crawler.load_listing_cache(tmp_path)) == urls[:1]
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Smoke tests of the drawing of the flight track figures
+"""
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+pytest.importorskip("arke")
+import flight_track_over_sat_image as ftsi  # noqa: E402
+
+
+def synthetic_track():
+    n = 50
+    return dict(
+        lon=np.linspace(-20, -15, n),
+        lat=np.linspace(67, 70, n),
+        alt=np.linspace(50, 1800, n),
+        units=dict(alt="m"),
+    )
+
+
+def synthetic_sic():
+    lons, lats = np.meshgrid(np.linspace(-30, -10, 40), np.linspace(64, 74, 30))
+    # ice concentration increasing to the north-west
+    data = np.clip((lats - 66) * 20 - (lons + 20) * 5, 0, 100)
+    return lons, lats, data
+
+
+def test_draw_base_map():
+    import matplotlib.pyplot as plt
+
+    cfg = ftsi.make_config(sea_ice="amsr2")
+    fig = plt.figure(figsize=(6, 4))
+    ax, anno = ftsi._draw_base_map(cfg, fig, synthetic_track(), synthetic_sic())
+    fig.canvas.draw()
+    assert ax.collections
+    plt.close(fig)
+
+
+def test_draw_sat_image_mosaic(tmp_path, monkeypatch):
+    import matplotlib.pyplot as plt
+    from rasterio.windows import Window
+
+    import mosaic
+
+    cfg = ftsi.make_config(sea_ice=None, mosaic="scene", dpi=50)
+    # a scene in the left half of two tiles within the map, empty elsewhere
+    size = mosaic.TILE_SIZE
+    window = mosaic.grid_window(ftsi._map_bbox(cfg))
+    window = Window(window.col_off + size, window.row_off + size, 2 * size, size)
+    data = np.zeros((size, 2 * size), dtype="u1")
+    data[:, : size // 2] = 200
+    fname = mosaic._write(tmp_path / "scene.tif", data, window, dict(TEST="1"))
+    monkeypatch.setattr(ftsi, "_get_mosaic", lambda cfg, task: fname)
+    fig = plt.figure(figsize=(6, 4))
+    ax = fig.add_subplot(projection=ftsi._igp_proj())
+    img = ftsi._draw_sat_image(cfg, ax, dict())
+    im = img.get_array()
+    # empty pixels are masked (transparent), not drawn black
+    assert np.ma.getmaskarray(im).any()
+    assert (im.compressed() == 200).all()
+    plt.close(fig)
+
+
+def test_mosaic_extent():
+    assert ftsi.make_config(sea_ice=None)["mosaic"] == "scene"
+    # maps larger than the grid of the reprojected images regrid them
+    cfg = ftsi.make_config(sea_ice=None, extent=[-45, 0, 58, 80])
+    assert cfg["mosaic"] is None
+
+
+def test_watch_retry(tmp_path, monkeypatch):
+    from datetime import datetime
+
+    import watcher
+
+    input_file = tmp_path / "20180301.zip"
+    input_file.write_bytes(b"data")
+    cfg = ftsi.make_config(
+        dict(mosaic=None, sequence=False),
+        sea_ice=None,
+        output_dir=tmp_path,
+        flights=["293"],
+    )
+    task = dict(
+        flight_id="293",
+        sat_opt=dict(instrument="avhrr", platform="noaa19", channel="band2_vis"),
+        tstamp=datetime(2018, 3, 1, 12),
+        output=tmp_path / "figure.png",
+    )
+    # one change, then polls without changes
+    monkeypatch.setattr(
+        watcher, "poll", lambda *args, **kwargs: iter([{str(input_file)}, set()])
+    )
+    monkeypatch.setattr(ftsi, "make_tasks", lambda cfg: [dict(task)])
+    monkeypatch.setattr(ftsi, "_watch_inputs", lambda cfg, task: [input_file])
+    calls = []
+
+    def run_plan(cfg, plan, keep_raw=False):
+        calls.append([t["output"] for *_, seq in plan["jobs"] for t in seq])
+        if len(calls) == 1:
+            raise RuntimeError("sea ice data not available yet")
+        task["output"].write_bytes(b"png")
+        return {}
+
+    monkeypatch.setattr(ftsi, "run_plan", run_plan)
+    ftsi.watch(cfg, interval=0)
+    # the failed figure is tried again after the next poll
+    assert calls == [[task["output"]], [task["output"]]]
+    manifest = watcher.load_manifest(tmp_path / "watch_manifest.json")
+    assert watcher.is_current(manifest, task["output"], [input_file])
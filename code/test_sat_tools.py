@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the downloads of `sat_tools` against a local HTTP server
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+import requests
+
+import sat_tools
+
+CONTENT = bytes(range(256)) * 1000
+CHUNK_SIZE = 4000
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serve `CONTENT` with Range support
+
+    The path selects the behaviour: "/file" answers normally, "/cut" sends
+    only the first half of the (full) body on the first request,
+    "/dead" closes the connection without answering and "/busy" answers
+    503 on the first request.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("Range")))
+        count = sum(path == self.path for path, _ in server.requests)
+        if self.path == "/dead":
+            self.close_connection = True
+            return
+        if self.path == "/busy" and count == 1:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start = 0
+        rng = self.headers.get("Range")
+        if rng is not None:
+            start = int(rng.split("=")[1].rstrip("-"))
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}"
+            )
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.path == "/cut" and count == 1:
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(sat_tools, "DOWNLOAD_BACKOFF", 0)
+    # small chunks, so that a part of a cut response is saved
+    monkeypatch.setattr(sat_tools, "DOWNLOAD_CHUNK_SIZE", CHUNK_SIZE)
+    # a new session (not the one cached for the process)
+    return sat_tools.get_session.__wrapped__(retries=2)
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_fetch(server, session, tmp_path):
+    save_to = tmp_path / "file"
+    sat_tools._fetch(url(server, "/file"), save_to, session)
+    assert save_to.read_bytes() == CONTENT
+    assert not (tmp_path / "file.part").exists()
+    assert server.requests == [("/file", None)]
+
+
+def test_fetch_resume(server, session, tmp_path):
+    save_to = tmp_path / "cut"
+    sat_tools._fetch(url(server, "/cut"), save_to, session)
+    assert save_to.read_bytes() == CONTENT
+    assert not (tmp_path / "cut.part").exists()
+    # the second request starts after the saved chunks
+    offset = len(CONTENT) // 2 // CHUNK_SIZE * CHUNK_SIZE
+    assert server.requests == [("/cut", None), ("/cut", f"bytes={offset}-")]
+
+
+def test_fetch_complete_part(server, session, tmp_path):
+    save_to = tmp_path / "file"
+    (tmp_path / "file.part").write_bytes(CONTENT)
+    sat_tools._fetch(url(server, "/file"), save_to, session)
+    # 416: the partial file was complete
+    assert save_to.read_bytes() == CONTENT
+    assert server.requests == [("/file", f"bytes={len(CONTENT)}-")]
+
+
+def test_fetch_status_retry(server, session, tmp_path):
+    save_to = tmp_path / "busy"
+    sat_tools._fetch(url(server, "/busy"), save_to, session)
+    assert save_to.read_bytes() == CONTENT
+    assert [path for path, _ in server.requests] == ["/busy", "/busy"]
+
+
+def test_fetch_dead_host(server, session, tmp_path):
+    save_to = tmp_path / "dead"
+    with pytest.raises(requests.exceptions.ConnectionError):
+        sat_tools._fetch(url(server, "/dead"), save_to, session, retries=2)
+    # one layer of retries: the first attempt and 2 retries
+    assert len(server.requests) == 3
+    assert not save_to.exists()
+
+
+def test_download_many(server, tmp_path):
+    fnames = sat_tools.download_many(
+        [url(server, "/file"), url(server, "/cut")], save_dir=tmp_path, workers=2
+    )
+    assert [fname.name for fname in fnames] == ["file", "cut"]
+    assert all(fname.read_bytes() == CONTENT for fname in fnames)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the batched parcel diagnostics against MetPy
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import sonde
+
+mpcalc = pytest.importorskip("metpy.calc")
+units = pytest.importorskip("metpy.units").units
+
+SONDE_DIR = Path(__file__).absolute().parents[1] / "data" / "radiosonde"
+# Differences come from the saturation vapour pressure formulas
+# (Bolton in `sonde`, Ambaum in MetPy)
+RTOL = 5e-3
+ATOL = 0.1  # J kg-1
+
+# Sounding of the `metpy.calc.cape_cin()` example
+PRESSURE = np.array(
+    [1008, 1000, 950, 900, 850, 800, 750, 700, 650, 600, 550, 500, 450, 400, 350]
+    + [300, 250, 200, 175, 150, 125, 100, 80, 70, 60, 50, 40, 30, 25, 20],
+    dtype="f8",
+)
+TEMPERATURE = np.array(
+    [29.3, 28.1, 23.5, 20.9, 18.4, 15.9, 13.1, 10.1, 6.7, 3.1, -0.5, -4.5, -9.0]
+    + [-14.8, -21.5, -29.7, -40.0, -52.4, -59.2, -66.5, -74.1, -78.5, -76.0]
+    + [-71.6, -66.7, -61.3, -56.3, -51.7, -50.7, -47.5]
+)
+RH = np.array(
+    [0.85, 0.65, 0.36, 0.39, 0.82, 0.72, 0.75, 0.86, 0.65, 0.22, 0.52, 0.66, 0.64]
+    + [0.20, 0.05, 0.75, 0.76, 0.45, 0.25, 0.48, 0.76, 0.88, 0.56, 0.88, 0.39]
+    + [0.67, 0.15, 0.04, 0.94, 0.35]
+)
+
+
+def metpy_cape_cin(pressure, temperature, dewpoint, parcel):
+    """CAPE and CIN of each profile by MetPy (with the same parcel profiles)"""
+    result = []
+    for p, t, td, tp in zip(pressure, temperature, dewpoint, parcel):
+        ok = ~(np.isnan(p) | np.isnan(t) | np.isnan(td) | np.isnan(tp))
+        cape, cin = mpcalc.cape_cin(
+            p[ok] * units.hPa, t[ok] * units.K, td[ok] * units.K, tp[ok] * units.K
+        )
+        result.append((cape.m_as("J/kg"), cin.m_as("J/kg")))
+    return np.array(result).T
+
+
+@pytest.mark.parametrize("ptop", [None, 300])
+def test_cape_cin_sample(ptop):
+    profiles = [
+        sonde.read_edt(fname, use_cache=False)
+        for fname in sorted(SONDE_DIR.glob("edt_1s_*.txt"))
+    ]
+    ds = sonde.add_parcel_diagnostics(sonde.to_dataset(profiles), ptop=ptop)
+    p = ds["P"].values.astype("f8")
+    if ptop is not None:
+        p = np.where(p > ptop, p, np.nan)
+    expected = metpy_cape_cin(
+        p,
+        ds["Temp"].values.astype("f8") + sonde.T0C,
+        ds["Dewp"].values.astype("f8") + sonde.T0C,
+        ds["parcel_temperature"].values.astype("f8") + sonde.T0C,
+    )
+    np.testing.assert_allclose(
+        [ds["cape"].values, ds["cin"].values], expected, rtol=RTOL, atol=ATOL
+    )
+
+
+def test_cape_cin_profiles():
+    dewpoint = mpcalc.dewpoint_from_relative_humidity(
+        TEMPERATURE * units.degC, RH
+    ).m_as("degC")
+    # an inversion above the surface (CIN), a colder profile, a deep warm
+    # layer (CAPE below the LCL only) and a stable profile (no LFC)
+    inversion = np.where((PRESSURE <= 950) & (PRESSURE >= 800), 8.0, 0.0)
+    cases = [
+        (TEMPERATURE, dewpoint),
+        (TEMPERATURE + inversion, dewpoint),
+        (TEMPERATURE - 5, dewpoint - 5),
+        (TEMPERATURE + 12 * (PRESSURE < 900), dewpoint),
+        (TEMPERATURE + 30 * (PRESSURE < 1000), dewpoint),
+    ]
+    pressure = np.tile(PRESSURE, (len(cases), 1))
+    # missing levels
+    pressure[2, -3:] = np.nan
+    pressure[3, 5] = np.nan
+    temperature = np.array([t for t, _ in cases]) + sonde.T0C
+    dewpoint = np.array([td for _, td in cases]) + sonde.T0C
+    parcel, _, _ = sonde.parcel_profile(pressure, temperature[:, 0], dewpoint[:, 0])
+
+    cape, cin = sonde.cape_cin(pressure, temperature, dewpoint, parcel)
+    expected = metpy_cape_cin(pressure, temperature, dewpoint, parcel)
+    np.testing.assert_allclose([cape, cin], expected, rtol=RTOL, atol=ATOL)
+    assert cin[1] < -100
+    assert cape[4] == cin[4] == 0
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Polling of input directories and a manifest of inputs and outputs
+
+Directories are polled with `os.scandir()`, which only reads the directory
+entries and file attributes, so polling an idle directory costs next to
+nothing. A file is reported once its size and modification time are
+the same in two consecutive polls, so files that are still being copied
+are not picked up (see `poll()`).
+
+The manifest is a small JSON file keeping the content hash of each input
+file and, for each output, the hashes of the inputs it was made from:
+
+    {
+        "version": 1,
+        "files": {path: [size, mtime_ns, hash]},
+        "outputs": {output path: {input path: hash}}
+    }
+
+Files are hashed again only when their size or modification time change,
+and an output is up to date if its inputs have the recorded contents
+(see `is_current()`), so touching a file or copying it again does not
+lead to new outputs.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+
+# Bump the version if the structure of the manifest changes
+MANIFEST_VERSION = 1
+# Size of the blocks read when hashing files [bytes]
+HASH_BLOCK_SIZE = 2**20
+
+
+def file_hash(fname):
+    """Hash of the content of a file"""
+    h = hashlib.blake2b(digest_size=20)
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def snapshot(dirs, patterns=("*",), exclude=()):
+    """
+    Size and modification time of the files in directories (recursively)
+
+    Arguments
+    ---------
+    dirs: sequence of pathlib.Path
+        Directories (missing ones are skipped)
+    patterns: sequence of str, optional
+        Shell-style patterns of the file names
+    exclude: sequence of path-like, optional
+        Files to skip (e.g. outputs written into a watched directory)
+
+    Returns
+    -------
+    dict
+        Path (str) -> (size, mtime_ns)
+    """
+    exclude = {str(i) for i in exclude}
+    files = {}
+    stack = [str(i) for i in dirs]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                stack.append(entry.path)
+            elif (
+                entry.is_file()
+                and entry.path not in exclude
+                and any(fnmatch.fnmatch(entry.name, p) for p in patterns)
+            ):
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def new_manifest():
+    return dict(version=MANIFEST_VERSION, files={}, outputs={})
+
+
+def load_manifest(fname):
+    """Read a manifest (a new one if the file does not exist)"""
+    fname = Path(fname)
+    if not fname.is_file():
+        return new_manifest()
+    with fname.open("r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return new_manifest()
+    return manifest
+
+
+def save_manifest(manifest, fname):
+    """Write a manifest (atomically)"""
+    fname = Path(fname)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = fname.with_suffix(f".{os.getpid()}.tmp")
+    with tmp_file.open("w") as f:
+        json.dump(manifest, f, indent=1)
+    tmp_file.replace(fname)
+
+
+def update_hashes(manifest, files, skip=()):
+    """
+    Update the manifest with the current state of the input files
+
+    Arguments
+    ---------
+    manifest: dict
+        See the module docstring
+    files: dict
+        Output of `snapshot()`
+    skip: set of str, optional
+        Paths of files to leave as they are in the manifest
+
+    Returns
+    -------
+    set of str
+        Paths of new, changed (by content) and removed files
+    """
+    known = manifest["files"]
+    changed = {path for path in known if path not in files and path not in skip}
+    for path in changed:
+        del known[path]
+    for path, (size, mtime_ns) in files.items():
+        entry = known.get(path)
+        if path in skip or (entry is not None and entry[:2] == [size, mtime_ns]):
+            continue
+        try:
+            digest = file_hash(path)
+        except FileNotFoundError:
+            continue
+        if entry is None or entry[2] != digest:
+            changed.add(path)
+        known[path] = [size, mtime_ns, digest]
+    return changed
+
+
+def add_files(manifest, paths):
+    """
+    Hash given files into the manifest (e.g. files written by this program,
+    so that the next poll does not report them as changed)
+    """
+    known = manifest["files"]
+    for path in map(str, paths):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entry = known.get(path)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            known[path] = [stat.st_size, stat.st_mtime_ns, file_hash(path)]
+
+
+def input_hashes(manifest, inputs):
+    """Recorded hashes of input files (None for unknown files)"""
+    return {str(i): manifest["files"].get(str(i), [None] * 3)[2] for i in inputs}
+
+
+def is_current(manifest, output, inputs):
+    """Check if an output exists and was made from the current inputs"""
+    return Path(output).is_file() and manifest["outputs"].get(
+        str(output)
+    ) == input_hashes(manifest, inputs)
+
+
+def record(manifest, output, inputs):
+    """Record the inputs an output was made from"""
+    manifest["outputs"][str(output)] = input_hashes(manifest, inputs)
+
+
+def poll(dirs, manifest, interval=10, patterns=("*",), exclude=(), idle=False):
+    """
+    Wait for changes of the files in directories
+
+    Yields the changes of the first poll at once (e.g. files added while
+    not watching), then sleeps between polls and yields only when some
+    files have changed and settled (or, if `idle` is True, after every poll).
+
+    Arguments
+    ---------
+    dirs: sequence of pathlib.Path
+        Directories to watch
+    manifest: dict
+        Manifest with the hashes of the files (updated in place)
+    interval: float, optional
+        Time between polls [s]
+    patterns, exclude: optional
+        See `snapshot()`
+    idle: bool, optional
+        Also yield an empty set after polls without changes
+        (e.g. to retry failed work)
+
+    Yields
+    ------
+    set of str
+        Paths of new, changed (by content) and removed files
+    """
+    previous = snapshot(dirs, patterns=patterns, exclude=exclude)
+    yield update_hashes(manifest, previous)
+    while True:
+        time.sleep(interval)
+        current = snapshot(dirs, patterns=patterns, exclude=exclude)
+        # files still being written wait for the next poll
+        unsettled = {
+            path for path, state in current.items() if previous.get(path) != state
+        }
+        previous = current
+        known = manifest["files"]
+        changed = set()
+        if any(path not in current for path in known) or any(
+            known.get(path, [None, None])[:2] != list(state)
+            for path, state in current.items()
+            if path not in unsettled
+        ):
+            changed = update_hashes(manifest, current, skip=unsettled)
+        if changed or idle:
+            yield changed
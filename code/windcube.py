@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to read Windcube wind lidar data
+
+Statistics files (.sta.7z, LZMA-compressed) are decompressed as a stream
+and read in chunks of rows, keeping only the wind speed and direction
+at each height as float32 arrays. The result is a compact dataset
+with dimensions (time, height) and wind components u and v.
+"""
+import concurrent.futures
+import lzma
+import re
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import mypaths
+from cache import cached
+
+# Daily statistics files, compressed with 7z (LZMA)
+STA_FILE_MASK = "WLS866-14_{date:%Y_%m_%d__%H_%M_%S}.sta.7z"
+# Number of header lines before the column names
+STA_HEADER = 40
+# Number of rows read at once
+CHUNK_SIZE = 10000
+# Columns of wind speed and direction at each height, e.g. "100m Wind Speed (m/s)"
+WSPD_REGEX = re.compile(r"(?P<height>[0-9]{2,3})m Wind Speed \(m/s\)")
+# (units of direction are a degree sign, in whatever encoding)
+WDIR_REGEX = re.compile(r"(?P<height>[0-9]{2,3})m Wind Direction \([^)]*\)")
+# Variable name -> column regex
+WIND_VARS = dict(wind_speed=WSPD_REGEX, wind_direction=WDIR_REGEX)
+
+
+def sta_file(date, data_dir=None):
+    """Path to the Windcube statistics file of a given day"""
+    if data_dir is None:
+        data_dir = mypaths.windcube_dir
+    return data_dir / STA_FILE_MASK.format(date=date)
+
+
+def wind_columns(columns, regex):
+    """Select wind columns by a regex and map them to heights [m]"""
+    heights = {}
+    for col in columns:
+        match = regex.match(col)
+        if match is not None:
+            heights[col] = int(match.group("height"))
+    return heights
+
+
+@cached(version=2)
+def read_sta(fname, chunk_size=CHUNK_SIZE):
+    """
+    Read wind speed and direction from a Windcube statistics file
+
+    The file is decompressed and parsed in chunks of `chunk_size` rows,
+    and only the wind columns are kept.
+
+    Arguments
+    ---------
+    fname: pathlib.Path
+        Path to the .sta.7z file
+    chunk_size: int, optional
+        Number of rows read at once
+
+    Returns
+    -------
+    tables: dict
+        Variable name (see `WIND_VARS`) -> pandas.DataFrame of float32
+        indexed by time, with heights [m] as column names
+    """
+    chunks = {name: [] for name in WIND_VARS}
+    with lzma.open(fname, "rb") as zf:
+        reader = pd.read_csv(
+            zf,  # uncompressed file buffer
+            header=STA_HEADER,  # skip the file header
+            delimiter="\t",  # tab as delimiter
+            encoding="latin-1",  # never fails, only wind columns are used
+            index_col=0,  # the first column is date-time
+            chunksize=chunk_size,
+        )
+        for df in reader:
+            index = pd.to_datetime(df.index).rename("time")
+            for name, regex in WIND_VARS.items():
+                heights = wind_columns(df.columns, regex)
+                chunks[name].append(
+                    pd.DataFrame(
+                        df[list(heights)].to_numpy(dtype="f4"),
+                        index=index,
+                        # column names have to be strings to be cached
+                        columns=[str(i) for i in heights.values()],
+                    )
+                )
+    return {name: pd.concat(dfs) for name, dfs in chunks.items()}
+
+
+def wind_components(speed, direction):
+    """
+    Calculate wind components from wind speed and meteorological direction
+
+    Arguments
+    ---------
+    speed: numpy array
+        Wind speed
+    direction: numpy array
+        Direction the wind is blowing from [degrees]
+
+    Returns
+    -------
+    u, v: numpy arrays
+    """
+    rad = np.deg2rad(direction)
+    return -speed * np.sin(rad), -speed * np.cos(rad)
+
+
+def wind_speed_direction(u, v):
+    """Calculate wind speed and meteorological direction [degrees] from components"""
+    speed = np.hypot(u, v)
+    direction = np.rad2deg(np.arctan2(-u, -v)) % 360
+    return speed, direction
+
+
+def to_dataset(tables):
+    """
+    Convert the output of `read_sta()` to a dataset
+
+    Returns
+    -------
+    xarray.Dataset
+        wind_speed, wind_direction, u and v (float32) with dimensions
+        (time, height)
+    """
+    wspd, wdir = tables["wind_speed"], tables["wind_direction"]
+    heights = np.array([int(i) for i in wspd.columns])
+    assert list(wspd.columns) == list(wdir.columns), "Mismatch of heights"
+    speed = wspd.to_numpy(dtype="f4")
+    direction = wdir.to_numpy(dtype="f4")
+    u, v = wind_components(speed, direction)
+    dims = ("time", "height")
+    return xr.Dataset(
+        dict(
+            wind_speed=(dims, speed, {"units": "m s-1"}),
+            wind_direction=(dims, direction, {"units": "degrees"}),
+            u=(dims, u, {"units": "m s-1"}),
+            v=(dims, v, {"units": "m s-1"}),
+        ),
+        coords=dict(
+            time=wspd.index.to_numpy(), height=("height", heights, {"units": "m"})
+        ),
+    )
+
+
+def load_sta(fname, **kwargs):
+    """Read a Windcube statistics file into a dataset (see `read_sta()`)"""
+    return to_dataset(read_sta(fname, **kwargs))
+
+
+def load_sta_files(fnames, max_workers=None):
+    """
+    Read several Windcube statistics files into one dataset
+
+    Files are decompressed and parsed in parallel processes
+    (or read from the cache), and the days are concatenated only once.
+
+    Arguments
+    ---------
+    fnames: list of pathlib.Path
+        Paths to the files
+    max_workers: int, optional
+        Number of worker processes (1 = read in this process);
+        defaults to the number of CPUs
+
+    Returns
+    -------
+    xarray.Dataset (see `to_dataset()`)
+    """
+    if max_workers == 1 or len(fnames) == 1:
+        days = [load_sta(fname) for fname in fnames]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            days = list(executor.map(load_sta, fnames))
+    ds = xr.concat(days, dim="time", join="outer")
+    return ds.sortby("time")
+
+
+def decimate(ds, freq=None, height_stride=1):
+    """
+    Reduce the number of points, e.g. for wind barbs or hodographs
+
+    Wind components are averaged over time intervals,
+    and wind speed and direction are calculated from the averages.
+
+    Arguments
+    ---------
+    ds: xarray.Dataset
+        Output of `load_sta()` or `load_sta_files()`
+    freq: str, optional
+        Length of the time intervals, e.g. "1h"; by default, no averaging
+    height_stride: int, optional
+        Use every `height_stride`-th height
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    ds = ds[["u", "v"]].isel(height=slice(None, None, height_stride))
+    if freq is not None:
+        ds = ds.resample(time=freq).mean()
+    speed, direction = wind_speed_direction(ds["u"].values, ds["v"].values)
+    ds["wind_speed"] = (("time", "height"), speed, {"units": "m s-1"})
+    ds["wind_direction"] = (("time", "height"), direction, {"units": "degrees"})
+    # drop the times without any data
+    return ds.isel(time=np.isfinite(ds["u"].values).any(axis=1))